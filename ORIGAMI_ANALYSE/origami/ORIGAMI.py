@@ -18,10 +18,12 @@
 # __author__ lukasz.g.migas
 
 import warnings
+from collections import OrderedDict
 from copy import deepcopy
 
 # Import libraries
 import gc
+import multiprocessing
 import numpy as np
 import os
 import pandas as pd
@@ -59,12 +61,17 @@ from icons import IconContainer as icons
 from document import document as documents
 from help import OrigamiHelp as help
 import readers.io_waters_raw as io_waters
+import readers.io_extraction as io_extraction
+import readers.io_scan_cube as io_scan_cube
+import readers.io_scan_index as io_scan_index
 import readers.io_text_files as io_text
 import readers.io_document as io_document
 import processing.spectra as pr_spectra
 import processing.heatmap as pr_heatmap
 import processing.origami_ms as pr_origami
 import processing.activation as pr_activation
+import processing.pipeline as pr_pipeline
+import processing.utils as pr_utils
 from toolbox import *
 import dialogs as dialogs
 from dialogs import (panelSelectDocument, panelCalibrantDB, panelHTMLViewer, 
@@ -109,9 +116,13 @@ class ORIGAMI(object):
         self.icons = icons()
         self.docs = documents()
         self.help = help()
+        self.scan_indexes = {}
 
         # Load configuration file
         self.onImportConfig(evt=None, onStart=True)
+        pr_spectra.set_resampling_cache_size(self.config.ms_resampling_cache_size)
+        pr_pipeline.set_stage_cache_size(self.config.process_cache_size)
+        pr_utils.set_processing_precision(self.config.processing_precision)
         
         # Setup variables
         self.makeVariables() 
@@ -141,6 +152,9 @@ class ORIGAMI(object):
             os.makedirs(temp_data_folder)
         self.config.temporary_data = temp_data_folder
         
+        # Set UniDec results cache path (not cleared with temporary data)
+        self.config.unidec_cache_path = os.path.join(os.getcwd(), "unidec_cache")
+        
 
         # Setup plot style
         self.view.panelPlots.onChangePlotStyle(evt=None)
@@ -153,6 +167,11 @@ class ORIGAMI(object):
         # add data processing module
         self.data_processing = self.view.data_processing
         
+        # periodically save documents that were already saved by the user
+        self.autosave_timer = wx.Timer(self.view)
+        self.view.Bind(wx.EVT_TIMER, self.on_autosave_documents, self.autosave_timer)
+        self.autosave_timer.Start(int(self.config.autoSaveDocumentsInterval * 1000))
+        
         # Load protein/CCS database
         if self.config.loadCCSAtStart:
             self.onImportCCSDatabase(evt=None, onStart=True)
@@ -408,18 +427,14 @@ class ORIGAMI(object):
             kwargs = {'auto_range':self.config.ms_auto_range,
                       'mz_min':xlimits[0], 'mz_max':xlimits[1],
                       'linearization_mode':self.config.ms_linearization_mode}
-            msDict = io_waters.rawMassLynx_MS_bin(filename=str(dlg.GetPath()), 
-                                                  function=1, 
-                                                  binData=self.config.import_binOnImport, 
-                                                  mzStart=self.config.ms_mzStart, 
-                                                  mzEnd=self.config.ms_mzEnd, 
-                                                  binsize=self.config.ms_mzBinSize,
-                                                  **kwargs)
-             
-            # Sum MS data
-            msX, msY = pr_spectra.sum_1D_dictionary(ydict=msDict)
-            # Sum MS to get RT data
-            rtX, rtY = pr_spectra.sum_spectrum_to_chromatogram(ydict=msDict)
+            msX, msY, rtY = io_waters.rawMassLynx_MS_bin_array(filename=str(dlg.GetPath()), 
+                                                               function=1, 
+                                                               binData=self.config.import_binOnImport, 
+                                                               mzStart=self.config.ms_mzStart, 
+                                                               mzEnd=self.config.ms_mzEnd, 
+                                                               binsize=self.config.ms_mzBinSize,
+                                                               sum_only=True, **kwargs)
+            rtX = np.arange(1, len(rtY)+1)
              
             # Add data to document 
             __, idName = os.path.split(dlg.GetPath())
@@ -657,11 +672,9 @@ class ORIGAMI(object):
     
         # Update statusbar
         self.onThreading(None, ("Loaded {}".format(path), 4), action='updateStatusbar')
+        engine = self.get_extraction_engine(path)
         try:
-            extract_kwargs = {'return_data':True}
-            msDataX, msDataY = io_waters.rawMassLynx_MS_extract(path=path,
-                                                                driftscope_path=self.config.driftscopePath, 
-                                                                **extract_kwargs)
+            msDataX, msDataY = engine.extract_ms()
             self.onThreading(None, ("Extracted mass spectrum", 4), action='updateStatusbar')
         except IOError:
             # Failed to open document because it does not have IM-MS data
@@ -671,41 +684,27 @@ class ORIGAMI(object):
             kwargs = {'auto_range':self.config.ms_auto_range,
                       'mz_min':xlimits[0], 'mz_max':xlimits[1],
                       'linearization_mode':self.config.ms_linearization_mode}
-            msDict = io_waters.rawMassLynx_MS_bin(filename=str(path), 
-                                                  function=1, 
-                                                  binData=self.config.import_binOnImport, 
-                                                  mzStart=self.config.ms_mzStart, 
-                                                  mzEnd=self.config.ms_mzEnd, 
-                                                  binsize=self.config.ms_mzBinSize,
-                                                  **kwargs)
-             
-            # Sum MS data
-            msDataX, msDataY = pr_spectra.sum_1D_dictionary(ydict=msDict)
-            
-            # Sum MS to get RT data
-            rtDataY, rtDataYnorm = pr_spectra.sum_spectrum_to_chromatogram(ydict=msDict)
+            msDataX, msDataY, rtDataY = io_waters.rawMassLynx_MS_bin_array(filename=str(path), 
+                                                                            function=1, 
+                                                                            binData=self.config.import_binOnImport, 
+                                                                            mzStart=self.config.ms_mzStart, 
+                                                                            mzEnd=self.config.ms_mzEnd, 
+                                                                            binsize=self.config.ms_mzBinSize,
+                                                                            sum_only=True, **kwargs)
+            rtDataYnorm = pr_spectra.normalize_1D(inputData=rtDataY)
             xvalsRT = np.arange(1,len(rtDataY)+1)
         
         if dataType != 'Type: MS':
             # RT
-            extract_kwargs = {'return_data':True, 'normalize':True}
-            xvalsRT, rtDataY, rtDataYnorm = io_waters.rawMassLynx_RT_extract(path=path,
-                                                                             driftscope_path=self.config.driftscopePath, 
-                                                                             **extract_kwargs)
+            xvalsRT, rtDataY, rtDataYnorm = engine.extract_rt(normalize=True)
             self.onThreading(None, ("Extracted chromatogram", 4), action='updateStatusbar')
             
             # DT
-            extract_kwargs = {'return_data':True}
-            xvalsDT, imsData1D = io_waters.rawMassLynx_DT_extract(path=path,
-                                                                  driftscope_path=self.config.driftscopePath, 
-                                                                  **extract_kwargs)
+            xvalsDT, imsData1D = engine.extract_dt()
             self.onThreading(None, ("Extracted mobiligram", 4), action='updateStatusbar')
             
             # 2D
-            extract_kwargs = {'return_data':True}
-            imsData2D = io_waters.rawMassLynx_2DT_extract(path=path,
-                                                          driftscope_path=self.config.driftscopePath, 
-                                                          **extract_kwargs)
+            imsData2D = engine.extract_rtdt()
             xlabels = 1+np.arange(len(imsData2D[1,:]))
             ylabels = 1+np.arange(len(imsData2D[:,1]))
             self.onThreading(None, ("Extracted heatmap", 4), action='updateStatusbar')
@@ -715,13 +714,9 @@ class ORIGAMI(object):
                 # m/z spacing, default is 1 Da
                 nPoints = int((parameters['endMS'] - parameters['startMS'])/self.config.ms_dtmsBinSize)
                 # Extract and load data
-                extract_kwargs = {'return_data':True}
-                imsDataMZDT = io_waters.rawMassLynx_MZDT_extract(path=path,
-                                                                 driftscope_path=self.config.driftscopePath, 
-                                                                 mz_start=parameters['startMS'],
-                                                                 mz_end=parameters['endMS'],
-                                                                 mz_nPoints=nPoints,
-                                                                 **extract_kwargs)
+                imsDataMZDT = engine.extract_mzdt(mz_start=parameters['startMS'],
+                                                  mz_end=parameters['endMS'],
+                                                  mz_nPoints=nPoints)
                 # Get x/y axis 
                 xlabelsMZDT = np.linspace(parameters['startMS']-self.config.ms_dtmsBinSize,
                                           parameters['endMS']+self.config.ms_dtmsBinSize, 
@@ -1442,6 +1437,7 @@ class ORIGAMI(object):
         
         # self.config.extractMode = 'multipleIons'
         tempList = self.view.panelMultipleIons.peaklist # shortcut
+        engines, batch = {}, {}
         for row in range(tempList.GetItemCount()):
             # Extract ion name
             itemInfo = self.view.panelMultipleIons.OnGetItemInformation(itemID=row)
@@ -1496,14 +1492,20 @@ class ORIGAMI(object):
                 
             msg = "Extracted: {}/{}".format((row+1), tempList.GetItemCount())
 
+            if document.dataType == 'Type: ORIGAMI' and self.config.extraction_batch_ions:
+                # ions are extracted together after all rows were checked
+                batch.setdefault(path, []).append([row, itemInfo, document, rangeName, 
+                                                   mzStart, mzEnd, label, charge])
+                continue
+            
             if document.dataType == 'Type: ORIGAMI':
+                # engine is reused for all ions of the same file
+                if path not in engines:
+                    engines[path] = self.get_extraction_engine(path)
+                engine = engines[path]
                 # 1D     
                 try:
-                    extract_kwargs = {'return_data':True}
-                    __, imsData1D = io_waters.rawMassLynx_DT_extract(path=path,
-                                                                     driftscope_path=self.config.driftscopePath, 
-                                                                     mz_start=mzStart, mz_end=mzEnd,
-                                                                     **extract_kwargs)
+                    __, imsData1D = engine.extract_dt(mz_start=mzStart, mz_end=mzEnd)
                 except IOError:
                     msg = "Failed to open the file - most likely because this file no longer exists or has been moved.\n" + \
                           "You can change the document path by right-clicking on the document in the Document Tree and \n " + \
@@ -1512,46 +1514,12 @@ class ORIGAMI(object):
                                    exceptionMsg= msg, type="Error")
                     return
                 # RT 
-                extract_kwargs = {'return_data':True, 'normalize':True}
-                xvalsRT, rtDataY, rtDataYnorm = io_waters.rawMassLynx_RT_extract(path=path,
-                                                                                 driftscope_path=self.config.driftscopePath,
-                                                                                 mz_start=mzStart, mz_end=mzEnd, 
-                                                                                 **extract_kwargs)
+                xvalsRT, rtDataY, rtDataYnorm = engine.extract_rt(mz_start=mzStart, mz_end=mzEnd, 
+                                                                  normalize=True)
                 # 2D
-                extract_kwargs = {'return_data':True}
-                imsData2D = io_waters.rawMassLynx_2DT_extract(path=path,
-                                                              driftscope_path=self.config.driftscopePath,
-                                                              mz_start=mzStart, mz_end=mzEnd, 
-                                                              **extract_kwargs)
-                xlabels = 1+np.arange(len(imsData2D[1,:]))
-                ylabels = 1+np.arange(len(imsData2D[:,1]))
-                # Update limits
-                self.setXYlimitsRMSD2D(xlabels, ylabels)
-                
-                # Get height of the peak
-                ms = np.transpose(np.array([document.massSpectrum['xvals'], document.massSpectrum['yvals']]))
-                mzYMax = self.view.getYvalue(msList=ms, mzStart=mzStart, mzEnd=mzEnd)
-                tempList.SetStringItem(index=row, col=self.config.peaklistColNames['intensity'], label=str(mzYMax))
-                
-                # Add data to document object
-                document.gotExtractedIons = True
-                document.IMS2Dions[rangeName] = {'zvals':imsData2D,
-                                                  'xvals':xlabels,
-                                                  'xlabels':'Scans',
-                                                  'yvals':ylabels,
-                                                  'ylabels':'Drift time (bins)',
-                                                  'cmap':itemInfo.get('colormap', self.config.currentCmap),
-                                                  'yvals1D':imsData1D,
-                                                  'yvalsRT':rtDataY,
-                                                  'title':label,
-                                                  'label':label,
-                                                  'charge':charge,
-                                                  'alpha':itemInfo['alpha'],
-                                                  'mask':itemInfo['mask'], 
-                                                  'color':itemInfo['color'], 
-                                                  'min_threshold':itemInfo['min_threshold'],
-                                                  'max_threshold':itemInfo['max_threshold'], 
-                                                  'xylimits':[mzStart,mzEnd,mzYMax]}
+                imsData2D = engine.extract_rtdt(mz_start=mzStart, mz_end=mzEnd)
+                self.on_add_extracted_ion(document, row, itemInfo, rangeName, mzStart, mzEnd, 
+                                          label, charge, imsData1D, rtDataY, imsData2D)
                 # Update document
                 # if auto extract is enabled and the user extracts items rapidly it can 
                 # cause an issue so its a small hack to fix that
@@ -1729,6 +1697,77 @@ class ORIGAMI(object):
             else: 
                 return
             self.onThreading(None, (msg, 4), action='updateStatusbar')
+        
+        if len(batch) > 0:
+            self.on_extract_2D_from_mass_range_batch(batch, engines)
+    
+    def on_add_extracted_ion(self, document, row, itemInfo, rangeName, mzStart, mzEnd, 
+                             label, charge, imsData1D, rtDataY, imsData2D):
+        """ Add extracted ion (ORIGAMI) to the document and update peaklist """
+        tempList = self.view.panelMultipleIons.peaklist # shortcut
+        xlabels = 1+np.arange(len(imsData2D[1,:]))
+        ylabels = 1+np.arange(len(imsData2D[:,1]))
+        # Update limits
+        self.setXYlimitsRMSD2D(xlabels, ylabels)
+        
+        # Get height of the peak
+        ms = np.transpose(np.array([document.massSpectrum['xvals'], document.massSpectrum['yvals']]))
+        mzYMax = self.view.getYvalue(msList=ms, mzStart=mzStart, mzEnd=mzEnd)
+        tempList.SetStringItem(index=row, col=self.config.peaklistColNames['intensity'], label=str(mzYMax))
+        
+        # Add data to document object
+        document.gotExtractedIons = True
+        document.IMS2Dions[rangeName] = {'zvals':imsData2D,
+                                          'xvals':xlabels,
+                                          'xlabels':'Scans',
+                                          'yvals':ylabels,
+                                          'ylabels':'Drift time (bins)',
+                                          'cmap':itemInfo.get('colormap', self.config.currentCmap),
+                                          'yvals1D':imsData1D,
+                                          'yvalsRT':rtDataY,
+                                          'title':label,
+                                          'label':label,
+                                          'charge':charge,
+                                          'alpha':itemInfo['alpha'],
+                                          'mask':itemInfo['mask'], 
+                                          'color':itemInfo['color'], 
+                                          'min_threshold':itemInfo['min_threshold'],
+                                          'max_threshold':itemInfo['max_threshold'], 
+                                          'xylimits':[mzStart,mzEnd,mzYMax]}
+
+    def on_extract_2D_from_mass_range_batch(self, batch, engines):
+        """ 
+        Extract all ions of each file in a single pass over the data
+        
+        batch : dict with list of [row, itemInfo, document, rangeName, mzStart, mzEnd, label, charge]
+                for each file path
+        """
+        for path, ions in batch.items():
+            if path not in engines:
+                engines[path] = self.get_extraction_engine(path)
+            mz_windows = [[ion[4], ion[5]] for ion in ions]
+            try:
+                ion_data = engines[path].extract_ions(mz_windows)
+            except IOError:
+                msg = "Failed to open the file - most likely because this file no longer exists or has been moved.\n" + \
+                      "You can change the document path by right-clicking on the document in the Document Tree and \n " + \
+                      "selecting Notes, Information, Labels..."
+                dialogs.dlgBox(exceptionTitle='Missing folder', 
+                               exceptionMsg= msg, type="Error")
+                return
+            
+            for ion, (imsData1D, rtDataY, imsData2D) in zip(ions, ion_data):
+                row, itemInfo, document, rangeName, mzStart, mzEnd, label, charge = ion
+                self.on_add_extracted_ion(document, row, itemInfo, rangeName, mzStart, mzEnd, 
+                                          label, charge, imsData1D, rtDataY, imsData2D)
+            
+            # Update document
+            try: self.OnUpdateDocument(document, 'ions')
+            except wx.PyAssertionError:
+                time.sleep(0.1)
+                self.OnUpdateDocument(document, 'ions')
+            msg = "Extracted {} ions from {}".format(len(ions), document.title)
+            self.onThreading(None, (msg, 4), action='updateStatusbar')
     
     def on_extract_2D_from_mass_range_threaded(self, evt, extract_type="all"):
         """
@@ -1851,29 +1890,21 @@ class ORIGAMI(object):
                 kwargs = {'auto_range':self.config.ms_auto_range,
                           'mz_min':xlimits[0], 'mz_max':xlimits[1],
                           'linearization_mode':self.config.ms_linearization_mode}
-                msDict = io_waters.rawMassLynx_MS_bin(filename=str(document.path), function=1, 
-                                                      startScan=startScan, endScan=endScan, 
-                                                      binData=self.config.import_binOnImport, 
-                                                      mzStart=xlimits[0], mzEnd=xlimits[1], # override any settings as this is a accidental extraction 
-                                                      binsize=self.config.ms_mzBinSize,
-                                                      **kwargs)
-                msX, msY = pr_spectra.sum_1D_dictionary(ydict=msDict)
+                msX, msY = self.on_extract_MS_for_scan_range(document.path, 
+                                                             startScan=startScan, endScan=endScan, 
+                                                             mzStart=xlimits[0], mzEnd=xlimits[1], # override any settings as this is a accidental extraction 
+                                                             **kwargs)
                 
             xlimits = [np.min(msX), np.max(msX)]
         else:
             kwargs = {'auto_range':self.config.ms_auto_range,
                       'mz_min':xlimits[0], 'mz_max':xlimits[1],
                       'linearization_mode':self.config.ms_linearization_mode}
-            msDict = io_waters.rawMassLynx_MS_bin(filename=str(document.path), 
-                                                  function=1, 
-                                                  startScan=startScan, endScan=endScan, 
-                                                  binData=self.config.import_binOnImport, 
-                                                  mzStart=self.config.ms_mzStart, 
-                                                  mzEnd=self.config.ms_mzEnd, 
-                                                  binsize=self.config.ms_mzBinSize,
-                                                  **kwargs)
-            
-            msX, msY = pr_spectra.sum_1D_dictionary(ydict=msDict)
+            msX, msY = self.on_extract_MS_for_scan_range(document.path, 
+                                                         startScan=startScan, endScan=endScan, 
+                                                         mzStart=self.config.ms_mzStart, 
+                                                         mzEnd=self.config.ms_mzEnd, 
+                                                         **kwargs)
             xlimits = [np.min(msX), np.max(msX)]
                                                                             
         # Add data to dictionary
@@ -1930,12 +1961,9 @@ class ORIGAMI(object):
    
         # Mass spectra
         try:
-            extract_kwargs = {'return_data':True}
-            msX, msY = io_waters.rawMassLynx_MS_extract(path=document.path,  
-                                                        driftscope_path=self.config.driftscopePath, 
-                                                        rt_start=rtStart, rt_end=rtEnd,
-                                                        dt_start=dtStart, dt_end=dtEnd,
-                                                        **extract_kwargs)
+            engine = self.get_extraction_engine(document.path)
+            msX, msY = engine.extract_ms(rt_start=rtStart, rt_end=rtEnd,
+                                         dt_start=dtStart, dt_end=dtEnd)
             if xlimits is None:
                 xlimits = [np.min(msX), np.max(msX)]
         except (IOError, ValueError):
@@ -1966,6 +1994,8 @@ class ORIGAMI(object):
         # Shortcut to ion table
         tempList = self.view.panelMultipleIons.peaklist 
         
+        # Ions are collected first and combined together if they share the same schedule
+        combine_list = []
         # Make a list of current documents
         for row in range(tempList.GetItemCount()):
             
@@ -2034,12 +2064,12 @@ class ORIGAMI(object):
                 else: 
                     continue 
                 # Combine data
-                imsData2D, scanList, parameters = pr_origami.origami_combine_linear(imsDataInput=zvals[selectedItem]['zvals'], 
-                                                              firstVoltage=self.config.origami_startScan,
-                                                              startVoltage=self.config.origami_startVoltage, 
-                                                              endVoltage=self.config.origami_endVoltage,
-                                                              stepVoltage=self.config.origami_stepVoltage, 
-                                                              scansPerVoltage=self.config.origami_spv)
+                combine_func = pr_origami.origami_combine_linear
+                combine_kwargs = {'firstVoltage':self.config.origami_startScan,
+                                  'startVoltage':self.config.origami_startVoltage, 
+                                  'endVoltage':self.config.origami_endVoltage,
+                                  'stepVoltage':self.config.origami_stepVoltage, 
+                                  'scansPerVoltage':self.config.origami_spv}
             # EXPONENTIAL METHOD
             elif self.config.origami_acquisition == 'Exponential': 
                 # Check that the user filled in appropriate parameters
@@ -2074,14 +2104,14 @@ class ORIGAMI(object):
                 elif self.config.useInternalParamsCombine and tempList.IsChecked(index=row):
                     pass
                 else: continue # skip
-                imsData2D, scanList, parameters = pr_origami.origami_combine_exponential(imsDataInput=zvals[selectedItem]['zvals'], 
-                                                                                         firstVoltage=self.config.origami_startScan,
-                                                                                         startVoltage=self.config.origami_startVoltage, 
-                                                                                         endVoltage=self.config.origami_endVoltage,
-                                                                                         stepVoltage=self.config.origami_stepVoltage, 
-                                                                                         scansPerVoltage=self.config.origami_spv,
-                                                                                         expIncrement=self.config.origami_exponentialIncrement,
-                                                                                         expPercentage=self.config.origami_exponentialPercentage)
+                combine_func = pr_origami.origami_combine_exponential
+                combine_kwargs = {'firstVoltage':self.config.origami_startScan,
+                                  'startVoltage':self.config.origami_startVoltage, 
+                                  'endVoltage':self.config.origami_endVoltage,
+                                  'stepVoltage':self.config.origami_stepVoltage, 
+                                  'scansPerVoltage':self.config.origami_spv,
+                                  'expIncrement':self.config.origami_exponentialIncrement,
+                                  'expPercentage':self.config.origami_exponentialPercentage}
             # FITTED/BOLTZMANN METHOD
             elif self.config.origami_acquisition == 'Fitted': 
                 # Check that the user filled in appropriate parameters
@@ -2114,13 +2144,13 @@ class ORIGAMI(object):
                 elif self.config.useInternalParamsCombine and tempList.IsChecked(index=row):
                     pass
                 else: continue # skip
-                imsData2D, scanList, parameters = pr_origami.origami_combine_boltzmann(imsDataInput=zvals[selectedItem]['zvals'], 
-                                                                                       firstVoltage=self.config.origami_startScan,
-                                                                                       startVoltage=self.config.origami_startVoltage, 
-                                                                                       endVoltage=self.config.origami_endVoltage,
-                                                                                       stepVoltage=self.config.origami_stepVoltage, 
-                                                                                       scansPerVoltage=self.config.origami_spv,
-                                                                                       dx=self.config.origami_boltzmannOffset)
+                combine_func = pr_origami.origami_combine_boltzmann
+                combine_kwargs = {'firstVoltage':self.config.origami_startScan,
+                                  'startVoltage':self.config.origami_startVoltage, 
+                                  'endVoltage':self.config.origami_endVoltage,
+                                  'stepVoltage':self.config.origami_stepVoltage, 
+                                  'scansPerVoltage':self.config.origami_spv,
+                                  'dx':self.config.origami_boltzmannOffset}
             # USER-DEFINED/LIST METHOD
             elif self.config.origami_acquisition == 'User-defined':
                 print(self.config.origamiList, self.config.origami_startScan)
@@ -2152,70 +2182,112 @@ class ORIGAMI(object):
                 elif self.config.useInternalParamsCombine and tempList.IsChecked(index=row):
                     pass
                 else: continue # skip
-                imsData2D, xlabels, scanList, parameters = pr_origami.origami_combine_userDefined(imsDataInput=zvals[selectedItem]['zvals'], 
-                                                                                                  firstVoltage=self.config.origami_startScan, 
-                                                                                                  inputList=self.config.origamiList)
+                combine_func = pr_origami.origami_combine_userDefined
+                combine_kwargs = {'firstVoltage':self.config.origami_startScan, 
+                                  'inputList':self.config.origamiList}
                 
+            # Add x-axis labels
+            xlabels = None
+            if self.config.origami_acquisition != 'User-defined':
+                xlabels = np.arange(self.config.origami_startVoltage, 
+                                    (self.config.origami_endVoltage+self.config.origami_stepVoltage), 
+                                    self.config.origami_stepVoltage)
+            combine_list.append([self.docs, selectedItem, zvals[selectedItem], xlabels, 
+                                 combine_func, combine_kwargs])
+        
+        # Group ions that share the same schedule and data shape
+        combine_groups = OrderedDict()
+        for item in combine_list:
+            combine_func, combine_kwargs = item[4], item[5]
+            key = [combine_func.__name__, np.shape(item[2]['zvals'])]
+            for name in sorted(combine_kwargs):
+                value = combine_kwargs[name]
+                if isinstance(value, np.ndarray):
+                    value = (value.shape, value.tobytes())
+                key.append((name, value))
+            combine_groups.setdefault(tuple(key), []).append(item)
+        
+        # Split groups so that each stack is at most ~256 MB
+        combine_chunks = []
+        for group in combine_groups.values():
+            chunk_size = max(int(268435456 // max(np.asarray(group[0][2]['zvals']).size * 8, 1)), 1)
+            for idx in range(0, len(group), chunk_size):
+                combine_chunks.append(group[idx:idx + chunk_size])
+        
+        updated_documents = []
+        for group in combine_chunks:
+            combine_func, combine_kwargs = group[0][4], group[0][5]
+            imsDataStack = np.array([item[2]['zvals'] for item in group])
+            # Combine all ions in one go
+            if combine_func == pr_origami.origami_combine_userDefined:
+                imsDataStack, ColEnergyX, scanList, parameters = combine_func(imsDataInput=imsDataStack, **combine_kwargs)
+            else:
+                imsDataStack, scanList, parameters = combine_func(imsDataInput=imsDataStack, **combine_kwargs)
                 
-            if imsData2D[0] is None:
+            if imsDataStack[0] is None:
                 msg = "With your current input, there would be too many scans in your file! " + \
                       "There are %s scans in your file and your settings suggest there should be %s" \
-                      % (imsData2D[2], imsData2D[1])
+                      % (imsDataStack[2], imsDataStack[1])
                 dialogs.dlgBox(exceptionTitle='Are your settings correct?', 
                                exceptionMsg= msg, type="Warning")
                 continue
-                
-            # Add x-axis and y-axis labels
-            if self.config.origami_acquisition != 'User-defined':
-                xlabels = np.arange(self.config.origami_startVoltage, 
-                                    (self.config.origami_endVoltage+self.config.origami_stepVoltage), 
-                                    self.config.origami_stepVoltage)
-                
-            # Y-axis is bins by default
-            ylabels = np.arange(1,201,1)
-            # Combine 2D array into 1D 
-            imsData1D = np.sum(imsData2D, axis=1).T
-            yvalsRT = np.sum(imsData2D, axis=0)
-            # Check if item has labels, alpha, charge
-            charge = zvals[selectedItem].get('charge', None)
-            cmap = zvals[selectedItem].get('cmap', self.config.overlay_cmaps[randomIntegerGenerator(0,5)])
-            color = zvals[selectedItem].get('color', self.config.customColors[randomIntegerGenerator(0,15)])
-            label = zvals[selectedItem].get('label', None)
-            alpha = zvals[selectedItem].get('alpha', self.config.overlay_defaultAlpha)
-            mask = zvals[selectedItem].get('mask', self.config.overlay_defaultMask)
-            min_threshold = zvals[selectedItem].get('min_threshold', 0)
-            max_threshold = zvals[selectedItem].get('max_threshold', 1)
-        
-            # Add 2D data to document object
-            self.docs.gotCombinedExtractedIons = True            
-            self.docs.IMS2DCombIons[selectedItem] = {'zvals':imsData2D,
-                                                     'xvals':xlabels,
-                                                     'xlabels':'Collision Voltage (V)',
-                                                     'yvals':ylabels,
-                                                     'ylabels':'Drift time (bins)',
-                                                     'yvals1D':imsData1D,
-                                                     'yvalsRT':yvalsRT,
-                                                     'cmap':cmap,
-                                                     'xylimits':zvals[selectedItem]['xylimits'],
-                                                     'charge':charge,
-                                                     'label':label, 
-                                                     'alpha':alpha,
-                                                     'mask':mask, 
-                                                     'color':color, 
-                                                     'min_threshold':min_threshold,
-                                                     'max_threshold':max_threshold, 
-                                                     'scanList':scanList,
-                                                     'parameters':parameters}
-            self.docs.combineIonsList = scanList
-            # Add 1D data to document object
-            self.docs.gotCombinedExtractedIonsRT = True            
-            self.docs.IMSRTCombIons[selectedItem] = {'xvals':xlabels,
-                                                     'yvals':np.sum(imsData2D, axis=0),
-                                                     'xlabels':'Collision Voltage (V)'}
-            
-            # Update document
-            self.OnUpdateDocument(self.docs, 'combined_ions')
             
+            for (document, selectedItem, ion_data, xlabels, __, __), imsData2D in zip(group, imsDataStack):
+                self._on_add_combined_ion(document, selectedItem, ion_data, imsData2D, 
+                                          xlabels if xlabels is not None else ColEnergyX, 
+                                          [list(scan) for scan in scanList], parameters.copy())
+                if document not in updated_documents:
+                    updated_documents.append(document)
+        
+        # Update documents
+        for document in updated_documents:
+            self.OnUpdateDocument(document, 'combined_ions')
+            
+    def _on_add_combined_ion(self, document, selectedItem, ion_data, imsData2D, xlabels, 
+                             scanList, parameters):
+        """ Add combined ion to the document """
+        # Y-axis is bins by default
+        ylabels = np.arange(1, imsData2D.shape[0] + 1, 1)
+        # Combine 2D array into 1D 
+        imsData1D = np.sum(imsData2D, axis=1).T
+        yvalsRT = np.sum(imsData2D, axis=0)
+        # Check if item has labels, alpha, charge
+        charge = ion_data.get('charge', None)
+        cmap = ion_data.get('cmap', self.config.overlay_cmaps[randomIntegerGenerator(0,5)])
+        color = ion_data.get('color', self.config.customColors[randomIntegerGenerator(0,15)])
+        label = ion_data.get('label', None)
+        alpha = ion_data.get('alpha', self.config.overlay_defaultAlpha)
+        mask = ion_data.get('mask', self.config.overlay_defaultMask)
+        min_threshold = ion_data.get('min_threshold', 0)
+        max_threshold = ion_data.get('max_threshold', 1)
+    
+        # Add 2D data to document object
+        document.gotCombinedExtractedIons = True            
+        document.IMS2DCombIons[selectedItem] = {'zvals':imsData2D,
+                                                'xvals':xlabels,
+                                                'xlabels':'Collision Voltage (V)',
+                                                'yvals':ylabels,
+                                                'ylabels':'Drift time (bins)',
+                                                'yvals1D':imsData1D,
+                                                'yvalsRT':yvalsRT,
+                                                'cmap':cmap,
+                                                'xylimits':ion_data['xylimits'],
+                                                'charge':charge,
+                                                'label':label, 
+                                                'alpha':alpha,
+                                                'mask':mask, 
+                                                'color':color, 
+                                                'min_threshold':min_threshold,
+                                                'max_threshold':max_threshold, 
+                                                'scanList':scanList,
+                                                'parameters':parameters}
+        document.combineIonsList = scanList
+        # Add 1D data to document object
+        document.gotCombinedExtractedIonsRT = True            
+        document.IMSRTCombIons[selectedItem] = {'xvals':xlabels,
+                                                'yvals':np.sum(imsData2D, axis=0),
+                                                'xlabels':'Collision Voltage (V)'}
+
     def onExtractMSforEachCollVoltage(self, evt):
         """
         This function extracts 'binned' msX and msY values for each collision
@@ -2257,18 +2329,15 @@ class ORIGAMI(object):
                   'mz_min':xlimits[0], 'mz_max':xlimits[1],
                   'linearization_mode':self.config.ms_linearization_mode}
         
+        spectra = []
         for counter, item in enumerate(splitlist):
             itemName = "Scans: %s-%s | CV: %s V" % (item[0], item[1], item[2])
             if self.config.binCVdata or scantime == None:
-                msDict = io_waters.rawMassLynx_MS_bin(filename=str(document.path), 
-                                                      function=1, 
-                                                      startScan=item[0], endScan=item[1], 
-                                                      binData=self.config.import_binOnImport, 
-                                                      mzStart=self.config.ms_mzStart, 
-                                                      mzEnd=self.config.ms_mzEnd, 
-                                                      binsize=self.config.ms_mzBinSize,
-                                                      **kwargs)
-                msX, msY = pr_spectra.sum_1D_dictionary(ydict=msDict)
+                msX, msY = self.on_extract_MS_for_scan_range(document.path, 
+                                                             startScan=item[0], endScan=item[1], 
+                                                             mzStart=self.config.ms_mzStart, 
+                                                             mzEnd=self.config.ms_mzEnd, 
+                                                             **kwargs)
                 xlimits = [self.config.ms_mzStart, self.config.ms_mzEnd]   
             elif not self.config.binCVdata and scantime != None:
                 # Mass spectra
@@ -2287,15 +2356,13 @@ class ORIGAMI(object):
                                                         'xlabels':'m/z (Da)',
                                                         'xlimits':xlimits}
             msFilenames.append(str(item[2]))
-            if counter == 0:
-                tempArray = msY
-            else: 
-                tempArray = np.concatenate((tempArray, msY), axis=0)     
+            spectra.append((msX, msY))
         # Form pandas dataframe
-        combMSOut = np.concatenate((msX, tempArray), axis=0)
-        combMSOut = combMSOut.reshape((len(msY), int(counter+2)), order='F') 
-   
-        msSaveData = pd.DataFrame(data=combMSOut, columns=msFilenames)
+        msX, combMS = pr_spectra.linearize_spectra(spectra, msCentre=spectra[0][0],
+                                                   linearization_mode=self.config.ms_linearization_mode,
+                                                   mz_bin=self.config.ms_mzBinSize,
+                                                   n_threads=self.config.ms_linearization_threads)
+        msSaveData = pd.DataFrame(data=np.column_stack((msX, combMS.T)), columns=msFilenames)
         document.gotMSSaveData = True
         document.massSpectraSave = msSaveData # pandas dataframe that can be exported as csv
         
@@ -3316,19 +3383,20 @@ class ORIGAMI(object):
                                                     'footnote':footnote}
         elif self.config.overlayMethod == "RMSD Matrix":
             """ Compute RMSD matrix for selected files """
-            zvals = np.zeros([tempAccumulator,tempAccumulator])
             tickLabels = []
             for row in range(tempAccumulator):
                 key = compList[row]
                 # Extract text labels from table
                 tickLabels.append(compDict[key]['label'])
-                # Compute pairwise RMSD
-                for row2 in range(row+1,tempAccumulator):
-                    zvalsIon1plot = compDict[compList[row]]['zvals']
-                    zvalsIon2plot = compDict[compList[row2]]['zvals']
-                    pRMSD, tempArray = pr_activation.compute_RMSD(inputData1=zvalsIon1plot,
-                                                      inputData2=zvalsIon2plot)
-                    zvals[row,row2] = np.round(pRMSD,2)
+            # Compute pairwise RMSD
+            try:
+                zvals = pr_activation.compute_RMSD_matrix([compDict[key]['zvals'] for key in compList[:tempAccumulator]],
+                                                          n_processes=self.config.rmsd_matrix_processes)
+            except ValueError as err:
+                dialogs.dlgBox(exceptionTitle='Error', exceptionMsg=str(err), type="Error")
+                return
+            # Only show upper triangle
+            zvals = np.round(np.triu(zvals, 1), 2)
             self.view.panelPlots.on_plot_matrix(zvals=zvals, xylabels=tickLabels, cmap=self.docs.colormap)
             self.view.panelPlots.mainBook.SetSelection(self.config.panelNames['Comparison'])
             if add_data_to_document:
@@ -3362,7 +3430,7 @@ class ORIGAMI(object):
                 legend_text.append([color, label])
                 
                 # Change intensity
-                data = pr_heatmap.adjust_min_max_intensity(data.copy(), min_threshold, max_threshold)
+                data = pr_heatmap.adjust_min_max_intensity(data, min_threshold, max_threshold)
                 # Convert to RGB
                 rgb = make_rgb(data, color)
                 data_list.append(rgb)
@@ -3601,6 +3669,108 @@ class ORIGAMI(object):
             # Update documents tree
             self.view.panelDocuments.topP.documents.addDocument(docData = self.docs)               
                         
+    def get_extraction_engine(self, path, backend=None, **kwargs):
+        """
+        Get extraction engine for MassLynx file using the backend specified in the config
+        """
+        if backend is None:
+            backend = self.config.extraction_backend
+
+        if backend == "Cube" and 'cube' not in kwargs:
+            cube = io_scan_cube.load_scan_cube(path)
+            if cube is None:
+                cube = self.on_build_scan_cube(path)
+            if cube is not None:
+                kwargs['cube'] = cube
+            else:
+                print("Scan cube is not available for this file - using DriftScope instead")
+                backend = "DriftScope"
+
+        if backend == "DriftScope":
+            kwargs.setdefault('driftscope_path', self.config.driftscopePath)
+
+        return io_extraction.get_extraction_engine(path, backend=backend, **kwargs)
+
+    def on_build_scan_cube(self, path):
+        """
+        Bin the raw file into persistent scan cube (scan x drift x m/z) so that any
+        subsequent extraction is a slice of memory-mapped arrays
+        """
+        self.onThreading(None, ("Building scan cube. This only needs to be done once per file...", 4),
+                         action='updateStatusbar')
+        tstart = time.time()
+        try:
+            cube = io_scan_cube.build_scan_cube(path, mz_bin=self.config.extraction_cube_mzBinSize)
+        except Exception as err:
+            print("Failed to build scan cube: {}".format(err))
+            return None
+
+        self.onThreading(None, ("Built scan cube in {:.2f} seconds".format(time.time() - tstart), 4),
+                         action='updateStatusbar')
+        return cube
+
+    def get_scan_spectrum_index(self, path, mzStart, mzEnd):
+        """
+        Get cumulative spectrum index for MassLynx file. The index is built on first use
+        and is afterwards loaded from the disk. Returns None if the index cannot be used
+        with current settings
+        """
+        binsize = self.config.ms_mzBinSize
+        mode = self.config.ms_linearization_mode
+        if (not self.config.ms_use_scan_index or mode == "Raw" or binsize in [0, None]
+            or mzStart is None or mzEnd is None):
+            return None
+
+        parameters = io_scan_index.get_index_parameters(mzStart, mzEnd, binsize, mode)
+        key = (path, tuple(sorted(parameters.items())))
+        if key in self.scan_indexes:
+            return self.scan_indexes[key]
+
+        index = io_scan_index.load_scan_index(path, mzStart, mzEnd, binsize, mode)
+        if index is None:
+            try:
+                n_scans = io_waters.rawMassLynx_MS_scan_count(filename=str(path), function=1)
+                size = io_scan_index.estimate_index_size(n_scans, mzStart, mzEnd, binsize, mode)
+                if size > self.config.ms_scan_index_max_size * 1024 ** 2:
+                    print("Spectrum index would take {:.1f} MB - exceeds the limit of {} MB".format(
+                        size / 1024. ** 2, self.config.ms_scan_index_max_size))
+                    return None
+
+                self.onThreading(None, ("Building spectrum index. This only needs to be done once per file...", 4),
+                                 action='updateStatusbar')
+                scans = io_waters.rawMassLynx_MS_scans(filename=str(path), function=1)
+                index = io_scan_index.build_scan_index(path, scans, n_scans, mzStart, mzEnd, binsize, mode)
+            except Exception as err:
+                print("Failed to build spectrum index: {}".format(err))
+                return None
+
+        self.scan_indexes[key] = index
+        return index
+
+    def on_extract_MS_for_scan_range(self, path, startScan=0, endScan=-1, mzStart=None,
+                                     mzEnd=None, **kwargs):
+        """
+        Get summed mass spectrum for scan range. Uses the spectrum index when binning is
+        enabled, otherwise the scans are read from the raw file
+        """
+        if kwargs.get('auto_range', False):
+            mzStart, mzEnd = kwargs['mz_min'], kwargs['mz_max']
+
+        index = None
+        if self.config.import_binOnImport:
+            index = self.get_scan_spectrum_index(path, mzStart, mzEnd)
+
+        if index is not None:
+            return index.get_spectrum(start_scan=startScan, end_scan=endScan)
+
+        msX, msY, __ = io_waters.rawMassLynx_MS_bin_array(filename=str(path), function=1,
+                                                          startScan=startScan, endScan=endScan,
+                                                          binData=self.config.import_binOnImport,
+                                                          mzStart=mzStart, mzEnd=mzEnd,
+                                                          binsize=self.config.ms_mzBinSize,
+                                                          sum_only=True, **kwargs)
+        return msX, msY
+
     def checkIfRawFile(self, path):
         """
         Checks whether the selected directory is a MassLynx file i.e. ends with .raw
@@ -3611,12 +3781,13 @@ class ORIGAMI(object):
     def onProcessMultipleIonsIons(self, evt):
         """
         This function processes the 2D array data from multiple ions MULTIFILE or ORIGAMI
+        All selected heatmaps are processed together in one batch
         """
         # Shortcut to table
         tempList = self.view.panelMultipleIons.peaklist
         
-
-        # Make a list of current documents
+        # Make a list of heatmaps to process [document, dictionary name, ion name]
+        process_list = []
         for row in range(tempList.GetItemCount()):
             self.currentDoc = tempList.GetItem(itemId=row, col=self.config.peaklistColNames['filename']).GetText()
             # Check that data was extracted first
@@ -3630,66 +3801,62 @@ class ORIGAMI(object):
             mzStart = tempList.GetItem(itemId=row, col=self.config.peaklistColNames['start']).GetText()
             mzEnd = tempList.GetItem(itemId=row, col=self.config.peaklistColNames['end']).GetText()
             selectedItem = ''.join([str(mzStart),'-',str(mzEnd)])
-            # strip any processed string from the title
-            dataset = selectedItem
-            if "(processed)" in selectedItem:
-                dataset = selectedItem.split(" (")[0]
-            new_dataset = "%s (processed)" % dataset
             # Select document
             self.docs = self.documentsDict[self.currentDoc]
             dataType = self.docs.dataType
             
-            # process data
             if (dataType in ['Type: ORIGAMI', 'Type: Infrared', 'Type: MANUAL'] and 
-                self.docs.gotCombinedExtractedIons == True):
-                try:
-                    tempData = self.docs.IMS2DCombIons[selectedItem]
-                    imsData2D, params = self.data_processing.on_process_2D(zvals=tempData['zvals'].copy(), 
-                                                                           return_all=True)
-                    imsData1D = np.sum(imsData2D, axis=1).T
-                    rtDataY = np.sum(imsData2D, axis=0)
-                    self.docs.IMS2DCombIons[new_dataset] = {'zvals':imsData2D,
-                                                            'xvals':tempData['xvals'],
-                                                            'xlabels':tempData['xlabels'],
-                                                            'yvals':tempData['yvals'],
-                                                            'ylabels':tempData['ylabels'],
-                                                            'yvals1D':imsData1D, 'yvalsRT':rtDataY,
-                                                            'cmap':tempData.get('cmap', self.config.currentCmap),
-                                                            'xylimits':tempData['xylimits'],
-                                                            'charge':tempData.get('charge', None),
-                                                            'label':tempData.get('label', None),
-                                                            'alpha':tempData.get('alpha', None),
-                                                            'mask':tempData.get('alpha', None),
-                                                            'process_parameters':params}
-                except:
-                    pass
+                self.docs.gotCombinedExtractedIons == True and 
+                selectedItem in self.docs.IMS2DCombIons):
+                process_list.append([self.docs, 'IMS2DCombIons', selectedItem])
                 
             if (dataType in ['Type: ORIGAMI', 'Type: Infrared'] and 
-                self.docs.gotExtractedIons == True):
-                try:
-                    tempData = self.docs.IMS2Dions[selectedItem]
-                    imsData2D, params = self.data_processing.on_process_2D(zvals=tempData['zvals'].copy(), 
-                                                                           return_all=True)
-                    imsData1D = np.sum(imsData2D, axis=1).T
-                    rtDataY = np.sum(imsData2D, axis=0)
-                    self.docs.IMS2Dions[new_dataset] = {'zvals':imsData2D,
-                                                        'xvals':tempData['xvals'],
-                                                        'xlabels':tempData['xlabels'],
-                                                        'yvals':tempData['yvals'],
-                                                        'ylabels':tempData['ylabels'],
-                                                        'yvals1D':imsData1D, 'yvalsRT':rtDataY,
-                                                        'cmap':tempData.get('cmap', self.config.currentCmap),
-                                                        'xylimits':tempData['xylimits'],
-                                                        'charge':tempData.get('charge', None),
-                                                        'label':tempData.get('label', None),
-                                                        'alpha':tempData.get('alpha', None),
-                                                        'mask':tempData.get('alpha', None),
-                                                        'process_parameters':params}
-                except:
-                    pass
+                self.docs.gotExtractedIons == True and 
+                selectedItem in self.docs.IMS2Dions):
+                process_list.append([self.docs, 'IMS2Dions', selectedItem])
+                
+        if len(process_list) == 0:
+            return
+        
+        # process data
+        zvals_list = [getattr(document, data_name)[selectedItem]['zvals'] 
+                      for document, data_name, selectedItem in process_list]
+        try:
+            zvals_list, params = self.data_processing.on_process_2D_batch(zvals_list)
+        except (ValueError, TypeError, MemoryError) as e:
+            self.onThreading(None, ('Failed to process data: {}'.format(e), 4), action='updateStatusbar')
+            return
+        
+        update_list = OrderedDict()
+        for (document, data_name, selectedItem), imsData2D in zip(process_list, zvals_list):
+            # strip any processed string from the title
+            dataset = selectedItem
+            if "(processed)" in selectedItem:
+                dataset = selectedItem.split(" (")[0]
+            new_dataset = "%s (processed)" % dataset
+            
+            data = getattr(document, data_name)
+            tempData = data[selectedItem]
+            imsData1D = np.sum(imsData2D, axis=1).T
+            rtDataY = np.sum(imsData2D, axis=0)
+            data[new_dataset] = {'zvals':imsData2D,
+                                 'xvals':tempData['xvals'],
+                                 'xlabels':tempData['xlabels'],
+                                 'yvals':tempData['yvals'],
+                                 'ylabels':tempData['ylabels'],
+                                 'yvals1D':imsData1D, 'yvalsRT':rtDataY,
+                                 'cmap':tempData.get('cmap', self.config.currentCmap),
+                                 'xylimits':tempData['xylimits'],
+                                 'charge':tempData.get('charge', None),
+                                 'label':tempData.get('label', None),
+                                 'alpha':tempData.get('alpha', None),
+                                 'mask':tempData.get('alpha', None),
+                                 'process_parameters':params}
+            update_list[document.title] = document
 
-            # Update file list
-            self.OnUpdateDocument(self.docs, 'combined_ions')
+        # Update file list
+        for document in update_list.values():
+            self.OnUpdateDocument(document, 'combined_ions')
       
     def on_open_multiple_ORIGAMI_files(self, evt):
         
@@ -3860,34 +4027,22 @@ class ORIGAMI(object):
                 except: pass
                 
             msFilenames = ["m/z"]
-            counter = 0
+            spectra = []
             for key in self.docs.multipleMassSpectrum:
                 msFilenames.append(key)
-                if counter == 0:
-                    msDataX, tempArray = pr_spectra.linearize_data(self.docs.multipleMassSpectrum[key]['xvals'], 
-                                                                   self.docs.multipleMassSpectrum[key]['yvals'], 
-                                                                   **kwargs)
-                    msList = tempArray 
-                else:
-                    msDataX, msList = pr_spectra.linearize_data(self.docs.multipleMassSpectrum[key]['xvals'], 
-                                                                self.docs.multipleMassSpectrum[key]['yvals'], 
-                                                                **kwargs)
-                    tempArray = np.concatenate((tempArray, msList), axis=0)
-                counter += 1
-        
-            # Reshape the list 
-            combMS = tempArray.reshape((len(msList), int(counter)), order='F') 
+                spectra.append((self.docs.multipleMassSpectrum[key]['xvals'], 
+                                self.docs.multipleMassSpectrum[key]['yvals']))
+            msDataX, combMS = pr_spectra.linearize_spectra(spectra, 
+                                                           n_threads=self.config.ms_linearization_threads,
+                                                           **kwargs)
             
             # Sum y-axis data
-            msDataY = np.sum(combMS, axis=1)
+            msDataY = np.sum(combMS, axis=0)
             msDataY = pr_spectra.normalize_1D(inputData=msDataY)
             xlimits = [parameters['startMS'], parameters['endMS']]
             
             # Form pandas dataframe
-            combMSOut = np.concatenate((msDataX, tempArray), axis=0)
-            combMSOut = combMSOut.reshape((len(msList), int(counter+1)), order='F') 
-            
-            msSaveData = pd.DataFrame(data=combMSOut, columns=msFilenames)
+            msSaveData = pd.DataFrame(data=np.column_stack((msDataX, combMS.T)), columns=msFilenames)
              
             # Add data
             self.docs.gotMSSaveData = True
@@ -3946,35 +4101,27 @@ class ORIGAMI(object):
                 except: pass
                 
             msFilenames = ["m/z"]
-            counter = 0
+            spectra = []
             for key in self.docs.multipleMassSpectrum:
                 msFilenames.append(key)
-                if counter == 0:
-                    msDataX, tempArray = pr_spectra.linearize_data(self.docs.multipleMassSpectrum[key]['xvals'], 
-                                                                   self.docs.multipleMassSpectrum[key]['yvals'], 
-                                                                   **kwargs)
-                    msList = tempArray 
-                else:
-                    msDataX, msList = pr_spectra.linearize_data(self.docs.multipleMassSpectrum[key]['xvals'], 
-                                                                self.docs.multipleMassSpectrum[key]['yvals'], 
-                                                                **kwargs)
-                    tempArray = np.concatenate((tempArray, msList), axis=0)
-                counter += 1
-        
-            # Reshape the list 
-            combMS = tempArray.reshape((len(msList), int(counter)), order='F') 
+                spectra.append((self.docs.multipleMassSpectrum[key]['xvals'], 
+                                self.docs.multipleMassSpectrum[key]['yvals']))
+            msDataX, combMS = pr_spectra.linearize_spectra(spectra, 
+                                                           n_threads=self.config.ms_linearization_threads,
+                                                           **kwargs)
             
             # Sum y-axis data
-            msDataY = np.sum(combMS, axis=1)
+            msDataY = np.sum(combMS, axis=0)
             msDataY = pr_spectra.normalize_1D(inputData=msDataY)
             xlimits = [self.docs.parameters['startMS'], 
                        self.docs.parameters['endMS']]
             
             # Form pandas dataframe
-            combMSOut = np.concatenate((msDataX, tempArray), axis=0)
-            combMSOut = combMSOut.reshape((len(msList), int(counter+1)), order='F') 
+            msSaveData = pd.DataFrame(data=np.column_stack((msDataX, combMS.T)), columns=msFilenames)
              
             # Add data
+            self.docs.gotMSSaveData = True
+            self.docs.massSpectraSave = msSaveData # pandas dataframe that can be exported as csv
             self.docs.gotMS = True
             self.docs.massSpectrum = {'xvals':msDataX, 'yvals':msDataY, 'xlabels':'m/z (Da)', 'xlimits':xlimits}
             # Plot 
@@ -5516,7 +5663,7 @@ class ORIGAMI(object):
         # Smooth data
         if self.config.plot2D_smooth_mode != None:
             if self.config.plot2D_smooth_mode == 'Gaussian':
-                zvals = pr_heatmap.smooth_gaussian_2D(inputData=zvals.copy(), 
+                zvals = pr_heatmap.smooth_gaussian_2D(inputData=zvals, 
                                               sigma=self.config.plot2D_smooth_sigma)
             elif self.config.plot2D_smooth_mode == 'Savitzky-Golay':
                 zvals = pr_heatmap.smooth_savgol_2D(inputData = zvals,
@@ -5525,12 +5672,12 @@ class ORIGAMI(object):
         else: 
             pass
         # Threshold
-        zvals = pr_heatmap.remove_noise_2D(inputData=zvals.copy(), 
+        zvals = pr_heatmap.remove_noise_2D(inputData=zvals, 
                                            threshold=self.config.plot2D_threshold)
         # Normalize
         if self.config.plot2D_normalize == True:
-            zvals = pr_heatmap.normalize_2D(inputData=zvals.copy(), 
-                                            mode=self.config.plot2D_normalize_mode)
+            zvals = pr_heatmap.normalize_2D(inputData=zvals, 
+                                            mode=self.config.plot2D_normalize_mode, inplace=True)
             
         if replot:
             xvals, yvals, xlabel, ylabel = data[1::]
@@ -6632,9 +6779,9 @@ class ORIGAMI(object):
 
     def on_save_document(self, evt):
         """
-        Save ORIGAMI document as pickled object
+        Save ORIGAMI document in the container format
         """
-        fileType = "ORIGAMI Document File|*.pickle"
+        fileType = "ORIGAMI Document File|*.origami"
         
             
         # Save single document
@@ -6646,11 +6793,13 @@ class ORIGAMI(object):
                                 wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT)
         defaultFilename = document.title.split(".")
         dlg.SetFilename(defaultFilename[0])
+        # saving to the same file only writes datasets that changed
+        self.set_document_save_path(dlg, document)
                     
         if dlg.ShowModal() == wx.ID_OK:
             saveFileName = dlg.GetPath()          
             # Save
-            io_document.save_py_object(filename=saveFileName, saveFile=document)
+            io_document.save_document(filename=saveFileName, document=document)
             self.view.updateRecentFiles(path={'file_type':'pickle',
                                               'file_path': saveFileName})
             
@@ -6658,24 +6807,50 @@ class ORIGAMI(object):
         
     def on_save_all_documents(self, evt):
         """
-        Save all ORIGAMI documents as pickled objects
+        Save all ORIGAMI documents in the container format
         """
-        fileType = "ORIGAMI Document File|*.pickle"
+        fileType = "ORIGAMI Document File|*.origami"
         for document in self.documentsDict:
             dlg =  wx.FileDialog(self.view, "Save document to file...", "", "", fileType,
                                     wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT)
             defaultFilename = self.documentsDict[document].title.split(".")
             print("Saving {}".format(defaultFilename[0]))
             dlg.SetFilename(defaultFilename[0])
+            self.set_document_save_path(dlg, self.documentsDict[document])
             
             if dlg.ShowModal() == wx.ID_OK:
                 saveFileName = dlg.GetPath()          
                 # Save
-                io_document.save_py_object(filename=saveFileName, saveFile=self.documentsDict[document])
+                io_document.save_document(filename=saveFileName, document=self.documentsDict[document])
                 self.view.updateRecentFiles(path={'file_type':'pickle',
                                                   'file_path': saveFileName})
             else: continue
 
+    def set_document_save_path(self, dlg, document):
+        """ Point save dialog to the file the document was previously saved to """
+        filename = getattr(document, 'document_filename', None)
+        if filename is not None and os.path.exists(filename):
+            dlg.SetDirectory(os.path.dirname(filename))
+            dlg.SetFilename(os.path.basename(filename))
+
+    def on_autosave_documents(self, evt=None):
+        """
+        Save documents that were previously saved in the container format. Only datasets that
+        changed since the last save are written so this is cheap even for large documents
+        """
+        if not self.config.autoSaveDocuments:
+            return
+        for title in list(self.documentsDict.keys()):
+            document = self.documentsDict[title]
+            filename = getattr(document, 'document_filename', None)
+            if filename is None or not os.path.exists(filename):
+                continue
+            try:
+                if io_document.save_document(filename=filename, document=document):
+                    self.onThreading(None, ("Auto-saved {}".format(title), 4), action='updateStatusbar')
+            except Exception as err:
+                print("Failed to auto-save {}: {}".format(title, err))
+
     def onOpenDocument(self, evt, file_path=None):
         """
         This function opens whole document to a pickled directory
@@ -6684,7 +6859,7 @@ class ORIGAMI(object):
         dlg = None
         
         if file_path == None:
-            wildcard = "ORIGAMI document (*.pickle, *.pkl)| *.pickle;*.pkl"
+            wildcard = "ORIGAMI document (*.origami, *.pickle, *.pkl)| *.origami;*.pickle;*.pkl"
             dlg = wx.FileDialog(self.view, "Open Document File", wildcard = wildcard ,
                                 style=wx.FD_MULTIPLE | wx.FD_CHANGE_DIR)
             
@@ -6694,7 +6869,7 @@ class ORIGAMI(object):
                 filenames = dlg.GetFilenames()
                 for (file_path, file_name) in zip(pathlist, filenames):
                     tstart = time.clock()
-                    document = openObject(filename=file_path)
+                    document = self.on_open_document_file(file_path)
                     if document is None:
                         self.onThreading(None, ("Could not load {}".format(file_path), 4), action='updateStatusbar')
                         continue
@@ -6707,7 +6882,7 @@ class ORIGAMI(object):
             else: return
         elif file_path != None:
             try:
-                self.loadDocumentData(document=openObject(filename=file_path))
+                self.loadDocumentData(document=self.on_open_document_file(file_path))
             except (ValueError, AttributeError, TypeError, IOError), e:
                 dialogs.dlgBox(exceptionTitle='Failed to load document on load.', 
                                exceptionMsg= str(e),
@@ -6720,6 +6895,15 @@ class ORIGAMI(object):
         else: 
             return
          
+    def on_open_document_file(self, file_path):
+        """
+        Open document in the container format (datasets are loaded on first access) or
+        import pickled document
+        """
+        if io_document.is_document_container(file_path):
+            return io_document.open_document(filename=file_path)
+        return openObject(filename=file_path)
+         
     def loadDocumentData(self, document=None):
         """
         Function to iterate over the whole document to ensure complete loading of the data
@@ -7158,6 +7342,8 @@ class ORIGAMI(object):
         
         
 if __name__ == '__main__':
+    # required by the process pools in frozen (Windows) executables
+    multiprocessing.freeze_support()
     app = ORIGAMI(redirect=False)
     app.start()
     
@@ -61,11 +61,16 @@ class OrigamiConfig:
         self.threading = True
         self.autoSaveSettings = True
         self.autoSaveDocuments = True
+        self.autoSaveDocumentsInterval = 60 # seconds
         self.debug = True
         self.loadCCSAtStart = True
         self.configFile_name = 'configOut.xml'
         self.checkForDriftscopeAtStart = True
         self.driftscopePath = "C:\DriftScope\lib"
+        self.extraction_backend_choices = ["DriftScope", "Cube"]
+        self.extraction_backend = "DriftScope"
+        self.extraction_cube_mzBinSize = 0.1
+        self.extraction_batch_ions = True
 
         self.import_duplicate_action = "merge"
         self.import_duplicate_ask = False
@@ -536,6 +541,10 @@ class OrigamiConfig:
         self.unidec_peakNormalization = "Max"
         self.unidec_lineSeparation = 0.05
         self.unidec_maxIterations = 100
+        self.unidec_in_memory = False # use NumPy core instead of the UniDec binary
+        self.unidec_batch_processes = 0 # 0 = number of cores - 1
+        self.unidec_cache = True
+        self.unidec_cache_size = 512 # MB
         self.unidec_charges_label_charges = 0.05
         self.unidec_charges_offset = 0.01
         self.unidec_show_individualComponents = True
@@ -617,6 +626,8 @@ class OrigamiConfig:
         # UVPD
         self.uvpd_peak_finding_threshold = 0.1  # new in v1.2.1
         self.uvpd_peak_buffer_width = 1  # new in v1.2.1
+        self.uvpd_peak_min_width = 0
+        self.uvpd_peak_merge_gap = 0
         self.uvpd_peak_first_index = 1  # new in v1.2.1
         self.uvpd_peak_laser_on = (1, 0, 0)  # new in v1.2.1
         self.uvpd_peak_laser_off = (0, 0, 1)  # new in v1.2.1
@@ -642,6 +653,7 @@ class OrigamiConfig:
         self.rmsd_lineStyle = 'solid'
         self.rmsd_lineHatch = ' '
         self.rmsd_hspace = 0.1
+        self.rmsd_matrix_processes = 1
 
         # Process 2D
         self.plot2D_normalize = False
@@ -694,6 +706,14 @@ class OrigamiConfig:
                                               "Binning"]
         self.ms_linearization_mode = "Linear interpolation"
         self.ms_auto_range = True
+        self.ms_use_scan_index = True
+        self.ms_scan_index_max_size = 2000 # MB
+        self.ms_resampling_cache_size = 256 # MB
+        self.ms_linearization_threads = 1
+        self.process_cache_size = 256 # MB
+        self.plot2D_process_threads = 1
+        self.processing_precision = "float32"
+        self.processing_precision_choices = ["float32", "float64"]
 
         # waterfall
         self.waterfall = False
@@ -886,6 +906,7 @@ class OrigamiConfig:
         self.cwd = None
         self.unidec_path = None
         self.temporary_data = None
+        self.unidec_cache_path = None
 
         # Application presets
         self.zoomWindowX = 3  # m/z units
@@ -1544,10 +1565,15 @@ class OrigamiConfig:
         buff += '    <param name="logging" value="%s" type="bool" />\n' % (bool(self.logging))
         buff += '    <param name="threading" value="%s" type="bool" />\n' % (bool(self.threading))
         buff += '    <param name="autoSaveSettings" value="%s" type="bool" />\n' % (bool(self.autoSaveSettings))
+        buff += '    <param name="autoSaveDocuments" value="%s" type="bool" />\n' % (bool(self.autoSaveDocuments))
+        buff += '    <param name="autoSaveDocumentsInterval" value="%d" type="int" />\n' % (int(self.autoSaveDocumentsInterval))
         buff += '    <param name="debug" value="%s" type="bool" />\n' % (bool(self.debug))
         buff += '    <param name="quickDisplay" value="%s" type="bool" />\n' % (bool(self.quickDisplay))
         buff += '    <param name="loadCCSAtStart" value="%s" type="bool" />\n' % (bool(self.loadCCSAtStart))
         buff += '    <param name="checkForDriftscopeAtStart" value="%s" type="bool" />\n' % (bool(self.checkForDriftscopeAtStart))
+        buff += '    <param name="extraction_backend" value="%s" type="unicode" choices="%s" />\n' % (self.extraction_backend, self.extraction_backend_choices)
+        buff += '    <param name="extraction_cube_mzBinSize" value="%.4f" type="float" />\n' % (float(self.extraction_cube_mzBinSize))
+        buff += '    <param name="extraction_batch_ions" value="%s" type="bool" />\n' % (bool(self.extraction_batch_ions))
         buff += '    <param name="overrideCombine" value="%s" type="bool" />\n' % (bool(self.overrideCombine))
         buff += '    <param name="useInternalParamsCombine" value="%s" type="bool" />\n' % (bool(self.useInternalParamsCombine))
         buff += '    <param name="overlay_usedProcessed" value="%s" type="bool" />\n' % (bool(self.overlay_usedProcessed))
@@ -1707,6 +1733,10 @@ class OrigamiConfig:
         buff += '    <param name="unidec_peakDetectionThreshold" value="%.2f" type="float" />\n' % (float(self.unidec_peakDetectionThreshold))
         buff += '    <param name="unidec_peakNormalization" value="%s" type="unicode" choices="%s" />\n' % (self.unidec_peakNormalization, self.unidec_peakNormalization_choices.keys())
         buff += '    <param name="unidec_lineSeparation" value="%.2f" type="float" />\n' % (float(self.unidec_lineSeparation))
+        buff += '    <param name="unidec_in_memory" value="%s" type="bool" />\n' % (bool(self.unidec_in_memory))
+        buff += '    <param name="unidec_batch_processes" value="%d" type="int" />\n' % (int(self.unidec_batch_processes))
+        buff += '    <param name="unidec_cache" value="%s" type="bool" />\n' % (bool(self.unidec_cache))
+        buff += '    <param name="unidec_cache_size" value="%d" type="int" />\n' % (int(self.unidec_cache_size))
         buff += '    <!-- Plotting parameters -->\n'
         buff += '    <param name="unidec_plot_panel_view" value="%s" type="unicode" />\n' % (str(self.unidec_plot_panel_view))
         buff += '    <param name="unidec_maxShown_individualLines" value="%d" type="int" />\n' % (int(self.unidec_maxShown_individualLines))
@@ -1754,6 +1784,13 @@ class OrigamiConfig:
         buff += '    <param name="ms_dtmsBinSize" value="%.2f" type="float" />\n' % (float(self.ms_dtmsBinSize))
         buff += '    <param name="ms_linearization_mode" value="%s" type="unicode" choices="%s" />\n' % (self.ms_linearization_mode, self.ms_linearization_mode_choices)
         buff += '    <param name="ms_auto_range" value="%s" type="bool" />\n' % (bool(self.ms_auto_range))
+        buff += '    <param name="ms_use_scan_index" value="%s" type="bool" />\n' % (bool(self.ms_use_scan_index))
+        buff += '    <param name="ms_scan_index_max_size" value="%d" type="int" />\n' % (int(self.ms_scan_index_max_size))
+        buff += '    <param name="ms_resampling_cache_size" value="%d" type="int" />\n' % (int(self.ms_resampling_cache_size))
+        buff += '    <param name="ms_linearization_threads" value="%d" type="int" />\n' % (int(self.ms_linearization_threads))
+        buff += '    <param name="process_cache_size" value="%d" type="int" />\n' % (int(self.process_cache_size))
+        buff += '    <param name="plot2D_process_threads" value="%d" type="int" />\n' % (int(self.plot2D_process_threads))
+        buff += '    <param name="processing_precision" value="%s" type="unicode" choices="%s" />\n' % (self.processing_precision, self.processing_precision_choices)
         buff += '    <param name="ms_process_crop" value="%s" type="bool" />\n' % (bool(self.ms_process_crop))
         buff += '    <param name="ms_process_linearize" value="%s" type="bool" />\n' % (bool(self.ms_process_linearize))
         buff += '    <param name="ms_process_smooth" value="%s" type="bool" />\n' % (bool(self.ms_process_smooth))
@@ -1791,6 +1828,8 @@ class OrigamiConfig:
         buff += '    <param name="uvpd_peak_laser_off" value="%s" type="color" />\n' % (str(self.uvpd_peak_laser_off))
         buff += '    <param name="uvpd_peak_first_index" value="%d" type="int" />\n' % (int(self.uvpd_peak_first_index))
         buff += '    <param name="uvpd_peak_buffer_width" value="%.2f" type="float" />\n' % (float(self.uvpd_peak_buffer_width))
+        buff += '    <param name="uvpd_peak_min_width" value="%d" type="int" />\n' % (int(self.uvpd_peak_min_width))
+        buff += '    <param name="uvpd_peak_merge_gap" value="%d" type="int" />\n' % (int(self.uvpd_peak_merge_gap))
         buff += '    <param name="uvpd_peak_finding_threshold" value="%.2f" type="float" />\n' % (float(self.uvpd_peak_finding_threshold))
         buff += '  </process_presets_uvpd>\n\n'
 
@@ -1821,6 +1860,7 @@ class OrigamiConfig:
         buff += '    <param name="rmsd_lineStyle" value="%s" type="unicode" choices="%s" />\n' % (self.rmsd_lineStyle, self.lineStylesList)
         buff += '    <param name="rmsd_lineHatch" value="%s" type="unicode" choices="%s" />\n' % (self.rmsd_lineHatch, self.lineHatchList)
         buff += '    <param name="rmsd_hspace" value="%.2f" type="float" />\n' % (float(self.rmsd_hspace))
+        buff += '    <param name="rmsd_matrix_processes" value="%d" type="int" />\n' % (int(self.rmsd_matrix_processes))
         buff += '  </plot_presets_rmsd>\n\n'
 
         # Plot presets - waterfall
@@ -1,16 +1,109 @@
 from collections import OrderedDict
+import numpy as np
+
+class LazyArray(object):
+    """
+    Placeholder for array that is stored on the disk and is only loaded when accessed
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        return np.load(self.path)
+
+
+class LazyObject(LazyArray):
+    """
+    Placeholder for pickled object that is stored on the disk and is only loaded when accessed
+    """
+
+    def load(self):
+        from readers.io_document import load_pickle
+        return load_pickle(self.path)
+
+
+class LazyDict(OrderedDict):
+    """
+    Dictionary that loads its lazy values (`LazyArray`) on first access. Copying or
+    pickling the dictionary loads all values and returns normal OrderedDict
+    """
+
+    def __getitem__(self, key):
+        value = OrderedDict.__getitem__(self, key)
+        if isinstance(value, LazyArray):
+            value = value.load()
+            OrderedDict.__setitem__(self, key, value)
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        return OrderedDict.pop(self, key, *default)
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def itervalues(self):
+        for key in self:
+            yield self[key]
+
+    def iteritems(self):
+        for key in self:
+            yield (key, self[key])
+
+    def is_loaded(self, key):
+        return not isinstance(OrderedDict.__getitem__(self, key), LazyArray)
+
+    def get_raw(self, key):
+        """ Get value without loading it """
+        return OrderedDict.__getitem__(self, key)
+
+    def __reduce__(self):
+        return (OrderedDict, (self.items(),))
+
+    def copy(self):
+        return OrderedDict(self.items())
+
 
 class document():
     """
     Document object
     """
     
+    def __getattr__(self, name):
+        # datasets of documents opened from the container format are loaded on first access
+        lazy_attributes = self.__dict__.get('_lazy_attributes', {})
+        if name in lazy_attributes:
+            value = lazy_attributes.pop(name).load()
+            setattr(self, name, value)
+            return value
+        raise AttributeError(name)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name, value in state.pop('_lazy_attributes', {}).items():
+            state[name] = value.load()
+        return state
+
     def __init__(self):
         
         # File info
         self.docVersion = "19-10-2018" # to keep track of new features: add as date: DD-MM-YYYY
         
         self.last_saved = None # added in 19-10-2018 / v1.2.1
+        self.document_filename = None # path of the .origami file the document was saved to
         self.title = ''
         self.path = ''
         self.notes = ''
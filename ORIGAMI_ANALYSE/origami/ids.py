@@ -279,6 +279,7 @@ ID_mmlPanel_changeColorBatch_colormap = NewId()
 ID_mmlPanel_preprocess = NewId()
 ID_mmlPanel_addToDocument = NewId()
 ID_mmlPanel_batchRunUniDec = NewId()
+ID_mmlPanel_batchCancelUniDec = NewId()
 ID_mmlPanel_overlayChargeStates = NewId()
 ID_mmlPanel_overlayMW = NewId()
 ID_mmlPanel_overlayProcessedSpectra = NewId()
@@ -332,6 +333,7 @@ ID_ionPanel_changeColormapBatch = NewId()
 ID_ionPanel_addToDocument = NewId()
 ID_ionPanel_normalize1D = NewId()
 ID_ionPanel_automaticExtract = NewId()
+ID_ionPanel_batchExtract = NewId()
 ID_ionPanel_automaticOverlay = NewId()
 ID_ionPanel_show_mobiligram = NewId()
 ID_ionPanel_show_chromatogram = NewId()
@@ -395,7 +395,7 @@ class MyFrame(wx.Frame):
         menuFile.AppendMenu(ID_fileMenu_openRecent, "Open Recent", self.menuRecent)
         menuFile.AppendSeparator()
         menuFile.AppendItem(makeMenuItem(parent=menuFile, id=ID_openDocument,
-                                         text='Open ORIGAMI Document file (.pickle)\tCtrl+Shift+P', 
+                                         text='Open ORIGAMI Document file (.origami, .pickle)\tCtrl+Shift+P', 
                                          bitmap=self.icons.iconsLib['open_project_16']))
         menuFile.AppendSeparator()
         menuFile.AppendItem(makeMenuItem(parent=menuFile, id=ID_openORIGAMIRawFile,
@@ -447,10 +447,10 @@ class MyFrame(wx.Frame):
 
         menuFile.AppendSeparator()
         menuFile.AppendItem(makeMenuItem(parent=menuFile, id=ID_saveDocument,
-                                         text='Save document (.pickle)\tCtrl+S', 
+                                         text='Save document (.origami)\tCtrl+S', 
                                          bitmap=self.icons.iconsLib['save16']))
         menuFile.AppendItem(makeMenuItem(parent=menuFile, id=ID_saveAllDocuments,
-                                         text='Save all documents (.pickle)', 
+                                         text='Save all documents (.origami)', 
                                          bitmap=self.icons.iconsLib['pickle_16']))
         menuFile.AppendSeparator()
         menuFile.AppendItem(makeMenuItem(parent=menuFile, id=ID_quit,
@@ -2189,7 +2189,7 @@ class MyFrame(wx.Frame):
     
     def onOpenFile_DnD(self, file_path, file_extension):
         # open file
-        if file_extension in ['.pickle', '.pkl']:
+        if file_extension in ['.origami', '.pickle', '.pkl']:
             self.presenter.onOpenDocument(file_path=file_path, evt=None)
         elif file_extension == '.raw':
             self.presenter.onLoadOrigamiDataThreaded(path=file_path, evt=ID_openORIGAMIRawFile)
@@ -2308,7 +2308,7 @@ class DragAndDrop(wx.FileDropTarget):
         for filename in filenames:
             print("Opening {} file...".format(filename))
             __, file_extension = os.path.splitext(filename)
-            if file_extension in ['.raw', '.pickle', '.pkl', '.txt', '.csv', '.tab']:
+            if file_extension in ['.raw', '.origami', '.pickle', '.pkl', '.txt', '.csv', '.tab']:
                 try:
                     self.window.onOpenFile_DnD(filename, file_extension)
                 except:
@@ -394,6 +394,7 @@ class panelMultipleIons(wx.Panel):
     def onExtractTool(self, evt):
         
         self.Bind(wx.EVT_MENU, self.onCheckTool, id=ID_ionPanel_automaticExtract)
+        self.Bind(wx.EVT_MENU, self.onCheckTool, id=ID_ionPanel_batchExtract)
         self.Bind(wx.EVT_MENU, self.on_extract_all, id=ID_extractAllIons)
         self.Bind(wx.EVT_MENU, self.on_extract_selected, id=ID_extractSelectedIon)
         self.Bind(wx.EVT_MENU, self.on_extract_new, id=ID_extractNewIon)
@@ -402,6 +403,9 @@ class panelMultipleIons(wx.Panel):
         self.automaticExtract_check = menu.AppendCheckItem(ID_ionPanel_automaticExtract, "Extract automatically",
                                                            help="Ions will be extracted automatically")
         self.automaticExtract_check.Check(self.extractAutomatically)
+        self.batchExtract_check = menu.AppendCheckItem(ID_ionPanel_batchExtract, "Extract all ions in a single pass",
+                                                       help="All ions of the same file will be extracted together")
+        self.batchExtract_check.Check(self.config.extraction_batch_ions)
         menu.AppendSeparator()
         menu.Append(ID_extractNewIon, "Extract new ions")
         menu.Append(ID_extractSelectedIon, "Extract selected ions")
@@ -582,6 +586,11 @@ class panelMultipleIons(wx.Panel):
             args = ("Automatic extraction was set to: {}".format(self.extractAutomatically), 4)
             self.presenter.onThreading(evt, args, action='updateStatusbar')
             
+        if evtID == ID_ionPanel_batchExtract:
+            self.config.extraction_batch_ions = not self.config.extraction_batch_ions
+            args = ("Single pass extraction was set to: {}".format(self.config.extraction_batch_ions), 4)
+            self.presenter.onThreading(evt, args, action='updateStatusbar')
+            
         if evtID == ID_ionPanel_automaticOverlay:
             self.plotAutomatically = not self.plotAutomatically
             args = ("Automatic 2D overlaying was set to: {}".format(self.plotAutomatically), 4)
@@ -300,12 +300,16 @@ class panelMML( wx.Panel ):
     def onProcessTool(self, evt):
         self.Bind(wx.EVT_TOOL, self.on_combine_mass_spectra, id=ID_mmlPanel_data_combineMS)
         self.Bind(wx.EVT_TOOL, self.onAutoUniDec, id=ID_mmlPanel_batchRunUniDec)
+        self.Bind(wx.EVT_TOOL, self.onCancelUniDec, id=ID_mmlPanel_batchCancelUniDec)
         
         menu = wx.Menu()
         menu.Append(ID_mmlPanel_data_combineMS, "Average mass spectra (current document)")
         menu.AppendItem(makeMenuItem(parent=menu, id=ID_mmlPanel_batchRunUniDec,
                                      text='Run UniDec for selected items', 
                                      bitmap=self.icons.iconsLib['process_unidec_16']))
+        menu.AppendItem(makeMenuItem(parent=menu, id=ID_mmlPanel_batchCancelUniDec,
+                                     text='Cancel UniDec batch', 
+                                     bitmap=self.icons.iconsLib['blank_16']))
         self.PopupMenu(menu)
         menu.Destroy()
         self.SetFocus()
@@ -401,19 +405,21 @@ class panelMML( wx.Panel ):
           
     def onAutoUniDec(self, evt):
         
+        items = []
         for row in range(self.filelist.GetItemCount()):
             if not self.filelist.IsChecked(index=row): 
                 continue
             itemInfo = self.OnGetItemInformation(itemID=row)
+            items.append([itemInfo["document"], itemInfo["filename"]])
             
-            # get mass spectrum information
-            document = self.presenter.documentsDict[itemInfo["document"]]
-            dataset = itemInfo["filename"]           
-            self.data_processing.on_run_unidec(dataset, task="auto_unidec")
-             
-            print("Pre-processing mass spectra using m/z range {} - {} with {} bin size".format(self.config.unidec_mzStart,
-                                                                                                self.config.unidec_mzEnd,
-                                                                                                self.config.unidec_mzBinSize))
+        # deconvolute all spectra in parallel
+        self.data_processing.on_run_unidec_batch(items)
+        print("Pre-processing mass spectra using m/z range {} - {} with {} bin size".format(self.config.unidec_mzStart,
+                                                                                            self.config.unidec_mzEnd,
+                                                                                            self.config.unidec_mzBinSize))
+        
+    def onCancelUniDec(self, evt):
+        self.data_processing.on_cancel_unidec_batch()
 
     def onRenameItem(self, old_name, new_name, item_type="Document"):
         for row in range(self.filelist.GetItemCount()):
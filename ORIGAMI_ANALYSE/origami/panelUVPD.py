@@ -674,7 +674,9 @@ class panelUVPD(wx.MiniFrame):
         # Detect peaks
         peakList, tablelist, apexlist = pr_utils.detect_peaks_chromatogram(
             rtList, self.config.uvpd_peak_finding_threshold,
-            add_buffer=self.config.uvpd_peak_buffer_width)
+            add_buffer=self.config.uvpd_peak_buffer_width,
+            min_width=self.config.uvpd_peak_min_width,
+            merge_gap=self.config.uvpd_peak_merge_gap)
 
         # clear plots
         self.view.panelPlots.on_clear_patches("RT", False)
@@ -1265,18 +1267,13 @@ class panelUVPD(wx.MiniFrame):
         print("In total, it took {:.4f} seconds.".format(ttime() - tstart))
 
     def _extract_mass_spectrum(self, document_path, scan_list, **kwargs):
-        from processing.spectra import sum_1D_dictionary
 
         for counter, item in enumerate(scan_list):
-            msDict = io_waters.rawMassLynx_MS_bin(filename=str(document_path),
-                                                  function=1,
-                                                  startScan=item[0], endScan=item[1],
-                                                  binData=self.config.import_binOnImport,
-                                                  mzStart=self.config.ms_mzStart,
-                                                  mzEnd=self.config.ms_mzEnd,
-                                                  binsize=self.config.ms_mzBinSize,
-                                                  **kwargs)
-            msX, msY = sum_1D_dictionary(ydict=msDict)
+            msX, msY = self.presenter.on_extract_MS_for_scan_range(document_path,
+                                                                   startScan=item[0], endScan=item[1],
+                                                                   mzStart=self.config.ms_mzStart,
+                                                                   mzEnd=self.config.ms_mzEnd,
+                                                                   **kwargs)
 
             if counter == 0:
                 tempArray = msY
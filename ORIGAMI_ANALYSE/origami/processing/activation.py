@@ -17,11 +17,12 @@
 # -------------------------------------------------------------------------
 # __author__ lukasz.g.migas
 
+import time
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 
 from toolbox import isempty
 from heatmap import normalize_2D
-from spectra import normalize_1D
 
 
 def compute_RMSD(inputData1 = None, inputData2 = None): # computeRMSD
@@ -44,6 +45,126 @@ def compute_RMSD(inputData1 = None, inputData2 = None): # computeRMSD
          
     return pRMSD, tempArray
          
+def get_normalized_stack(data_list, dtype=np.float32):
+    """
+    Normalize each heatmap once (in the same way as `compute_RMSD`) and stack
+    them as flattened rows of a (n_maps, n_pixels) array
+
+    Parameters
+    ----------
+    data_list : list of 2D arrays
+        heatmaps of the same shape
+    dtype : numpy dtype
+        dtype of the stack
+    """
+    if len(data_list) == 0:
+        raise ValueError("Make sure you pick more than one file")
+
+    shape = np.shape(data_list[0])
+    stack = np.empty((len(data_list), int(np.prod(shape))), dtype=dtype)
+    for idx, data in enumerate(data_list):
+        if np.shape(data) != shape:
+            raise ValueError("The arrays are of different size! Cannot compare.")
+        stack[idx] = normalize_2D(inputData=data).ravel()
+
+    return stack
+
+def _compute_RMSD_block(stack, sq_norms, start, end):
+    """
+    Compute sum of squared differences between rows [start, end) and rows [start, n)
+    of the stack
+    """
+    products = np.dot(stack[start:end], stack[start:].T).astype(np.float64)
+    ssd = sq_norms[start:end, np.newaxis] + sq_norms[np.newaxis, start:] - 2 * products
+    return start, end, ssd
+
+def compute_RMSD_matrix(data_list, dtype=np.float32, n_processes=1, block_size=None,
+                        refine_ratio=0.01):
+    """
+    Compute pairwise RMSD (%) between all heatmaps in the list
+
+    Each heatmap is normalized once and the RMSD is computed from the dot products
+    of the stacked maps, using ||a - b||^2 = ||a||^2 + ||b||^2 - 2a.b. The maps are
+    centered on the mean map beforehand and pairs that are nearly identical (where
+    the subtraction loses precision) are recomputed directly.
+
+    Parameters
+    ----------
+    data_list : list of 2D arrays
+        heatmaps of the same shape
+    dtype : numpy dtype
+        dtype of the normalized stack, float32 halves the memory requirement
+    n_processes : int
+        number of processes used to compute the blocks of the matrix
+    block_size : int
+        number of rows in each block, by default the rows are split evenly between
+        the processes
+    refine_ratio : float
+        pairs with ||a - b||^2 < refine_ratio * (||a||^2 + ||b||^2) are recomputed
+
+    Returns
+    -------
+    matrix : 2D array
+        symmetric (n_maps, n_maps) array of pRMSD values
+    """
+    tstart = time.time()
+    stack = get_normalized_stack(data_list, dtype)
+    n_maps, n_pixels = stack.shape
+    stack -= stack.mean(axis=0, dtype=np.float64).astype(stack.dtype)
+    sq_norms = np.einsum("ij,ij->i", stack, stack, dtype=np.float64)
+
+    n_processes = max(int(n_processes), 1)
+    if block_size is None:
+        block_size = int(np.ceil(n_maps / float(n_processes)))
+    block_size = max(int(block_size), 1)
+    blocks = [(start, min(start + block_size, n_maps)) for start in range(0, n_maps, block_size)]
+
+    ssd = np.zeros((n_maps, n_maps), dtype=np.float64)
+    if n_processes > 1 and len(blocks) > 1:
+        with ProcessPoolExecutor(max_workers=n_processes) as executor:
+            results = [executor.submit(_compute_RMSD_block, stack, sq_norms, start, end)
+                       for start, end in blocks]
+            results = [result.result() for result in results]
+    else:
+        results = [_compute_RMSD_block(stack, sq_norms, start, end) for start, end in blocks]
+
+    for start, end, block in results:
+        ssd[start:end, start:] = block
+    # only upper triangle was computed
+    ssd = np.triu(ssd, 1)
+
+    # recompute pairs affected by cancellation
+    rows, cols = np.nonzero(np.triu(ssd < refine_ratio * (sq_norms[:, np.newaxis] + sq_norms), 1))
+    for row in np.unique(rows):
+        row_cols = cols[rows == row]
+        diff = stack[row_cols].astype(np.float64) - stack[row]
+        ssd[row, row_cols] = np.einsum("ij,ij->i", diff, diff)
+
+    ssd = ssd + ssd.T
+    np.maximum(ssd, 0, out=ssd)
+    matrix = np.sqrt(ssd / n_pixels) * 100
+
+    print("Computed {}x{} RMSD matrix in {:.4f} seconds".format(n_maps, n_maps, time.time() - tstart))
+    return matrix
+
+def normalize_columns(inputData):
+    """
+    Normalize each column (voltage) of the array to maximum intensity of 1, works
+    on the last two dimensions so a stack of heatmaps can be normalized at once.
+    NaNs are ignored when finding the maximum and empty columns are set to 0
+    """
+    inputData = np.asarray(inputData, dtype=np.float64)
+    max_vals = np.fmax.reduce(inputData, axis=-2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        normData = np.divide(inputData, max_vals[..., np.newaxis, :])
+    np.nan_to_num(normData, copy=False)
+    return normData
+
+def _compute_RMSF(inputData, reference):
+    """ Compute RMSF (%) of each column between (stack of) arrays and the reference """
+    tempArray = normalize_columns(inputData) - normalize_columns(reference)
+    return np.sqrt(np.mean(tempArray ** 2, axis=-2)) * 100
+
 def compute_RMSF(inputData1 = None, inputData2 = None): # computeRMSF
     """
     Compute the pairwise RMSF for a pair of arrays. RMSF is computed by comparing 
@@ -56,24 +177,32 @@ def compute_RMSF(inputData1 = None, inputData2 = None): # computeRMSF
         print("The two arrays are of different size! Cannot compare.")
         return
     else:
-        pRMSFlist = []
-        size = len(inputData1[1,:])
-        for row in range(0,size,1):
-            # Before computing the value of RMSF, we have to normalize to 1 
-            # to convert to percentage
-            inputData1norm = normalize_1D(inputData=inputData1[:,row])
-            np.nan_to_num(inputData1norm, copy=False)
-            inputData2norm = normalize_1D(inputData=inputData2[:,row])
-            np.nan_to_num(inputData2norm, copy=False)
-            # Compute difference
-            tempArray = (inputData1norm - inputData2norm) 
-            tempArray2 = tempArray**2
-            # Calculate RMSF/D value
-            RMSF = ((np.average(tempArray2))**0.5)
-            pRMSF = RMSF * 100
-            pRMSFlist.append(pRMSF)
+        pRMSFlist = _compute_RMSF(inputData1, inputData2)
     return pRMSFlist
- 
+
+def compute_RMSF_batch(data_list, reference):
+    """
+    Compute RMSF of each heatmap in the list against the reference heatmap
+
+    Parameters
+    ----------
+    data_list : list of 2D arrays or 3D array
+        N heatmaps with the same shape as the reference
+    reference : 2D array
+        reference heatmap
+
+    Returns
+    -------
+    pRMSF : 2D array
+        (N, n_voltages) array of RMSF values
+    """
+    reference = np.asarray(reference)
+    for data in data_list:
+        if np.shape(data) != reference.shape:
+            raise ValueError("The arrays are of different size! Cannot compare.")
+
+    return _compute_RMSF(np.asarray(data_list), reference)
+
 def compute_variance(inputData = None): # computeVariance
     output = np.var(inputData, axis=0)
     return output
@@ -17,6 +17,11 @@
 # -------------------------------------------------------------------------
 # __author__ lukasz.g.migas
 
+import os
+import wx
+import shutil
+import tempfile
+import multiprocessing
 import numpy as np
 from time import time as ttime
 
@@ -32,6 +37,8 @@ import processing.heatmap as pr_heatmap
 import processing.origami_ms as pr_origami
 import processing.activation as pr_activation
 import processing.utils as pr_utils
+import processing.pipeline as pr_pipeline
+import processing.unidec_batch as pr_unidec_batch
 import processing.peptide_annotation as pr_frag
 import dialogs as dialogs
 import unidec as unidec
@@ -60,6 +67,7 @@ class data_processing():
         # unidec parameters
         self.unidec_dataset = None
         self.unidec_document = None
+        self.unidec_batch = None
         
     def _on_get_document(self):
         self.presenter.currentDoc = self.documentTree.on_enable_document()
@@ -749,35 +757,39 @@ class data_processing():
         if self.config.processParamsWindow_on_off:
             self.view.panelProcessData.onSetupValues(evt=None)
         
+        # Intermediate results of each stage are cached so only stages that follow
+        # the changed parameter are recomputed
+        crop, linearize, smooth, threshold, normalize = None, None, None, None, None
         if self.config.ms_process_crop:
-            kwargs = {'min':self.config.ms_crop_min,
-                      'max':self.config.ms_crop_max}
-            msX, msY = pr_spectra.crop_1D_data(msX, msY, **kwargs)
+            crop = {'min':self.config.ms_crop_min,
+                    'max':self.config.ms_crop_max}
         
         if self.config.ms_process_linearize and msX is not None:
-            kwargs = {'auto_range':self.config.ms_auto_range,
-                      'mz_min':self.config.ms_mzStart, 
-                      'mz_max':self.config.ms_mzEnd, 
-                      'mz_bin':self.config.ms_mzBinSize,
-                      'linearization_mode':self.config.ms_linearization_mode}
-            msX, msY = pr_spectra.linearize_data(msX, msY, **kwargs)
+            linearize = {'auto_range':self.config.ms_auto_range,
+                         'mz_min':self.config.ms_mzStart, 
+                         'mz_max':self.config.ms_mzEnd, 
+                         'mz_bin':self.config.ms_mzBinSize,
+                         'linearization_mode':self.config.ms_linearization_mode}
         
         if self.config.ms_process_smooth:
             # Smooth data
-            kwargs = {'sigma':self.config.ms_smooth_sigma,
+            smooth = {'smoothMode':self.config.ms_smooth_mode,
+                      'sigma':self.config.ms_smooth_sigma,
                       'polyOrder':self.config.ms_smooth_polynomial,
                       'windowSize':self.config.ms_smooth_window}
-            msY = pr_spectra.smooth_1D(data=msY, smoothMode=self.config.ms_smooth_mode, **kwargs)
         
         if self.config.ms_process_threshold:
             # Threshold data
-            msY = pr_spectra.remove_noise_1D(inputData=msY, threshold=self.config.ms_threshold)
+            threshold = {'threshold':self.config.ms_threshold}
             
         if self.config.ms_process_normalize:
             # Normalize data        
             if self.config.ms_normalize: 
-                msY = pr_spectra.normalize_1D(inputData=np.asarray(msY), 
-                                              mode=self.config.ms_normalize_mode)
+                normalize = {'mode':self.config.ms_normalize_mode}
+        
+        pipeline = pr_pipeline.make_MS_pipeline(crop=crop, linearize=linearize, smooth=smooth, 
+                                                threshold=threshold, normalize=normalize)
+        msX, msY = pipeline.run(msX, msY)
             
         if replot: 
             # Plot data
@@ -867,24 +879,10 @@ class data_processing():
         if self.config.processParamsWindow_on_off:
             self.view.panelProcessData.onSetupValues(evt=None)
             
-        # Smooth data
-        if self.config.plot2D_smooth_mode != None:
-            if self.config.plot2D_smooth_mode == 'Gaussian':
-                zvals = pr_heatmap.smooth_gaussian_2D(inputData=zvals.copy(), 
-                                              sigma=self.config.plot2D_smooth_sigma)
-            elif self.config.plot2D_smooth_mode == 'Savitzky-Golay':
-                zvals = pr_heatmap.smooth_savgol_2D(inputData = zvals,
-                                                    polyOrder = self.config.plot2D_smooth_polynomial, 
-                                                    windowSize = self.config.plot2D_smooth_window)    
-        else: 
-            pass
-        # Threshold
-        zvals = pr_heatmap.remove_noise_2D(inputData=zvals.copy(), 
-                                           threshold=self.config.plot2D_threshold)
-        # Normalize
-        if self.config.plot2D_normalize == True:
-            zvals = pr_heatmap.normalize_2D(inputData=zvals.copy(), 
-                                            mode=self.config.plot2D_normalize_mode)
+        # Smooth, threshold and normalize (intermediate results are cached)
+        smooth, threshold, normalize = self._get_process_2D_parameters()
+        pipeline = pr_pipeline.make_2D_pipeline(smooth=smooth, threshold=threshold, normalize=normalize)
+        zvals, = pipeline.run(zvals)
 
         # As a precaution, remove inf
         zvals[zvals == -np.inf] = 0
@@ -917,6 +915,44 @@ class data_processing():
                           'threshold':self.config.plot2D_threshold}
             return zvals, parameters
                 
+    def _get_process_2D_parameters(self):
+        """
+        Get parameters of the smooth, threshold and normalize steps from config
+        """
+        smooth, normalize = None, None
+        if self.config.plot2D_smooth_mode != None:
+            smooth = {'smoothMode':self.config.plot2D_smooth_mode,
+                      'sigma':self.config.plot2D_smooth_sigma,
+                      'polyOrder':self.config.plot2D_smooth_polynomial,
+                      'windowSize':self.config.plot2D_smooth_window}
+        threshold = {'threshold':self.config.plot2D_threshold}
+        if self.config.plot2D_normalize == True:
+            normalize = {'mode':self.config.plot2D_normalize_mode}
+            
+        return smooth, threshold, normalize
+    
+    def on_process_2D_batch(self, zvals_list):
+        """
+        Process many heatmaps at once - smooth, threshold and normalize
+        @param zvals_list (list): list of 2D arrays
+        @return list of processed arrays, processing parameters
+        """
+        # Check values
+        self.config.onCheckValues(data_type='process')
+        if self.config.processParamsWindow_on_off:
+            self.view.panelProcessData.onSetupValues(evt=None)
+        
+        smooth, threshold, normalize = self._get_process_2D_parameters()
+        zvals_list = pr_heatmap.process_2D_batch(zvals_list, smooth=smooth, threshold=threshold, 
+                                                 normalize=normalize, 
+                                                 n_threads=self.config.plot2D_process_threads)
+        parameters = {'smooth_mode':self.config.plot2D_smooth_mode,
+                      'sigma':self.config.plot2D_smooth_sigma,
+                      'polyOrder':self.config.plot2D_smooth_polynomial,
+                      'windowSize':self.config.plot2D_smooth_window,
+                      'threshold':self.config.plot2D_threshold}
+        return zvals_list, parameters
+                
     def on_process_2D_and_add_data(self, document=None, dataset=None, ionName=None):
         if document == None or dataset == None:
             self.docs = self._on_get_document()
@@ -1082,6 +1118,40 @@ class data_processing():
             if self.config.unidec_mzEnd > kwargs['mz_max']:
                 self.config.unidec_mzEnd = np.round(kwargs['mz_max'], 0)
                 
+    def _get_unidec_parameters(self):
+        """
+        Get UniDec config attributes from the current settings
+        """
+        parameters = {# common parameters
+                      'numit':self.config.unidec_maxIterations,
+                      'inmemoryflag':int(self.config.unidec_in_memory),
+                      'cacheflag':int(self.config.unidec_cache and self.config.unidec_cache_path is not None),
+                      'cachedir':self.config.unidec_cache_path,
+                      'cachesize':self.config.unidec_cache_size,
+                      # preprocess
+                      'minmz':self.config.unidec_mzStart,
+                      'maxmz':self.config.unidec_mzEnd,
+                      'mzbins':self.config.unidec_mzBinSize,
+                      'smooth':self.config.unidec_gaussianFilter,
+                      'accvol':self.config.unidec_accelerationV,
+                      'linflag':self.config.unidec_linearization_choices[self.config.unidec_linearization],
+                      'cmap':self.config.currentCmap,
+                      # unidec engine
+                      'masslb':self.config.unidec_mwStart,
+                      'massub':self.config.unidec_mwEnd,
+                      'massbins':self.config.unidec_mwFrequency,
+                      'startz':self.config.unidec_zStart,
+                      'endz':self.config.unidec_zEnd,
+                      'numz':self.config.unidec_zEnd - self.config.unidec_zStart,
+                      'psfun':self.config.unidec_peakFunction_choices[self.config.unidec_peakFunction],
+                      # peak finding
+                      'peaknorm':self.config.unidec_peakNormalization_choices[self.config.unidec_peakNormalization],
+                      'peakwindow':self.config.unidec_peakDetectionWidth,
+                      'peakthresh':self.config.unidec_peakDetectionThreshold,
+                      'separation':self.config.unidec_lineSeparation}
+        
+        return parameters
+                
     def on_run_unidec(self, dataset, task):
         
         self.unidec_dataset = dataset
@@ -1104,32 +1174,9 @@ class data_processing():
             
         if task not in ['auto_unidec']:
             # set common parameters
-            self.config.unidec_engine.config.numit = self.config.unidec_maxIterations
-            # preprocess
-            self.config.unidec_engine.config.minmz = self.config.unidec_mzStart
-            self.config.unidec_engine.config.maxmz = self.config.unidec_mzEnd
-            self.config.unidec_engine.config.mzbins = self.config.unidec_mzBinSize
-            self.config.unidec_engine.config.smooth = self.config.unidec_gaussianFilter
-            self.config.unidec_engine.config.accvol = self.config.unidec_accelerationV
-            self.config.unidec_engine.config.linflag = self.config.unidec_linearization_choices[self.config.unidec_linearization]
-            self.config.unidec_engine.config.cmap = self.config.currentCmap
-    
-            # unidec engine 
-            self.config.unidec_engine.config.masslb = self.config.unidec_mwStart
-            self.config.unidec_engine.config.massub = self.config.unidec_mwEnd
-            self.config.unidec_engine.config.massbins = self.config.unidec_mwFrequency
-            self.config.unidec_engine.config.startz = self.config.unidec_zStart
-            self.config.unidec_engine.config.endz = self.config.unidec_zEnd
-            self.config.unidec_engine.config.numz = self.config.unidec_zEnd - self.config.unidec_zStart
-            self.config.unidec_engine.config.psfun = self.config.unidec_peakFunction_choices[self.config.unidec_peakFunction]
-            
-            # peak finding
-            self.config.unidec_engine.config.peaknorm = self.config.unidec_peakNormalization_choices[self.config.unidec_peakNormalization]
-            self.config.unidec_engine.config.peakwindow = self.config.unidec_peakDetectionWidth
-            self.config.unidec_engine.config.peakthresh = self.config.unidec_peakDetectionThreshold
-            self.config.unidec_engine.config.separation = self.config.unidec_lineSeparation
+            for key, value in self._get_unidec_parameters().items():
+                setattr(self.config.unidec_engine.config, key, value)
         
-         
          # load data
         if task in ['auto_unidec', 'load_data_unidec', 'run_all_unidec']:
             self.presenter.onThreading(None, ("UniDec: Loading data...", 4, 1) , action='updateStatusbar')
@@ -1181,6 +1228,8 @@ class data_processing():
             try: 
                 self.config.unidec_engine.run_unidec()
                 self.config.unidec_peakWidth = self.config.unidec_engine.config.mzsig
+                if self.config.unidec_engine.cache_hit:
+                    self.presenter.onThreading(None, ("UniDec: Loaded results from cache...", 4, 2) , action='updateStatusbar')
             except IndexError:
                 dlgBox(exceptionTitle="Error",
                        exceptionMsg="Load and pre-process data first", 
@@ -1245,7 +1294,96 @@ class data_processing():
         # add data to document
         self.on_add_unidec(task, dataset, document_title=document_title)
 
-    def on_add_unidec(self, task, dataset, document_title=None):
+    def on_run_unidec_batch(self, items):
+        """
+        Deconvolve many mass spectra in parallel. Results are added to the document as soon
+        as each spectrum is finished
+        @param items (list): list of [document title, dataset] of `multipleMassSpectrum` items
+        """
+        if self.unidec_batch is not None and self.unidec_batch.is_running():
+            self.presenter.onThreading(None, ("UniDec: Batch deconvolution is already running", 4), 
+                                       action='updateStatusbar')
+            return
+        
+        n_processes = self.config.unidec_batch_processes
+        if n_processes <= 0:
+            n_processes = max(multiprocessing.cpu_count() - 1, 1)
+        peak_width = None
+        if not self.config.unidec_peakWidth_auto:
+            peak_width = self.config.unidec_peakWidth
+        
+        # each spectrum is processed in its own working directory
+        batch_folder = tempfile.mkdtemp(prefix="unidec_batch_", dir=self.config.temporary_data)
+        jobs = []
+        for document_title, dataset in items:
+            try:
+                data = self.presenter.documentsDict[document_title].multipleMassSpectrum[dataset]
+            except KeyError:
+                continue
+            msX, msY = data['xvals'], data['yvals']
+            self._check_unidec_input(**{'mz_min':msX[0], 'mz_max':msX[-1]})
+            parameters = self._get_unidec_parameters()
+            parameters['UniDecPath'] = self.config.unidec_path
+            
+            file_name = clean_filename("".join([document_title, "_", dataset]))
+            folder = os.path.join(batch_folder, "%04d" % len(jobs))
+            os.mkdir(folder)
+            jobs.append({'document':document_title, 'dataset':dataset,
+                         'kwargs':{'msX':msX, 'msY':msY, 'file_name':file_name, 'folder':folder,
+                                   'parameters':parameters, 'peak_width':peak_width}})
+        if len(jobs) == 0:
+            shutil.rmtree(batch_folder, ignore_errors=True)
+            return
+        
+        self.unidec_batch = pr_unidec_batch.UniDecBatch(
+            jobs, n_processes=n_processes,
+            on_result=lambda job, engine: wx.CallAfter(self._on_add_unidec_batch_result, job, engine),
+            on_error=lambda job, err: wx.CallAfter(self._on_unidec_batch_error, job, err),
+            on_progress=lambda n_finished, n_jobs: wx.CallAfter(self._on_unidec_batch_progress, n_finished, n_jobs),
+            on_finish=lambda n_finished, n_jobs, cancelled: wx.CallAfter(self._on_unidec_batch_finish, n_finished, n_jobs, 
+                                                                         cancelled, batch_folder))
+        self.presenter.onThreading(None, ("UniDec: Deconvoluting {} spectra using {} processes...".format(len(jobs), n_processes), 4), 
+                                   action='updateStatusbar')
+        self.unidec_batch.start()
+        
+    def on_cancel_unidec_batch(self):
+        if self.unidec_batch is not None and self.unidec_batch.is_running():
+            self.unidec_batch.cancel()
+            self.presenter.onThreading(None, ("UniDec: Cancelling batch deconvolution...", 4), 
+                                       action='updateStatusbar')
+        
+    def _on_add_unidec_batch_result(self, job, engine):
+        if self.unidec_batch is not None and self.unidec_batch.is_cancelled():
+            return
+        if job['document'] not in self.presenter.documentsDict:
+            return
+        
+        # results are added from the job's engine, the engine of the UniDec panel is not changed
+        try:
+            self.on_add_unidec('run_all_unidec', job['dataset'], document_title=job['document'], engine=engine)
+        except (ValueError, IndexError) as err:
+            self._on_unidec_batch_error(job, err)
+            
+    def _on_unidec_batch_error(self, job, err):
+        print("UniDec: Failed to deconvolute {} ({}): {}".format(job['dataset'], job['document'], err))
+        
+    def _on_unidec_batch_progress(self, n_finished, n_jobs):
+        self.presenter.onThreading(None, ("UniDec: Deconvoluted {}/{} spectra".format(n_finished, n_jobs), 4), 
+                                   action='updateStatusbar')
+        
+    def _on_unidec_batch_finish(self, n_finished, n_jobs, cancelled, batch_folder=None):
+        # results were already imported so the input/output files are no longer needed
+        if batch_folder is not None:
+            shutil.rmtree(batch_folder, ignore_errors=True)
+        if cancelled:
+            msg = "UniDec: Cancelled batch deconvolution ({}/{} spectra)".format(n_finished, n_jobs)
+        else:
+            msg = "UniDec: Finished batch deconvolution ({} spectra)".format(n_finished)
+        self.presenter.onThreading(None, (msg, 4), action='updateStatusbar')
+
+    def on_add_unidec(self, task, dataset, document_title=None, engine=None):
+        if engine is None:
+            engine = self.config.unidec_engine
                
 #         # export current MS to file
 #         if 'MS' in self.document: 
@@ -1282,34 +1420,34 @@ class data_processing():
             
 
         if task in ['auto_unidec', 'run_all_unidec', 'preprocess_unidec']:
-            raw_data = {'xvals':self.config.unidec_engine.data.data2[:, 0],
-                        'yvals':self.config.unidec_engine.data.data2[:, 1],
+            raw_data = {'xvals':engine.data.data2[:, 0],
+                        'yvals':engine.data.data2[:, 1],
                         'color':[0,0,0], 'label':"Data", 'xlabels':"m/z", 
                         'ylabels':"Intensity"}
             # add data
             data['unidec']['Processed'] = raw_data
             
         if task in ['auto_unidec', 'run_all_unidec', "run_unidec"]:
-            fit_data = {'xvals':[self.config.unidec_engine.data.data2[:, 0], 
-                                 self.config.unidec_engine.data.data2[:, 0]],
-                        'yvals':[self.config.unidec_engine.data.data2[:, 1], 
-                                 self.config.unidec_engine.data.fitdat],
+            fit_data = {'xvals':[engine.data.data2[:, 0], 
+                                 engine.data.data2[:, 0]],
+                        'yvals':[engine.data.data2[:, 1], 
+                                 engine.data.fitdat],
                         'colors':[[0,0,0], [1,0,0]], 'labels':['Data', 'Fit Data'],
                         'xlabel':"m/z", 'ylabel':"Intensity", 
-                        'xlimits':[np.min(self.config.unidec_engine.data.data2[:, 0]), 
-                                   np.max(self.config.unidec_engine.data.data2[:, 0])]}
-            mw_distribution_data = {'xvals':self.config.unidec_engine.data.massdat[:, 0],
-                                    'yvals':self.config.unidec_engine.data.massdat[:, 1],
+                        'xlimits':[np.min(engine.data.data2[:, 0]), 
+                                   np.max(engine.data.data2[:, 0])]}
+            mw_distribution_data = {'xvals':engine.data.massdat[:, 0],
+                                    'yvals':engine.data.massdat[:, 1],
                                     'color':[0,0,0], 'label':"Data", 'xlabels':"Mass (Da)",
                                     'ylabels':"Intensity"}
-            mz_grid_data = {'grid':self.config.unidec_engine.data.mzgrid,
+            mz_grid_data = {'grid':engine.data.mzgrid,
                             'xlabels':" m/z (Da)", 'ylabels':"Charge",
-                            'cmap':self.config.unidec_engine.config.cmap}
-            mw_v_z_data = {'xvals':self.config.unidec_engine.data.massdat[:, 0],
-                           'yvals':self.config.unidec_engine.data.ztab,
-                           'zvals':self.config.unidec_engine.data.massgrid,
+                            'cmap':engine.config.cmap}
+            mw_v_z_data = {'xvals':engine.data.massdat[:, 0],
+                           'yvals':engine.data.ztab,
+                           'zvals':engine.data.massgrid,
                            'xlabels':"Mass (Da)", 'ylabels':"Charge",
-                           'cmap':self.config.unidec_engine.config.cmap}
+                           'cmap':engine.config.cmap}
             # add data
             data['unidec']['Fitted'] = fit_data
             data['unidec']['MW distribution'] = mw_distribution_data
@@ -1318,17 +1456,17 @@ class data_processing():
             
         if task in ['auto_unidec', 'run_all_unidec', 'pick_peaks_unidec']:
             # individually plotted
-            individual_dict = self.get_unidec_data(data_type="Individual MS")
-            barchart_dict = self.get_unidec_data(data_type="Barchart")
-            massList, massMax = self.get_unidec_data(data_type="MassList")
+            individual_dict = self.get_unidec_data(data_type="Individual MS", engine=engine)
+            barchart_dict = self.get_unidec_data(data_type="Barchart", engine=engine)
+            massList, massMax = self.get_unidec_data(data_type="MassList", engine=engine)
             individual_dict['_massList_'] = [massList, massMax]
             
             # add data
             data['unidec']['m/z with isolated species'] = individual_dict
             data['unidec']['Barchart'] = barchart_dict
-            data['unidec']['Charge information'] = self.config.unidec_engine.get_charge_peaks()
+            data['unidec']['Charge information'] = engine.get_charge_peaks()
         
-        data['temporary_unidec'] = self.config.unidec_engine
+        data['temporary_unidec'] = engine
             
         # update data dictionary
         if dataset == 'Mass Spectrum':
@@ -1347,15 +1485,16 @@ class data_processing():
 
     def get_unidec_data(self, data_type="Individual MS", **kwargs):
         
+        engine = kwargs.get("engine", self.config.unidec_engine)
         if data_type == "Individual MS":
             stickmax = 1.0
             num = 0
             individual_dict = dict()
             legend_text = [[[0,0,0], "Raw"]]
             colors, labels = [], []
-#             charges = self.config.unidec_engine.get_charge_peaks()
-            for i in xrange(0, self.config.unidec_engine.pks.plen):
-                p = self.config.unidec_engine.pks.peaks[i]
+#             charges = engine.get_charge_peaks()
+            for i in xrange(0, engine.pks.plen):
+                p = engine.pks.peaks[i]
                 if p.ignore == 0:
                     list1, list2 = [], []
                     if (not isempty(p.mztab)) and (not isempty(p.mztab2)):
@@ -1363,32 +1502,32 @@ class data_processing():
                         mztab2 = np.array(p.mztab2)
                         maxval = np.amax(mztab[:, 1])
                         for k in range(0, len(mztab)):
-                            if mztab[k, 1] > self.config.unidec_engine.config.peakplotthresh * maxval:
+                            if mztab[k, 1] > engine.config.peakplotthresh * maxval:
                                 list1.append(mztab2[k, 0])
                                 list2.append(mztab2[k, 1])
                                 
-                        if self.config.unidec_engine.pks.plen <= 15:
+                        if engine.pks.plen <= 15:
                             color=convertRGB255to1(self.config.customColors[i])
                         else:
                             color=p.color
                         colors.append(color)
                         labels.append("MW: {:.2f}".format(p.mass))
                         legend_text.append([color, "MW: {:.2f}".format(p.mass)])
-#                         self._calculate_peak_widths(charges, p.mass, self.config.unidec_engine.config.mzsig, adductIon)
+#                         self._calculate_peak_widths(charges, p.mass, engine.config.mzsig, adductIon)
                         
                         individual_dict["MW: {:.2f}".format(p.mass)] = {'scatter_xvals':np.array(list1),
                                                                         'scatter_yvals':np.array(list2),
                                                                         'marker':p.marker, 
                                                                         'color':color,
                                                                         'label':"MW: {:.2f}".format(p.mass),
-                                                                        'line_xvals':self.config.unidec_engine.data.data2[:, 0],
-                                                                        'line_yvals':np.array(p.stickdat)/stickmax-(num + 1) * self.config.unidec_engine.config.separation
+                                                                        'line_xvals':engine.data.data2[:, 0],
+                                                                        'line_yvals':np.array(p.stickdat)/stickmax-(num + 1) * engine.config.separation
                                                                         }
                         num += 1
 
             individual_dict['legend_text'] = legend_text
-            individual_dict['xvals'] = self.config.unidec_engine.data.data2[:, 0]
-            individual_dict['yvals'] = self.config.unidec_engine.data.data2[:, 1]
+            individual_dict['xvals'] = engine.data.data2[:, 0]
+            individual_dict['yvals'] = engine.data.data2[:, 1]
             individual_dict['xlabel'] = "m/z (Da)"
             individual_dict['ylabel'] = "Intensity"
             individual_dict['colors'] = colors
@@ -1398,8 +1537,8 @@ class data_processing():
         
         elif data_type == 'MassList':
             mwList, heightList = [], []
-            for i in range(0, self.config.unidec_engine.pks.plen):
-                p = self.config.unidec_engine.pks.peaks[i]
+            for i in range(0, engine.pks.plen):
+                p = engine.pks.peaks[i]
                 if p.ignore == 0:
                     mwList.append("MW: {:.2f} ({:.2f} %)".format(p.mass, p.height))
                     heightList.append(p.height)
@@ -1407,13 +1546,13 @@ class data_processing():
             return mwList, mwList[heightList.index(np.max(heightList))]
         
         elif data_type == 'Barchart':
-            if self.config.unidec_engine.pks.plen > 0:
+            if engine.pks.plen > 0:
                 num = 0
                 yvals, colors, labels, legend_text, markers, legend = [], [], [], [], [], []
-                for p in self.config.unidec_engine.pks.peaks:
+                for p in engine.pks.peaks:
                     if p.ignore == 0:
                         yvals.append(p.height)
-                        if self.config.unidec_engine.pks.plen <= 15:
+                        if engine.pks.plen <= 15:
                             color = convertRGB255to1(self.config.customColors[num])
                         else:
                             color = p.color
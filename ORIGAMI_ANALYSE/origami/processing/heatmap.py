@@ -17,13 +17,21 @@
 # -------------------------------------------------------------------------
 # __author__ lukasz.g.migas
 
+import time
 import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from scipy.signal import savgol_filter 
 from scipy.ndimage import gaussian_filter
-from sklearn.preprocessing import normalize
 from gui_elements.misc_dialogs import dlgBox
+from utils import as_processing_array, get_processing_dtype
 
-def adjust_min_max_intensity(inputData=None, min_threshold=0.0, max_threshold=1.0): # threshold2D
+def adjust_min_max_intensity(inputData=None, min_threshold=0.0, max_threshold=1.0, inplace=False): # threshold2D
+    """
+    Set values below min_threshold to 0 and above max_threshold to maximum. If `inplace`
+    is True, the input array is modified (as long as it has the processing precision)
+    """
+    inputData = as_processing_array(inputData, inplace)
     
     # Check min_threshold is larger than max_threshold
     if min_threshold > max_threshold:
@@ -48,56 +56,84 @@ def adjust_min_max_intensity(inputData=None, min_threshold=0.0, max_threshold=1.
     
     return inputData
 
-def remove_noise_2D(inputData=None, threshold=0): # removeNoise
+def check_threshold_2D(threshold, max_value):
+    """
+    Check threshold against the maximum intensity of the heatmap
+    :return: threshold, warning message (or None)
+    """
     # Check whether threshold values meet the criteria.
     # First check if value is not above the maximum or below 0
-    if (threshold > np.max(inputData)) or (threshold < 0):
-        dlgBox(exceptionTitle='Warning', 
-               exceptionMsg= "Threshold value was too high - the maximum value is %s. Value was reset to 0. Consider reducing your threshold value." % np.max(inputData), 
-               type="Warning")
-        threshold=0
+    if (threshold > max_value) or (threshold < 0):
+        return 0, "Threshold value was too high - the maximum value is %s. Value was reset to 0. Consider reducing your threshold value." % max_value
     elif threshold == 0.0:
         pass
     # Check if the value is a fraction (i.e. if working on a normalized dataset)
-    elif (threshold < (np.max(inputData)/10000)): # This is somewhat guesswork! It won't be 100 % fool proof
-        if (threshold > 1) or (threshold <= 0):
-            threshold=0
-        dlgBox(exceptionTitle='Warning', 
-               exceptionMsg= "Threshold value was too low - the maximum value is %s. Value was reset to 0. Consider increasing your threshold value." % np.max(inputData), 
-               type="Warning")
-        threshold=0
+    elif (threshold < (max_value/10000)): # This is somewhat guesswork! It won't be 100 % fool proof
+        return 0, "Threshold value was too low - the maximum value is %s. Value was reset to 0. Consider increasing your threshold value." % max_value
     # Or leave it as is if the values are correct
+    return threshold, None
+
+def show_warning(message, messages=None):
+    """
+    Show warning dialog or, if `messages` is a list (e.g. when processing in a worker
+    thread), add the message to it so that the caller can show it in the main thread
+    """
+    if messages is not None:
+        messages.append(message)
     else:
-        threshold=threshold
+        dlgBox(exceptionTitle='Warning', exceptionMsg=message, type="Warning")
+
+def remove_noise_2D(inputData=None, threshold=0, inplace=False, messages=None): # removeNoise
+    """
+    Set values below threshold to 0. Stack of heatmaps (n_maps x n_rows x n_cols) is
+    thresholded in one go, with the threshold checked against the maximum of each heatmap
+    """
+    inputData = as_processing_array(inputData, inplace)
+    if inputData.ndim == 3:
+        thresholds, stack_messages = [], []
+        for max_value in np.max(inputData.reshape(inputData.shape[0], -1), axis=1):
+            map_threshold, message = check_threshold_2D(threshold, max_value)
+            thresholds.append(map_threshold)
+            if message is not None:
+                stack_messages.append(message)
+        # show only one warning for the whole stack
+        if stack_messages:
+            show_warning(stack_messages[0], messages)
+        inputData[inputData <= np.reshape(thresholds, (-1, 1, 1))] = 0
+        return inputData
+
+    threshold, message = check_threshold_2D(threshold, np.max(inputData))
+    if message is not None:
+        show_warning(message, messages)
           
     inputData[inputData<=threshold] = 0
     return inputData    
 
-def smooth_gaussian_2D(inputData = None, sigma = 2): # smoothDataGaussian
+def smooth_gaussian_2D(inputData = None, sigma = 2, inplace=False, messages=None): # smoothDataGaussian
     # Check if input data is there
     if inputData is None or len(inputData) == 0:
         return None
     if sigma < 0:
-        dlgBox(exceptionTitle='Warning', 
-               exceptionMsg= "Value of sigma is too low. Value was reset to 1",
-               type="Warning")
+        show_warning("Value of sigma is too low. Value was reset to 1", messages)
         sigma=1
     else:
         sigma=sigma
-    dataOut = gaussian_filter(inputData, sigma = sigma, order=0)
-    dataOut[dataOut < 0] = 0
+    dataOut = as_processing_array(inputData, inplace)
+    # stack of heatmaps is only smoothed within each heatmap
+    if dataOut.ndim == 3:
+        sigma = (0, sigma, sigma)
+    gaussian_filter(dataOut, sigma = sigma, order=0, output=dataOut)
+    np.maximum(dataOut, 0, out=dataOut)
     return dataOut    
 # ------------ #
  
-def smooth_savgol_2D(inputData = None, polyOrder = 2, windowSize = 5): # smoothDataSavGol
+def smooth_savgol_2D(inputData = None, polyOrder = 2, windowSize = 5, inplace=False, messages=None): # smoothDataSavGol
     # Check if input data is there
     if inputData is None or len(inputData) == 0:
         return None
     # Check whether polynomial order is of correct size
     if (polyOrder<=0) :
-        dlgBox(exceptionTitle='Warning', 
-               exceptionMsg= "Polynomial order is too small. Value was reset to 2",
-               type="Warning")
+        show_warning("Polynomial order is too small. Value was reset to 2", messages)
         polyOrder=2   
     else:
         polyOrder=polyOrder
@@ -107,37 +143,111 @@ def smooth_savgol_2D(inputData = None, polyOrder = 2, windowSize = 5): # smoothD
     elif (windowSize % 2) and (windowSize>polyOrder) :
         windowSize=windowSize
     elif windowSize<= polyOrder:
-        dlgBox(exceptionTitle='Warning', 
-               exceptionMsg= "Window size was smaller than the polynomial order. Value was reset to %s" % (polyOrder+1),
-               type="Warning")
+        show_warning("Window size was smaller than the polynomial order. Value was reset to %s" % (polyOrder+1),
+                     messages)
         windowSize=polyOrder+1
     else:
         print('Window size is even. Adding 1 to make it odd.')
         windowSize=windowSize+1
           
-    dataOut = savgol_filter(inputData, polyorder=polyOrder, window_length=windowSize, axis=0)
+    dataOut = savgol_filter(inputData, polyorder=polyOrder, window_length=windowSize, axis=-2)
     dataOut[dataOut < 0] = 0 # Remove any values that are below 0
-    return dataOut
+    if inplace:
+        inputData = as_processing_array(inputData, inplace)
+        inputData[:] = dataOut
+        return inputData
+    return as_processing_array(dataOut, True)
 # ------------ #
  
-def normalize_2D(inputData = None, mode='Maximum'): # normalizeIMS
+def normalize_2D(inputData = None, mode='Maximum', inplace=False): # normalizeIMS
     """
-    Normalize 2D array to appropriate mode
+    Normalize 2D array (or stack of 2D arrays) to appropriate mode. Normalization is done
+    in the processing precision and, if `inplace` is True, without making a copy of the input array
     """
-    inputData = np.nan_to_num(inputData)
+    normData = as_processing_array(inputData, inplace)
+    np.nan_to_num(normData, copy=False)
 #      Normalize 2D array to maximum intensity of 1
     if mode == "Maximum":
-        normData = normalize(inputData.astype(np.float64), axis=0, norm='max')
+        norms = np.max(normData, axis=-2)
     elif mode == 'Logarithmic':
-        normData = np.log10(inputData.astype(np.float64))
+        np.log10(normData, out=normData)
     elif mode == 'Natural log':
-         normData = np.log(inputData.astype(np.float64))
+        np.log(normData, out=normData)
     elif mode == 'Square root':
-         normData = np.sqrt(inputData.astype(np.float64))
+        np.sqrt(normData, out=normData)
     elif mode == 'Least Abs Deviation':
-         normData = normalize(inputData.astype(np.float64), axis=0, norm='l1')
+        norms = np.sum(np.abs(normData), axis=-2)
     elif mode == 'Least Squares':
-         normData = normalize(inputData.astype(np.float64), axis=0, norm='l2')
+        norms = np.sqrt(np.einsum("...ij,...ij->...j", normData, normData))
+
+    # normalize each column (same as sklearn's normalize(axis=0))
+    if mode in ["Maximum", "Least Abs Deviation", "Least Squares"]:
+        norms[norms == 0.0] = 1.0
+        normData /= np.expand_dims(norms, -2)
      #TODO add except ValueError which will return raw data
     return normData
 
+
+
+def process_2D_stack(stack, smooth=None, threshold=None, normalize=None, messages=None):
+    """
+    Smooth, threshold and normalize stack of heatmaps (n_maps x n_rows x n_cols) in place
+    Each argument is a dictionary of parameters (as in `on_process_2D`) or None if the step
+    should be skipped. If `messages` is a list, warnings are added to it instead of shown
+    """
+    stack = as_processing_array(stack, True)
+    if smooth is not None:
+        if smooth.get('smoothMode') == 'Gaussian':
+            smooth_gaussian_2D(stack, sigma=smooth.get('sigma', 1), inplace=True, messages=messages)
+        elif smooth.get('smoothMode') == 'Savitzky-Golay':
+            smooth_savgol_2D(stack, polyOrder=smooth.get('polyOrder', 2),
+                             windowSize=smooth.get('windowSize', 5), inplace=True, messages=messages)
+    if threshold is not None:
+        remove_noise_2D(stack, threshold=threshold.get('threshold', 0), inplace=True, messages=messages)
+    if normalize is not None:
+        normalize_2D(stack, mode=normalize.get('mode', 'Maximum'), inplace=True)
+    # As a precaution, remove inf
+    stack[stack == -np.inf] = 0
+    return stack
+
+def process_2D_batch(data_list, smooth=None, threshold=None, normalize=None, n_threads=1):
+    """
+    Process many heatmaps at once. Heatmaps with identical shape are stacked and processed
+    together, heatmaps with unique shape are processed in a thread pool. Warnings are
+    collected and only the first one is shown (in the calling thread)
+    :param data_list: list of heatmaps
+    :return: list of processed heatmaps (in the same order as `data_list`)
+    """
+    tstart = time.time()
+    groups = OrderedDict()
+    for idx, zvals in enumerate(data_list):
+        groups.setdefault(np.shape(zvals), []).append(idx)
+
+    output = [None] * len(data_list)
+    def process_group(indices):
+        messages = []
+        stack = np.array([data_list[idx] for idx in indices], dtype=get_processing_dtype())
+        stack = process_2D_stack(stack, smooth, threshold, normalize, messages)
+        for idx, zvals in zip(indices, stack):
+            output[idx] = zvals
+        return messages
+
+    stacked = [indices for indices in groups.values() if len(indices) > 1]
+    ragged = [indices for indices in groups.values() if len(indices) == 1]
+    messages = []
+    for indices in stacked:
+        messages.extend(process_group(indices))
+    if n_threads > 1 and len(ragged) > 1:
+        # dialogs can only be shown from the main thread
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            for group_messages in executor.map(process_group, ragged):
+                messages.extend(group_messages)
+    else:
+        for indices in ragged:
+            messages.extend(process_group(indices))
+    if messages:
+        show_warning(messages[0])
+
+    print("Processed {} heatmaps ({} shapes) in {:.4f} seconds".format(
+        len(data_list), len(groups), time.time() - tstart))
+    return output
@@ -57,8 +57,117 @@ def origami_combine_infrared(inputData=None, threshold=2000, noiseLevel=500, sig
     # Return array
     return dataSplitArray, xvals, yvals, dataRT, data1DT
  
+def get_scan_boundaries(firstVoltage, scanPerVoltageList):
+    """
+    Convert list of scans-per-voltage to scan boundaries, voltage `i` is made of
+    scans [boundaries[i], boundaries[i+1])
+    """
+    # scans-per-voltage are truncated in the same way as `int(x1+spv)`
+    spv = np.asarray(scanPerVoltageList, dtype=np.float64).astype(np.int64)
+    boundaries = np.zeros(len(spv) + 1, dtype=np.int64)
+    np.cumsum(spv, out=boundaries[1:])
+    return boundaries + int(firstVoltage)
+
+def get_scan_list(firstVoltage, boundaries, ColEnergyX, add_width=False):
+    """
+    Generate list of [first scan, last scan, collision voltage(, number of scans)]
+    """
+    scanList = []
+    for x1, x2, cv in zip(boundaries[:-1] - int(firstVoltage), boundaries[1:] - int(firstVoltage), ColEnergyX):
+        item = [int(x1) + firstVoltage, int(x2) + firstVoltage, cv]
+        if add_width:
+            item.append(int(x2 - x1))
+        scanList.append(item)
+    return scanList
+
+def origami_combine_scans(imsData, boundaries):
+    """
+    Combine scans into collision voltages using scan boundaries
+
+    Parameters
+    ----------
+    imsData : array
+        (n_bins, n_scans) array or (n_ions, n_bins, n_scans) array to combine
+        several ions that share the same acquisition schedule
+    boundaries : array
+        n_voltages + 1 scan indices, see `get_scan_boundaries`
+
+    Returns
+    -------
+    imsDataCEcombined : array
+        (n_bins, n_voltages) or (n_ions, n_bins, n_voltages) array
+    """
+    imsData = np.asarray(imsData)
+    boundaries = np.asarray(boundaries, dtype=np.int64)
+    n_scans = imsData.shape[-1]
+    if boundaries[-1] > n_scans or boundaries[0] < 0:
+        raise ValueError("Scan boundaries are outside of the data range (%s scans)" % n_scans)
+
+    n_voltages = len(boundaries) - 1
+    if boundaries[-1] <= boundaries[0]:
+        return np.zeros(imsData.shape[:-1] + (n_voltages,), dtype=np.float64)
+
+    cropIMSdata = imsData[..., :boundaries[-1]]
+    # reduceat returns single scan for empty blocks so they are cleared afterwards
+    starts = np.minimum(boundaries[:-1], boundaries[-1] - 1)
+    imsDataCEcombined = np.add.reduceat(cropIMSdata, starts, axis=-1, dtype=np.float64)
+    imsDataCEcombined[..., boundaries[1:] <= boundaries[:-1]] = 0
+
+    return imsDataCEcombined
+
+def get_linear_schedule(startVoltage, endVoltage, stepVoltage, scansPerVoltage):
+    numberOfVoltages=((endVoltage-startVoltage)/stepVoltage)+1
+    ColEnergyX = np.linspace(startVoltage,endVoltage, num=int(numberOfVoltages))
+    scanPerVoltageList = [scansPerVoltage] * int(numberOfVoltages)
+    return scanPerVoltageList, ColEnergyX
+
+def get_exponential_schedule(startVoltage, endVoltage, stepVoltage, scansPerVoltage,
+                             expIncrement, expPercentage, expAccumulator=0):
+    numberOfVoltages=((endVoltage-startVoltage)/stepVoltage)+1
+    ColEnergyX = np.linspace(startVoltage,endVoltage, num=int(numberOfVoltages))
+    # SPVs increase exponentially above the threshold voltage
+    expAccumulator = expAccumulator + expIncrement * np.cumsum(ColEnergyX >= endVoltage*expPercentage/100)
+    scanPerVoltageList = np.where(ColEnergyX >= endVoltage*expPercentage/100,
+                                  np.round(scansPerVoltage*np.exp(expAccumulator),0),
+                                  scansPerVoltage)
+    return scanPerVoltageList, ColEnergyX
+
+def get_boltzmann_schedule(startVoltage, endVoltage, stepVoltage, scansPerVoltage,
+                           A1=2, A2=0.07, x0=47, dx=None):
+    numberOfVoltages=((endVoltage-startVoltage)/stepVoltage)+1
+    ColEnergyX = np.linspace(startVoltage,endVoltage, num=int(numberOfVoltages))
+    scanPerVoltageFit = np.round(1/(A2+(A1-A2)/(1+np.exp((ColEnergyX-x0)/dx))),0)
+    scanPerVoltageList = scanPerVoltageFit*scansPerVoltage
+    return scanPerVoltageList, ColEnergyX
+
+def get_origami_schedule(method, **kwargs):
+    """
+    Get (scanPerVoltageList, ColEnergyX) for any of the acquisition methods
+    """
+    if method == 'Linear':
+        return get_linear_schedule(kwargs['startVoltage'], kwargs['endVoltage'],
+                                   kwargs['stepVoltage'], kwargs['scansPerVoltage'])
+    elif method == 'Exponential':
+        return get_exponential_schedule(kwargs['startVoltage'], kwargs['endVoltage'],
+                                        kwargs['stepVoltage'], kwargs['scansPerVoltage'],
+                                        kwargs['expIncrement'], kwargs['expPercentage'])
+    elif method in ['Fitted', 'Boltzmann']:
+        return get_boltzmann_schedule(kwargs['startVoltage'], kwargs['endVoltage'],
+                                      kwargs['stepVoltage'], kwargs['scansPerVoltage'],
+                                      dx=kwargs['dx'])
+    elif method == 'User-defined':
+        inputList = kwargs['inputList']
+        return inputList[:,0], inputList[:,1]
+    else:
+        raise ValueError("Unknown ORIGAMI acquisition method: %s" % method)
+
 def origami_combine_linear(imsDataInput, firstVoltage, startVoltage, endVoltage, # combineCEscansLinear
                            stepVoltage, scansPerVoltage):
+    """
+    Combine scans acquired with linear ramp. `imsDataInput` can be a (n_bins, n_scans)
+    array or a (n_ions, n_bins, n_scans) stack of ions with the same schedule.
+    The same applies to the other `origami_combine_*` functions.
+    """
     # Build dictionary with parameters
     parameters = {'firstVoltage':firstVoltage, 'startV':startVoltage,
                   'endV':endVoltage, 'stepV':stepVoltage,'spv':scansPerVoltage,
@@ -67,27 +176,15 @@ def origami_combine_linear(imsDataInput, firstVoltage, startVoltage, endVoltage,
     # Calculate information about acquisition lengths
     numberOfVoltages=((endVoltage-startVoltage)/stepVoltage)+1
     lastVoltage=firstVoltage+(scansPerVoltage*numberOfVoltages)
-    if lastVoltage > len(imsDataInput[1,:]):
-        return [None, lastVoltage, len(imsDataInput[1,:])], None, None
+    if lastVoltage > imsDataInput.shape[-1]:
+        return [None, lastVoltage, imsDataInput.shape[-1]], None, None
     else:
-        print('File has a total of: %s scans. The last scan of CE ramp is %s' %(len(imsDataInput[1,:]), lastVoltage))
+        print('File has a total of: %s scans. The last scan of CE ramp is %s' %(imsDataInput.shape[-1], lastVoltage))
    
-    # Pre-calculate X-axis information
-    ColEnergyX = np.linspace(startVoltage,endVoltage, num=numberOfVoltages)
-    # Crop IMS data to appropriate size (remove start and end regions 'reporter')
-    cropIMSdata = imsDataInput[:,int(firstVoltage)::]
-    x1 = 0
-    # Create an empty array to put data into
-    imsDataCEcombined, scanList = [], []
-    for i, cv in zip(range(int(numberOfVoltages)), ColEnergyX):
-        x2 = int(x1+scansPerVoltage)
-        scanList.append([x1+firstVoltage, x2+firstVoltage, cv])
-        _tempIMSData = cropIMSdata[:,x1:x2] # Crop appropriate range 
-        _tempIMSData = np.sum(_tempIMSData, axis=1) # Combine all into one array
-        x1 = x2
-        imsDataCEcombined=np.append(imsDataCEcombined,_tempIMSData) # Create a new array containing all IMS data         
-    # Output raw and normalized data
-    imsDataCEcombined = imsDataCEcombined.reshape((200,int(numberOfVoltages)),order='F') # Reshape list to array
+    scanPerVoltageList, ColEnergyX = get_linear_schedule(startVoltage, endVoltage, stepVoltage, scansPerVoltage)
+    boundaries = get_scan_boundaries(firstVoltage, scanPerVoltageList)
+    scanList = get_scan_list(firstVoltage, boundaries, ColEnergyX)
+    imsDataCEcombined = origami_combine_scans(imsDataInput, boundaries)
     return imsDataCEcombined, scanList, parameters
  
 # ------------ #
@@ -102,40 +199,19 @@ def origami_combine_exponential(imsDataInput, firstVoltage, # combineCEscansExpo
                   'expIncrement':expIncrement,'expPercent':expIncrement,
                   'method':'Exponential'}
     
-    # Calculate how many voltages were used 
-    numberOfVoltages=((endVoltage-startVoltage)/stepVoltage)+1
-    ColEnergyX = np.linspace(startVoltage,endVoltage, num=numberOfVoltages)
-    startScansPerVoltage = scansPerVoltage # Used as backup
     # Generate list of SPVs first
-    scanPerVoltageList = [] # Pre-set empty array
-    for i in range(int(numberOfVoltages)):
-        # Prepare list 
-        if (ColEnergyX[i] >= endVoltage*expPercentage/100):
-            expAccumulator=expAccumulator+expIncrement
-            scanPerVoltageFit = np.round(startScansPerVoltage*np.exp(expAccumulator),0)
-        else:
-            scanPerVoltageFit = startScansPerVoltage 
-        # Create a list with SPV counter
-        scanPerVoltageList.append(scanPerVoltageFit)
+    scanPerVoltageList, ColEnergyX = get_exponential_schedule(startVoltage, endVoltage, stepVoltage,
+                                                              scansPerVoltage, expIncrement,
+                                                              expPercentage, expAccumulator)
     lastVoltage=firstVoltage+(sum(scanPerVoltageList))
-    if lastVoltage > len(imsDataInput[1,:]):
-        return [None, lastVoltage, len(imsDataInput[1,:])], None, None
+    if lastVoltage > imsDataInput.shape[-1]:
+        return [None, lastVoltage, imsDataInput.shape[-1]], None, None
     else: 
-        print('File has a total of: %s scans. The last scan of CE ramp is %s' %(len(imsDataInput[1,:]), lastVoltage))
-    # Crop IMS data to appropriate size (remove start and end regions 'reporter')
-    cropIMSdata = imsDataInput[:,int(firstVoltage)::] #int(lastVoltage)]
-    x1 = 0
-    imsDataCEcombined, scanList = [], []
-    for i, cv in zip(scanPerVoltageList, ColEnergyX):
-        x2 = int(x1+i)
-        scanList.append([x1+firstVoltage, x2+firstVoltage, cv])
-        _tempIMSData = cropIMSdata[:,x1:x2] # Crop appropriate range 
-        _tempIMSData = np.sum(_tempIMSData,axis=1) # Combine all into one array
-        # Combine data into a list that will be reshaped afterwards
-        imsDataCEcombined=np.append(imsDataCEcombined,_tempIMSData) # Create a new array containing all IMS data  
-        x1 = x2 # set new starting index
-    # Output raw and normalized data
-    imsDataCEcombined = imsDataCEcombined.reshape((200,int(numberOfVoltages)),order='F') # Reshape list to array
+        print('File has a total of: %s scans. The last scan of CE ramp is %s' %(imsDataInput.shape[-1], lastVoltage))
+
+    boundaries = get_scan_boundaries(firstVoltage, scanPerVoltageList)
+    scanList = get_scan_list(firstVoltage, boundaries, ColEnergyX)
+    imsDataCEcombined = origami_combine_scans(imsDataInput, boundaries)
     return imsDataCEcombined, scanList, parameters
 # ------------ #
  
@@ -148,37 +224,20 @@ def origami_combine_boltzmann(imsDataInput, firstVoltage, # combineCEscansFitted
                   'endV':endVoltage, 'stepV':stepVoltage,'spv':scansPerVoltage,
                   'A1':A1,'A2':A2,'x0':x0,'dx':dx,'method':'Fitted'}
     
-    # Calculate how many voltages were used 
-    numberOfVoltages=((endVoltage-startVoltage)/stepVoltage)+1
-    ColEnergyX = np.linspace(startVoltage,endVoltage, num=numberOfVoltages)
-    startScansPerVoltage = scansPerVoltage # Used as backup
     # Generate list of SPVs first
-    scanPerVoltageList = [] # Pre-set empty array
-    for i in range(int(numberOfVoltages)):
-        scanPerVoltageFit = np.round(1/(A2+(A1-A2)/(1+np.exp((ColEnergyX[i]-x0)/dx))),0)
-        # Append to file
-        scanPerVoltageList.append(scanPerVoltageFit*startScansPerVoltage)
+    scanPerVoltageList, ColEnergyX = get_boltzmann_schedule(startVoltage, endVoltage, stepVoltage,
+                                                            scansPerVoltage, A1, A2, x0, dx)
  
     # Calculate last voltage
     lastVoltage=firstVoltage+(sum(scanPerVoltageList))
-    if lastVoltage > len(imsDataInput[1,:]):
-        return [None, lastVoltage, len(imsDataInput[1,:])], None, None
+    if lastVoltage > imsDataInput.shape[-1]:
+        return [None, lastVoltage, imsDataInput.shape[-1]], None, None
     else: 
-        print('File has a total of: %s scans. The last scan of CE ramp is %s' %(len(imsDataInput[1,:]), lastVoltage))
-    # Crop IMS data to appropriate size (remove start and end regions 'reporter')
-    cropIMSdata = imsDataInput[:,int(firstVoltage)::] #int(lastVoltage)]
-    x1 = 0
-    imsDataCEcombined, scanList = [], []
-    for i, cv in zip(scanPerVoltageList, ColEnergyX):
-        x2 = int(x1+i)
-        scanList.append([x1+firstVoltage, x2+firstVoltage, cv]) 
-        _tempIMSData = cropIMSdata[:,x1:x2] # Crop appropriate range 
-        _tempIMSData = np.sum(_tempIMSData,axis=1) # Combine all into one array
-        # Combine data into a list that will be reshaped afterwards
-        imsDataCEcombined=np.append(imsDataCEcombined,_tempIMSData) # Create a new array containing all IMS data
-        x1 = x2
-    # Output raw and normalized data
-    imsDataCEcombined = imsDataCEcombined.reshape((200,int(numberOfVoltages)),order='F') # Reshape list to array
+        print('File has a total of: %s scans. The last scan of CE ramp is %s' %(imsDataInput.shape[-1], lastVoltage))
+
+    boundaries = get_scan_boundaries(firstVoltage, scanPerVoltageList)
+    scanList = get_scan_list(firstVoltage, boundaries, ColEnergyX)
+    imsDataCEcombined = origami_combine_scans(imsDataInput, boundaries)
     return imsDataCEcombined, scanList, parameters
 # ------------ #
  
@@ -197,25 +256,15 @@ def origami_combine_userDefined(imsDataInput=None, firstVoltage=None, inputList=
     if len(ColEnergyX) != len(scanPerVoltageList):
         return
     # Calculate information about acquisition lengths
-    numberOfVoltages=len(scanPerVoltageList)
     lastVoltage=firstVoltage+sum(scanPerVoltageList)
     
-    if lastVoltage > len(imsDataInput[1,:]):
-        return [None, lastVoltage, len(imsDataInput[1,:])], None, None, None
+    if lastVoltage > imsDataInput.shape[-1]:
+        return [None, lastVoltage, imsDataInput.shape[-1]], None, None, None
     else:
-        print('File has a total of: %s scans. The last scan of CE ramp is %s' %(len(imsDataInput[1,:]), lastVoltage))
-    # Crop IMS data to appropriate size (remove start and end regions 'reporter')
-    cropIMSdata = imsDataInput[:,int(firstVoltage)::]
-    x1 = int(0)
-    # Create an empty array to put data into
-    imsDataCEcombined, scanList = [], []
-    for i, cv in zip(scanPerVoltageList, ColEnergyX):
-        x2 = int(x1+i) # index 2
-        scanList.append([x1+firstVoltage, x2+firstVoltage, cv, (x2-x1)])
-        _tempIMSData = cropIMSdata[:,x1:x2] # Crop appropriate range 
-        _tempIMSData = np.sum(_tempIMSData, axis=1) # Combine all into one array
-        imsDataCEcombined=np.append(imsDataCEcombined,_tempIMSData) # Create a new array containing all IMS data
-        x1 = x2
-    imsDataCEcombined = imsDataCEcombined.reshape((200, len(scanPerVoltageList)),order='F') # Reshape list to array
+        print('File has a total of: %s scans. The last scan of CE ramp is %s' %(imsDataInput.shape[-1], lastVoltage))
+
+    boundaries = get_scan_boundaries(firstVoltage, scanPerVoltageList)
+    scanList = get_scan_list(firstVoltage, boundaries, ColEnergyX, add_width=True)
+    imsDataCEcombined = origami_combine_scans(imsDataInput, boundaries)
     return imsDataCEcombined, ColEnergyX, scanList, parameters
  
\ No newline at end of file
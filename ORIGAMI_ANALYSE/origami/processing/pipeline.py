@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------------
+#    Copyright (C) 2017-2018 Lukasz G. Migas
+#    <lukasz.migas@manchester.ac.uk> OR <lukas.migas@yahoo.com>
+#
+# 	 GitHub : https://github.com/lukasz-migas/ORIGAMI
+# 	 University of Manchester IP : https://www.click2go.umip.com/i/s_w/ORIGAMI.html
+# 	 Cite : 10.1016/j.ijms.2017.08.014
+#
+#    This program is free software. Feel free to redistribute it and/or
+#    modify it under the condition you cite and credit the authors whenever
+#    appropriate.
+#    The program is distributed in the hope that it will be useful but is
+#    provided WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE
+# -------------------------------------------------------------------------
+# __author__ lukasz.g.migas
+
+"""
+Processing pipelines with cached intermediate results.
+
+A pipeline is a list of stages (crop, linearize, smooth, threshold, normalize...).
+The output of each stage is cached under a key made of the key of its input and
+the stage parameters, so that changing a late stage (e.g. normalization) reuses
+the output of all earlier stages.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+import processing.spectra as pr_spectra
+import processing.heatmap as pr_heatmap
+
+
+class StageCache(object):
+    """
+    LRU cache of stage outputs (tuples of arrays) keyed on the stage key
+    """
+
+    def __init__(self, max_size=256):
+        """
+        :param max_size: Maximum size of all cached outputs (MB)
+        """
+        self.max_size = max_size
+        self.outputs = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_output_size(output):
+        return sum([item.nbytes for item in output if isinstance(item, np.ndarray)])
+
+    def get(self, key):
+        with self._lock:
+            output = self.outputs.pop(key, None)
+            if output is not None:
+                self.outputs[key] = output
+                self.hits += 1
+            else:
+                self.misses += 1
+            return output
+
+    def put(self, key, output):
+        size = self.get_output_size(output)
+        with self._lock:
+            if size > self.max_size * 1024 ** 2 or key in self.outputs:
+                return
+            self.outputs[key] = output
+            self.nbytes += size
+            self._evict()
+
+    def _evict(self):
+        """ Remove least recently used outputs until the cache is within its limits """
+        while self.outputs and self.nbytes > self.max_size * 1024 ** 2:
+            __, evicted = self.outputs.popitem(last=False)
+            self.nbytes -= self.get_output_size(evicted)
+
+    def resize(self, max_size=None):
+        with self._lock:
+            if max_size is not None:
+                self.max_size = max_size
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self.outputs.clear()
+            self.nbytes = 0
+
+
+stage_cache = StageCache()
+
+
+def set_stage_cache_size(max_size=None):
+    """ Change limit of the processing cache (MB) """
+    stage_cache.resize(max_size)
+
+
+def get_data_key(*data):
+    """ Hash content of the input arrays """
+    key = hashlib.sha1()
+    for item in data:
+        if item is None:
+            key.update(b"None")
+            continue
+        item = np.ascontiguousarray(item)
+        key.update(str((item.shape, item.dtype.str)).encode("utf-8"))
+        key.update(item.view(np.uint8).ravel() if item.size else b"")
+    return key.hexdigest()
+
+
+def get_stage_key(input_key, name, parameters):
+    """ Hash input key with the stage name and parameters """
+    parameters = repr(sorted(parameters.items()))
+    return hashlib.sha1(("%s|%s|%s" % (input_key, name, parameters)).encode("utf-8")).hexdigest()
+
+
+def _shares_memory(item, arrays):
+    return isinstance(item, np.ndarray) and any([np.may_share_memory(item, array) for array in arrays])
+
+
+def _set_read_only(output):
+    for item in output:
+        if isinstance(item, np.ndarray):
+            item.setflags(write=False)
+    return output
+
+
+class ProcessingPipeline(object):
+    """
+    Sequence of processing stages. Each stage is a function that takes the current data
+    (tuple of arrays) and the stage parameters and returns new tuple of arrays.
+    Stage functions must not modify their inputs as they might be cached.
+    """
+
+    def __init__(self, cache=None):
+        self.cache = stage_cache if cache is None else cache
+        self.stages = []
+
+    def add_stage(self, name, function, **parameters):
+        self.stages.append((name, function, parameters))
+        return self
+
+    def run(self, *data):
+        """
+        Run all stages and return copy of the output
+        """
+        if not self.stages:
+            return data
+
+        inputs = [item for item in data if isinstance(item, np.ndarray)]
+        key = get_data_key(*data)
+        use_cache = self.cache.max_size > 0
+        for name, function, parameters in self.stages:
+            key = get_stage_key(key, name, parameters)
+            output = self.cache.get(key) if use_cache else None
+            if output is None:
+                output = tuple(function(*data, **parameters))
+                if use_cache:
+                    # cached outputs must not be views of the (mutable) input data
+                    output = tuple([np.array(item) if _shares_memory(item, inputs) else item
+                                    for item in output])
+                    self.cache.put(key, _set_read_only(output))
+            data = output
+
+        return tuple([np.array(item) if isinstance(item, np.ndarray) else item for item in data])
+
+
+# Mass spectra stages
+def _crop_MS(msX, msY, **kwargs):
+    return pr_spectra.crop_1D_data(msX, msY, **kwargs)
+
+
+def _linearize_MS(msX, msY, **kwargs):
+    return pr_spectra.linearize_data(msX, msY, **kwargs)
+
+
+def _smooth_MS(msX, msY, smoothMode='Gaussian', **kwargs):
+    return msX, pr_spectra.smooth_1D(data=msY, smoothMode=smoothMode, **kwargs)
+
+
+def _threshold_MS(msX, msY, threshold=0):
+    return msX, pr_spectra.remove_noise_1D(inputData=msY, threshold=threshold)
+
+
+def _normalize_MS(msX, msY, mode='Maximum'):
+    return msX, pr_spectra.normalize_1D(inputData=msY, mode=mode)
+
+
+def make_MS_pipeline(crop=None, linearize=None, smooth=None, threshold=None, normalize=None,
+                     cache=None):
+    """
+    Make mass spectrum pipeline, each argument is a dictionary of parameters of the stage
+    or None if the stage should be skipped
+    """
+    pipeline = ProcessingPipeline(cache)
+    for name, function, parameters in [("crop", _crop_MS, crop),
+                                       ("linearize", _linearize_MS, linearize),
+                                       ("smooth", _smooth_MS, smooth),
+                                       ("threshold", _threshold_MS, threshold),
+                                       ("normalize", _normalize_MS, normalize)]:
+        if parameters is not None:
+            pipeline.add_stage(name, function, **parameters)
+    return pipeline
+
+
+# Heatmap stages
+def _smooth_2D(zvals, smoothMode=None, sigma=1, polyOrder=2, windowSize=5):
+    if smoothMode == 'Gaussian':
+        zvals = pr_heatmap.smooth_gaussian_2D(inputData=zvals, sigma=sigma)
+    elif smoothMode == 'Savitzky-Golay':
+        zvals = pr_heatmap.smooth_savgol_2D(inputData=zvals, polyOrder=polyOrder,
+                                            windowSize=windowSize)
+    return (zvals,)
+
+
+def _threshold_2D(zvals, threshold=0):
+    return (pr_heatmap.remove_noise_2D(inputData=zvals, threshold=threshold),)
+
+
+def _normalize_2D(zvals, mode='Maximum'):
+    return (pr_heatmap.normalize_2D(inputData=zvals, mode=mode),)
+
+
+def make_2D_pipeline(smooth=None, threshold=None, normalize=None, cache=None):
+    """
+    Make heatmap pipeline, each argument is a dictionary of parameters of the stage
+    or None if the stage should be skipped
+    """
+    pipeline = ProcessingPipeline(cache)
+    for name, function, parameters in [("smooth", _smooth_2D, smooth),
+                                       ("threshold", _threshold_2D, threshold),
+                                       ("normalize", _normalize_2D, normalize)]:
+        if parameters is not None:
+            pipeline.add_stage(name, function, **parameters)
+    return pipeline
@@ -18,17 +18,25 @@
 # __author__ lukasz.g.migas
 
 import math
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from sklearn.preprocessing import normalize
 from scipy.interpolate import interp1d
+from scipy.sparse import coo_matrix
 from bisect import bisect_left
 from scipy.signal import savgol_filter
 from scipy.ndimage import gaussian_filter
 from toolbox import getNarrow1Ddata
 from gui_elements.misc_dialogs import dlgBox
+from utils import as_processing_array
 
 
-def remove_noise_1D(inputData=None, threshold=0):
+def remove_noise_1D(inputData=None, threshold=0, inplace=False):
+    inputData = as_processing_array(inputData, inplace)
     # Check whether threshold values meet the criteria.
     # First check if value is not above the maximum or below 0
     if (threshold > np.max(inputData)) or (threshold < 0):
@@ -53,19 +61,16 @@ def remove_noise_1D(inputData=None, threshold=0):
     return inputData
 
 
-def normalize_1D(inputData=None, mode="Maximum"):  # normalizeMS
+def normalize_1D(inputData=None, mode="Maximum", inplace=False):  # normalizeMS
     # Normalize data to maximum intensity of 1
-    try:
-        inputData = inputData.astype(np.float64)
-    except AttributeError:
-        inputData = np.array(inputData, dtype=np.float64)
+    normData = as_processing_array(inputData, inplace)
 
     if mode == "Maximum":
-        max_val = np.max(inputData)
-        normData = np.divide(inputData, max_val)
+        max_val = np.max(normData)
+        np.divide(normData, max_val, out=normData)
     elif mode == 'tic':
-        normData = np.divide(inputData.astype(np.float64), np.sum(inputData))
-        normData = np.divide(normData.astype(np.float64), np.max(normData))
+        np.divide(normData, np.sum(normData), out=normData)
+        np.divide(normData, np.max(normData), out=normData)
 
     return normData
 
@@ -208,7 +213,7 @@ def subtract_1D(msY_1, msY_2):  # subtractMS
     return out_1, out_2
 
 
-def smooth_gaussian_1D(data=None, sigma=1):  # smooth1D
+def smooth_gaussian_1D(data=None, sigma=1, inplace=False):  # smooth1D
     """
     This function uses Gaussian filter to smooth 1D data
     """
@@ -221,11 +226,12 @@ def smooth_gaussian_1D(data=None, sigma=1):  # smooth1D
         sigma = 1
     else:
         sigma = sigma
-    dataOut = gaussian_filter(data, sigma=sigma, order=0)
+    dataOut = as_processing_array(data, inplace)
+    gaussian_filter(dataOut, sigma=sigma, order=0, output=dataOut)
     return dataOut
 
 
-def smooth_1D(data=None, smoothMode='Gaussian', **kwargs):  # smooth_1D
+def smooth_1D(data=None, smoothMode='Gaussian', inplace=False, **kwargs):  # smooth_1D
     """
     This function uses Gaussian filter to smooth 1D data
     """
@@ -237,7 +243,8 @@ def smooth_1D(data=None, smoothMode='Gaussian', **kwargs):  # smooth_1D
             sigma = 1
         # Smooth array
         try:
-            dataOut = gaussian_filter(data, sigma=sigma, order=0)
+            dataOut = as_processing_array(data, inplace)
+            gaussian_filter(dataOut, sigma=sigma, order=0, output=dataOut)
         except (ValueError, TypeError, MemoryError), error:
             return data
         return dataOut
@@ -258,7 +265,11 @@ def smooth_1D(data=None, smoothMode='Gaussian', **kwargs):  # smooth_1D
             return data
         # Remove values below zero
         dataOut[dataOut < 0] = 0  # Remove any values that are below 0
-        return dataOut
+        if inplace:
+            data = as_processing_array(data, inplace)
+            data[:] = dataOut
+            return data
+        return as_processing_array(dataOut, True)
     else:
         return data
 
@@ -332,6 +343,10 @@ def linearize(data, binsize, mode, input_list=[]):
             intx = nonlinear_axis(firstpoint, lastpoint, firstpoint / binsize)
     else:
         intx = input_list
+        # the same target axis is usually used for many spectra so use cached operator
+        if is_increasing(data[:, 0]):
+            operator = get_resampling_operator(data[:, 0], intx, mode)
+            return np.asarray(intx, dtype=np.float64), operator.dot(data[:, 1])
 
     if mode in ["Linear m/z", "Linear resolution"]:
 #     if mode < 2:
@@ -346,14 +361,241 @@ def linearize(data, binsize, mode, input_list=[]):
     return xvals, yvals
 
 
+def get_resampling_map(msX, msCentre, mode, ms_edges=None):
+    """
+    Precompute how intensities measured at `msX` are distributed onto the new x-axis. The
+    same map can be reused for every scan that shares the same m/z values.
+    :param msX: Original x-axis (sorted)
+    :param msCentre: New x-axis
+    :param mode: Linearization mode
+    :param ms_edges: Bin edges (only used in `Binning` mode). Without them, spectra are
+        interpolated, same as in `linearize`
+    :return: target, source, weights such that the resampled intensity is
+        np.bincount(target, weights=msY[source] * weights, minlength=len(msCentre))
+    """
+    msX = np.asarray(msX, dtype=np.float64)
+    msCentre = np.asarray(msCentre, dtype=np.float64)
+    if mode == "Binning" and ms_edges is not None:
+        # same as np.histogram, the right-most edge is included in the last bin
+        n_bins = len(ms_edges) - 1
+        target = np.searchsorted(ms_edges, msX, side="right") - 1
+        target[msX == ms_edges[-1]] = n_bins - 1
+        source = np.flatnonzero((target >= 0) & (target < n_bins))
+        return target[source], source, np.ones(len(source))
+    elif mode in ["Linear m/z", "Linear resolution"]:
+        # integration - each point is split between the two neighbouring points of the new axis
+        return get_lintegrate_map(msX, msCentre)
+    else:
+        # interpolation - each point of the new axis is taken from two neighbouring points
+        if len(msX) < 2:
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp), np.zeros(0)
+        target = np.flatnonzero((msCentre >= msX[0]) & (msCentre <= msX[-1]))
+        left = np.clip(np.searchsorted(msX, msCentre[target], side="right") - 1, 0, len(msX) - 2)
+        width = msX[left + 1] - msX[left]
+        fraction = np.divide(msCentre[target] - msX[left], width,
+                             out=np.zeros(len(target)), where=width > 0)
+        return (np.concatenate((target, target)), np.concatenate((left, left + 1)),
+                np.concatenate((1 - fraction, fraction)))
+
+
+def apply_resampling_map(resampling_map, msY, n_points, out=None):
+    """
+    Resample intensities using map from `get_resampling_map`
+    :param out: If provided, resampled intensities are added to it in-place
+    """
+    target, source, weights = resampling_map
+    yvals = np.bincount(target, weights=msY[source] * weights, minlength=n_points)
+    if out is None:
+        return yvals
+    out += yvals
+    return out
+
+
+def is_increasing(xvals):
+    """ Check whether values are strictly increasing """
+    return len(xvals) < 2 or bool(np.all(xvals[1:] > xvals[:-1]))
+
+
+def get_axis_fingerprint(xvals):
+    """ Get hashable fingerprint of an axis """
+    if xvals is None:
+        return None
+    xvals = np.ascontiguousarray(xvals, dtype=np.float64)
+    return len(xvals), hashlib.sha1(xvals.view(np.uint8)).hexdigest()
+
+
+class ResamplingOperatorCache(object):
+    """
+    LRU cache of sparse resampling operators (n_target x n_source matrices) keyed on the
+    fingerprint of the source axis, target axis and linearization mode
+    """
+
+    def __init__(self, max_size=256, max_items=128):
+        """
+        :param max_size: Maximum size of all operators (MB)
+        :param max_items: Maximum number of operators
+        """
+        self.max_size = max_size
+        self.max_items = max_items
+        self.operators = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_operator_size(operator):
+        return operator.data.nbytes + operator.indices.nbytes + operator.indptr.nbytes
+
+    def get(self, msX, msCentre, mode, ms_edges=None):
+        key = (get_axis_fingerprint(msX), get_axis_fingerprint(msCentre), mode,
+               get_axis_fingerprint(ms_edges))
+        with self._lock:
+            operator = self.operators.pop(key, None)
+            if operator is not None:
+                self.operators[key] = operator
+                self.hits += 1
+                return operator
+
+        operator = make_resampling_operator(msX, msCentre, mode, ms_edges)
+        size = self.get_operator_size(operator)
+        with self._lock:
+            self.misses += 1
+            if size > self.max_size * 1024 ** 2:
+                return operator
+            if key not in self.operators:
+                self.operators[key] = operator
+                self.nbytes += size
+            self._evict()
+        return operator
+
+    def _evict(self):
+        """ Remove least recently used operators until the cache is within its limits """
+        while self.operators and (self.nbytes > self.max_size * 1024 ** 2 or
+                                  len(self.operators) > self.max_items):
+            __, evicted = self.operators.popitem(last=False)
+            self.nbytes -= self.get_operator_size(evicted)
+
+    def resize(self, max_size=None, max_items=None):
+        with self._lock:
+            if max_size is not None:
+                self.max_size = max_size
+            if max_items is not None:
+                self.max_items = max_items
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self.operators.clear()
+            self.nbytes = 0
+
+
+resampling_cache = ResamplingOperatorCache()
+
+
+def set_resampling_cache_size(max_size=None, max_items=None):
+    """ Change limits of the resampling operator cache (MB / number of operators) """
+    resampling_cache.resize(max_size, max_items)
+
+
+def make_resampling_operator(msX, msCentre, mode, ms_edges=None):
+    """
+    Make sparse (n_target x n_source) matrix so that resampled intensity is operator.dot(msY)
+    """
+    target, source, weights = get_resampling_map(msX, msCentre, mode, ms_edges)
+    n_target = len(msCentre) if ms_edges is None else len(ms_edges) - 1
+    return coo_matrix((weights, (target, source)), shape=(n_target, len(msX))).tocsr()
+
+
+def get_resampling_operator(msX, msCentre, mode, ms_edges=None, use_cache=True):
+    """ Get (cached) sparse resampling operator """
+    if not use_cache or resampling_cache.max_size == 0:
+        return make_resampling_operator(msX, msCentre, mode, ms_edges)
+    return resampling_cache.get(msX, msCentre, mode, ms_edges)
+
+
+def resample_stack(msX, msY, msCentre, mode, ms_edges=None):
+    """
+    Resample stack of spectra that share the same x-axis
+    :param msX: Original x-axis (n_points)
+    :param msY: Intensities (n_spectra x n_points)
+    :return: resampled intensities (n_spectra x n_target)
+    """
+    operator = get_resampling_operator(msX, msCentre, mode, ms_edges)
+    return np.asarray(operator.dot(np.asarray(msY).T).T)
+
+
+def linearize_spectra(spectra, msCentre=None, n_threads=1, **kwargs):
+    """
+    Linearize many spectra onto common x-axis. Each spectrum gives the same result as
+    `linearize` with the same x-axis (e.g. `Binning` mode interpolates the spectra)
+    :param spectra: List of (msX, msY) pairs
+    :param msCentre: Target x-axis, if not provided it is computed from `mz_min`, `mz_max`,
+        `mz_bin` and `linearization_mode`
+    :param n_threads: Number of threads used to resample the spectra
+    :return: msCentre, array (n_spectra x n_points)
+    """
+    mode = kwargs.get('linearization_mode', "Linear interpolation")
+    if msCentre is None:
+        msCentre = get_linearization_range(kwargs['mz_min'], kwargs['mz_max'], kwargs['mz_bin'], mode)
+    msCentre = np.asarray(msCentre, dtype=np.float64)
+
+    msArray = np.zeros((len(spectra), len(msCentre)), dtype=np.float64)
+
+    # spectra that share the same x-axis are resampled together with one operator
+    groups = OrderedDict()
+    for idx, (msX, __) in enumerate(spectra):
+        groups.setdefault(get_axis_fingerprint(msX), []).append(idx)
+
+    def resample_group(indices):
+        msX = np.asarray(spectra[indices[0]][0], dtype=np.float64)
+        msY = np.array([spectra[idx][1] for idx in indices], dtype=np.float64)
+        if len(msX) == len(msCentre) and np.array_equal(msX, msCentre):
+            msArray[indices] = msY
+        elif is_increasing(msX):
+            msArray[indices] = resample_stack(msX, msY, msCentre, mode)
+        else:
+            for idx, yvals in zip(indices, msY):
+                __, yvals = linearize(np.transpose([msX, yvals]), kwargs.get('mz_bin', 0),
+                                      mode, input_list=msCentre)
+                msArray[idx] = np.nan_to_num(yvals)
+
+    if n_threads > 1 and len(groups) > 1:
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            list(executor.map(resample_group, groups.values()))
+    else:
+        for indices in groups.values():
+            resample_group(indices)
+
+    return msCentre, msArray
+
+
 def nonlinear_axis(start, end, res):
     """
     Creates a nonlinear axis with the m/z values spaced with a defined and constant resolution.
+
+    Each point is `(1 + 1 / res)` times larger than the previous one, so the axis is computed
+    directly as a geometric series.
     :param start: Minimum m/z value
     :param end: Maximum m/z value
     :param res: Resolution of the axis ( m / delta m)
     :return: One dimensional array of the nonlinear axis.
     """
+    start, end, res = float(start), float(end), float(res)
+    if start <= 0 or res <= 0:
+        raise ValueError("Start value and resolution of the nonlinear axis must be positive")
+
+    ratio = 1 + 1 / res
+    n_points = 1
+    if end > start:
+        n_points += int(np.ceil(np.log(end / start) / np.log(ratio))) + 1
+    axis = start * np.power(ratio, np.arange(n_points))
+    # first point is always included, others only if they are below the end value
+    return np.concatenate((axis[:1], axis[1:][axis[1:] < end]))
+
+
+def _nonlinear_axis_loop(start, end, res):
+    """ Original (pure Python) implementation of `nonlinear_axis`, used for benchmarking """
     axis = []
     i = start
     axis.append(i)
@@ -374,6 +616,55 @@ def linear_interpolation(x1, x2, x):
     return float(x - x1) / float(x2 - x1)
 
 
+def get_lintegrate_map(msX, intx, length=None):
+    """
+    Vectorised equivalent of the point-by-point loop in `lintegrate`.
+
+    Each point is assigned to its nearest point of the new axis and the neighbour on the other
+    side. The contributions are interleaved (nearest, neighbour) in the order of the original
+    data so that summing them with np.bincount gives the same result as the loop.
+    :param msX: Original x-axis
+    :param intx: New x-axis
+    :param length: Number of points in the original data (defaults to len(msX))
+    :return: target, source, weights (see `get_resampling_map`)
+    """
+    msX = np.asarray(msX, dtype=np.float64)
+    intx = np.asarray(intx)
+    if length is None:
+        length = len(msX)
+    n_points = len(intx)
+
+    source = np.flatnonzero((intx[0] < msX) & (msX < intx[n_points - 1]))
+    xvals = msX[source]
+
+    # nearest point of the new axis
+    index = np.clip(np.searchsorted(intx, xvals, side="left"), 0, n_points - 1)
+    inner = (index > 0) & (index < n_points - 1)
+    inner[inner] = np.abs(intx[index[inner]] - xvals[inner]) > np.abs(intx[index[inner] - 1] - xvals[inner])
+    index[inner] -= 1
+
+    # neighbour on the other side of the value
+    nearest_x = intx[index]
+    above = (nearest_x < xvals) & (index < length - 1)
+    below = (nearest_x > xvals) & (index > 0)
+    index2 = index.copy()
+    index2[above] += 1
+    index2[below] -= 1
+
+    interpos = np.zeros(len(xvals))
+    split = above | below
+    interpos[split] = (xvals[split] - nearest_x[split]) / (intx[index2[split]] - nearest_x[split])
+
+    # points exactly at the new axis are fully added to it, points that were skipped by the
+    # loop (no valid neighbour) get zero weight
+    weight1 = np.where(split, 1 - interpos, 0.)
+    weight1[nearest_x == xvals] = 1.
+
+    target = np.column_stack((index, index2)).ravel()
+    weights = np.column_stack((weight1, interpos)).ravel()
+    return target, np.repeat(source, 2), weights
+
+
 def lintegrate(data, intx):
     """
     Linearize x-axis by integration.
@@ -386,6 +677,16 @@ def lintegrate(data, intx):
     :return: Integration of intensity from original data onto the new x-axis.
         Same shape as the old data but new length.
     """
+    target, source, weights = get_lintegrate_map(data[:, 0], intx, len(data))
+    # integer axis (e.g. np.arange with integer bin size) still gets floating point intensities
+    inty = np.bincount(target, weights=data[source, 1] * weights, minlength=len(intx))
+    inty = inty.astype(np.result_type(intx, np.float32), copy=False)
+    newdat = np.column_stack((intx, inty))
+    return newdat
+
+
+def _lintegrate_loop(data, intx):
+    """ Original (pure Python) implementation of `lintegrate`, used for benchmarking """
     length = len(data)
     inty = np.zeros_like(intx)
     for i in range(0, length):
@@ -436,3 +737,83 @@ def nonlinearize(data, num_compressed):
         num_compressed = int(num_compressed)
         return np.array([np.mean(data[index:index + num_compressed], axis=0) for index in
                          xrange(0, len(data), num_compressed)])
+
+
+def benchmark_linearization(sizes=(1e5, 1e6, 1e7), mz_start=500., mz_end=5000., binsize=0.05,
+                            mode="Linear m/z", seed=0):
+    """
+    Compare vectorised `lintegrate` and `nonlinear_axis` against the original Python loops
+    on synthetic spectra of increasing size
+    :return: list of (n_points, reference time, vectorised time, maximum difference)
+    """
+    rng = np.random.RandomState(seed)
+    intx = get_linearization_range(mz_start, mz_end, binsize, mode)
+    results = []
+    for n_points in sizes:
+        n_points = int(n_points)
+        data = np.column_stack((np.sort(rng.uniform(mz_start, mz_end, n_points)),
+                                rng.uniform(0, 1000, n_points)))
+
+        tstart = time.time()
+        reference = _lintegrate_loop(data, intx)
+        t_reference = time.time() - tstart
+
+        tstart = time.time()
+        result = lintegrate(data, intx)
+        t_vectorised = time.time() - tstart
+
+        difference = np.max(np.abs(reference[:, 1] - result[:, 1]))
+        print("lintegrate: {} points | loop {:.4f} s | vectorised {:.4f} s | speed-up {:.1f}x | max difference {}".format(
+            n_points, t_reference, t_vectorised, t_reference / max(t_vectorised, 1e-9), difference))
+        results.append((n_points, t_reference, t_vectorised, difference))
+
+    res = mz_start / binsize
+    tstart = time.time()
+    reference = _nonlinear_axis_loop(mz_start, mz_end, res)
+    t_reference = time.time() - tstart
+    tstart = time.time()
+    result = nonlinear_axis(mz_start, mz_end, res)
+    t_vectorised = time.time() - tstart
+    print("nonlinear_axis: {} points | loop {:.4f} s | vectorised {:.4f} s | max relative difference {}".format(
+        len(result), t_reference, t_vectorised, np.max(np.abs(reference - result) / reference)))
+
+    return results
+
+
+def _linearize_reference(data, binsize, mode, input_list):
+    """ Original (uncached) implementation of `linearize` with predefined x-axis """
+    if mode in ["Linear m/z", "Linear resolution"]:
+        newdat = lintegrate(data, input_list)
+    else:
+        newdat = linterpolate(data, input_list)
+    return newdat[:, 0], newdat[:, 1]
+
+
+def check_linearization_modes(n_points=1e5, mz_start=500., mz_end=5000., binsize=0.05,
+                              modes=None, seed=0):
+    """
+    Check that cached resampling operators (`linearize` and `linearize_spectra`) give the same
+    spectra as the original `lintegrate`/`linterpolate` path in every linearization mode
+    :return: list of (mode, maximum difference)
+    """
+    if modes is None:
+        modes = ["Linear m/z", "Linear resolution", "Nonlinear", "Linear interpolation",
+                 "Linear resolution interpolation", "Binning"]
+    rng = np.random.RandomState(seed)
+    data = np.column_stack((np.sort(rng.uniform(mz_start, mz_end, int(n_points))),
+                            rng.uniform(0, 1000, int(n_points))))
+    results = []
+    for mode in modes:
+        intx = get_linearization_range(mz_start, mz_end, binsize, mode)
+        __, reference = _linearize_reference(data, binsize, mode, intx)
+        __, result = linearize(data, binsize, mode, input_list=intx)
+        __, stack = linearize_spectra([(data[:, 0], data[:, 1]), (data[:, 0], data[:, 1] * 2)],
+                                      msCentre=intx, mz_bin=binsize, linearization_mode=mode)
+        reference = np.nan_to_num(reference)
+        difference = max(np.max(np.abs(reference - np.nan_to_num(result))),
+                         np.max(np.abs(reference - stack[0])),
+                         np.max(np.abs(reference * 2 - stack[1])))
+        print("linearize ({}): {} points | max difference {}".format(mode, len(intx), difference))
+        results.append((mode, difference))
+
+    return results
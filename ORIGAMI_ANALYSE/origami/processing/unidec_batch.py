@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------------
+#    Copyright (C) 2017-2018 Lukasz G. Migas
+#    <lukasz.migas@manchester.ac.uk> OR <lukas.migas@yahoo.com>
+#
+# 	 GitHub : https://github.com/lukasz-migas/ORIGAMI
+# 	 University of Manchester IP : https://www.click2go.umip.com/i/s_w/ORIGAMI.html
+# 	 Cite : 10.1016/j.ijms.2017.08.014
+#
+#    This program is free software. Feel free to redistribute it and/or
+#    modify it under the condition you cite and credit the authors whenever
+#    appropriate.
+#    The program is distributed in the hope that it will be useful but is
+#    provided WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE
+# -------------------------------------------------------------------------
+# __author__ lukasz.g.migas
+
+"""
+Batch deconvolution of many mass spectra with UniDec.
+
+Each spectrum is deconvolved by a separate UniDec engine (with its own config and
+working directory) in a process pool. UniDec changes the current working directory
+while loading data, so the engines cannot share a process.
+"""
+
+import time
+import threading
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import unidec
+
+
+def run_unidec_job(msX, msY, file_name, folder, parameters, peak_width=None):
+    """
+    Load, pre-process and deconvolve mass spectrum and pick peaks (same steps as
+    'run_all_unidec' task)
+    :param folder: working directory of the engine
+    :param parameters: dictionary of UniDec config attributes
+    :param peak_width: peak width (m/z) or None if it should be determined automatically
+    :return: UniDec engine
+    """
+    engine = unidec.UniDec()
+    for key, value in parameters.items():
+        setattr(engine.config, key, value)
+
+    engine.open_file(file_name=file_name, file_directory=folder,
+                     data_in=np.transpose([msX, msY]), clean=True, silent=True)
+    engine.process_data(silent=True)
+    if peak_width is None:
+        engine.get_auto_peak_width()
+    else:
+        engine.config.mzsig = peak_width
+    out = engine.run_unidec(silent=True)
+    if out != 0:
+        raise ValueError("UniDec run failed with error code {}".format(out))
+    engine.pick_peaks()
+    engine.convolve_peaks()
+    return engine
+
+
+class UniDecBatch(object):
+    """
+    Run UniDec jobs in a process pool (from a background thread). Callbacks are called
+    from the background thread as soon as each job finishes
+    """
+
+    def __init__(self, jobs, n_processes=1, on_result=None, on_error=None, on_progress=None,
+                 on_finish=None):
+        """
+        :param jobs: list of dictionaries with `kwargs` of `run_unidec_job` (other keys are
+            passed back to the callbacks)
+        :param on_result: called with (job, engine)
+        :param on_error: called with (job, error)
+        :param on_progress: called with (n_finished, n_jobs)
+        :param on_finish: called with (n_finished, n_jobs, cancelled)
+        """
+        self.jobs = jobs
+        self.n_processes = max(int(n_processes), 1)
+        self.on_result = on_result
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.on_finish = on_finish
+
+        self._cancel = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def cancel(self):
+        """ Cancel jobs that have not started yet and ignore results of running jobs """
+        self._cancel.set()
+
+    def is_cancelled(self):
+        return self._cancel.is_set()
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def run(self):
+        tstart = time.time()
+        n_jobs, n_finished = len(self.jobs), 0
+        try:
+            with ProcessPoolExecutor(max_workers=min(self.n_processes, max(n_jobs, 1))) as executor:
+                futures = {}
+                for job in self.jobs:
+                    futures[executor.submit(run_unidec_job, **job['kwargs'])] = job
+
+                for future in as_completed(futures):
+                    if self.is_cancelled():
+                        for pending in futures:
+                            pending.cancel()
+                        break
+
+                    job = futures[future]
+                    try:
+                        engine = future.result()
+                    except Exception as err:
+                        if self.on_error is not None:
+                            self.on_error(job, err)
+                    else:
+                        if self.on_result is not None:
+                            self.on_result(job, engine)
+                    n_finished += 1
+                    if self.on_progress is not None:
+                        self.on_progress(n_finished, n_jobs)
+        finally:
+            # always called (e.g. to remove working directories), even if the pool failed
+            print("Deconvoluted {}/{} spectra in {:.4f} seconds".format(
+                n_finished, n_jobs, time.time() - tstart))
+            if self.on_finish is not None:
+                self.on_finish(n_finished, n_jobs, self.is_cancelled())
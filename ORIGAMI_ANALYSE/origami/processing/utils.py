@@ -18,58 +18,140 @@
 # __author__ lukasz.g.migas
 from __future__ import division
 import numpy as np
-from operator import itemgetter
-from itertools import groupby
 from time import time as ttime
 from scipy.signal import find_peaks # @UnresolvedImport
+from scipy.ndimage import maximum_filter1d
 
-def detect_peaks_chromatogram(data, threshold, add_buffer=0): # detectPeaksRT
+PEAK_DTYPE = [('spectrum', np.int64), ('index', np.int64), ('mz', np.float64), ('intensity', np.float64)]
+
+# precision of the intensity arrays returned by the processing functions
+PROCESSING_PRECISIONS = {"float32": np.float32, "float64": np.float64}
+PROCESSING_DTYPE = np.float32
+
+def set_processing_precision(precision="float32"):
+    """ Set precision (float32 or float64) used by the processing functions """
+    global PROCESSING_DTYPE
+    PROCESSING_DTYPE = PROCESSING_PRECISIONS.get(precision, np.float32)
+
+def get_processing_dtype():
+    return PROCESSING_DTYPE
+
+def as_processing_array(data, inplace=False):
     """
-    This function searches for split in the sequence of numbers (when signal goes to 0)
-    and returns the xy coordinates for the rectangle to be plotted
+    Convert data to the processing precision. If `inplace` is True, the input array is
+    returned as it is when it already has the correct dtype, otherwise new array is made
+    """
+    if inplace:
+        return np.asarray(data, dtype=PROCESSING_DTYPE)
+    return np.array(data, dtype=PROCESSING_DTYPE)
+
+def find_regions(xvals, mask, min_width=0, merge_gap=0):
+    """
+    Find runs of consecutive (integer) x-values where the mask is True
     ---
-    output : list of tuples, start and end x coordinates
+    Parameters:
+    ---
+    xvals: array (n_points)
+    mask: array (n_points) or (n_traces, n_points)
+    min_width: int, regions narrower than this (in scans) are removed
+    merge_gap: int, regions separated by this many scans (or less) are merged
+    ---
+    Returns:
+    ---
+    trace, start, end: arrays with the trace index and the x-value of the start and end of each region
     """
-    inxY = np.where(data[:,1] > threshold)
-    valX = data[inxY,0]
-    valY = data[inxY,1]
-    valXX = valX.astype(int).tolist()[0]
-    # Find index values
-    outlist = []
-    apex_list = []
-    for k, g in groupby(enumerate(valXX), lambda (i,x):i-x):
-        x = (map(itemgetter(1), g)) # list of vals
-        xStart = x[0] # get x start
-        xEnd = x[-1] # get x end
-        
-        if (xStart-xEnd) == 0:
-            apex_list.append([xStart, xEnd])
-            xStart = xStart - add_buffer
-            xEnd = xEnd + add_buffer
-            
-        
-        outlist.append([xStart,xEnd])
-        
+    mask = np.atleast_2d(mask)
+    trace, index = np.nonzero(mask)
+    xvals = np.asarray(xvals)[index].astype(int)
+    if len(xvals) == 0:
+        return trace, xvals, xvals
+
+    # new region starts whenever x-values are not consecutive or trace changes
+    breaks = (np.diff(xvals) != 1) | (np.diff(trace) != 0)
+    start_idx = np.concatenate(([0], np.nonzero(breaks)[0] + 1))
+    trace, start = trace[start_idx], xvals[start_idx]
+    end = np.maximum.reduceat(xvals, start_idx)
+
+    if merge_gap > 0 and len(start) > 1:
+        join = ((start[1:] - end[:-1] - 1) <= merge_gap) & (trace[1:] == trace[:-1])
+        keep = np.nonzero(np.concatenate(([True], ~join)))[0]
+        trace, start, end = trace[keep], start[keep], np.maximum.reduceat(end, keep)
+
+    if min_width > 0:
+        keep = (end - start + 1) >= min_width
+        trace, start, end = trace[keep], start[keep], end[keep]
+
+    return trace, start, end
+
+def _get_chromatogram_regions(data, start, end, add_buffer=0):
+    """
+    Generate output of `detect_peaks_chromatogram` from region boundaries
+    """
+    # single-point regions are widened by the buffer
+    single = start == end
+    apex_list = np.unique(start[single])
+    if np.any(single):
+        start = np.where(single, start - add_buffer, start)
+        end = np.where(single, end + add_buffer, end)
+    outlist = np.column_stack((start, end)).tolist()
+
     # pair list
-    outlistRav = np.ravel(outlist)-1
-    try:
-        valXout = data[outlistRav, 0]
-        valYout = data[outlistRav, 1]
-        output = np.array(zip(valXout,valYout))
-    except IndexError:
-        output = []
+    output, apexlist = [], []
+    if len(outlist) > 0:
+        try:
+            outlistRav = np.ravel(np.column_stack((start, end)))-1
+            output = np.column_stack((data[outlistRav, 0], data[outlistRav, 1]))
+        except IndexError:
+            output = []
     # apex list
-    try:
-        apexListRav = np.ravel(apex_list)-1
-        apexListRav = np.unique(apexListRav)
-        valXout = data[apexListRav, 0]
-        valYout = data[apexListRav, 1]
-        apexlist = np.array(zip(valXout,valYout))
-    except IndexError:
-        apexlist = []
-    
+    if len(apex_list) > 0:
+        try:
+            apexlist = np.column_stack((data[apex_list-1, 0], data[apex_list-1, 1]))
+        except IndexError:
+            apexlist = []
+
     return output, outlist, apexlist
 
+def detect_peaks_chromatogram(data, threshold, add_buffer=0, min_width=0, merge_gap=0): # detectPeaksRT
+    """
+    This function searches for split in the sequence of numbers (when signal goes to 0)
+    and returns the xy coordinates for the rectangle to be plotted
+    ---
+    output : list of tuples, start and end x coordinates
+    """
+    __, start, end = find_regions(data[:,0], data[:,1] > threshold, min_width, merge_gap)
+
+    return _get_chromatogram_regions(data, start, end, add_buffer)
+
+def detect_peaks_chromatogram_batch(xvals, yvals, threshold, add_buffer=0, min_width=0, merge_gap=0):
+    """
+    Detect regions in many chromatograms sharing the same x-axis at once
+    ---
+    Parameters:
+    ---
+    xvals: array (n_points)
+    yvals: array (n_traces, n_points)
+    threshold: float or array (n_traces)
+    ---
+    Returns:
+    ---
+    list of (output, outlist, apexlist) for each trace
+    """
+    yvals = np.atleast_2d(yvals)
+    threshold = np.asarray(threshold, dtype=np.float64)
+    if threshold.ndim > 0:
+        threshold = threshold[:, np.newaxis]
+    trace, start, end = find_regions(xvals, yvals > threshold, min_width, merge_gap)
+
+    results = []
+    bounds = np.searchsorted(trace, np.arange(len(yvals) + 1))
+    for idx in range(len(yvals)):
+        data = np.transpose([xvals, yvals[idx]])
+        i1, i2 = bounds[idx], bounds[idx + 1]
+        results.append(_get_chromatogram_regions(data, start[i1:i2], end[i1:i2], add_buffer))
+
+    return results
+
 def detect_peaks_spectrum2(xvals, yvals, window=10, threshold=0):
     peaks, __ = find_peaks(yvals, distance=window, threshold=threshold)
     
@@ -77,6 +159,58 @@ def detect_peaks_spectrum2(xvals, yvals, window=10, threshold=0):
     
     return np.transpose([mzs, ints])
 
+def find_peaks_maximum_filter(xvals, yvals, window=10, threshold=0, mzRange=None):
+    """
+    Peak detection using sliding-window maximum filter. A point is a peak if it is
+    the maximum within -window/+window points, is above `threshold` * maximum
+    intensity of the spectrum and is different from the previous point.
+    ---
+    Parameters:
+    ---
+    xvals: array (n_points)
+    yvals: array (n_points) or (n_spectra, n_points) stack of spectra sharing the x-axis
+    window: float
+    threshold: float
+    mzRange: tuple (ms start, ms end)
+    ---
+    Returns:
+    ---
+    peaks: structured array with fields spectrum, index, mz, intensity
+    """
+    xvals = np.asarray(xvals)
+    yvals = np.asarray(yvals)
+    if yvals.ndim == 1:
+        yvals = yvals[np.newaxis, :]
+
+    start = 0
+    if mzRange is not None:
+        start = np.argmin(np.abs(xvals - mzRange[0]))
+        end = np.argmin(np.abs(xvals - mzRange[1]))
+        xvals, yvals = xvals[start:end], yvals[:, start:end]
+
+    if yvals.shape[1] == 0:
+        return np.zeros(0, dtype=PEAK_DTYPE)
+
+    # window is [i - ceil(window), i + floor(window)] which is the same as centered
+    # window of size `left + right + 1`
+    left = max(int(np.ceil(window)), 0)
+    right = max(int(np.floor(window)), 0)
+    testmax = maximum_filter1d(yvals, size=left + right + 1, axis=-1, mode='nearest')
+
+    maxval = np.amax(yvals, axis=1)
+    mask = (yvals == testmax) & (yvals > (maxval * threshold)[:, np.newaxis])
+    mask[:, 1:] &= yvals[:, 1:] != yvals[:, :-1]
+    mask[:, 0] = False
+
+    spectrum, index = np.nonzero(mask)
+    peaks = np.zeros(len(index), dtype=PEAK_DTYPE)
+    peaks['spectrum'] = spectrum
+    peaks['index'] = index + start
+    peaks['mz'] = xvals[index]
+    peaks['intensity'] = yvals[spectrum, index]
+
+    return peaks
+
 def detect_peaks_spectrum(data, window=10, threshold=0, mzRange=None): # detectPeaks1D
     """
     Peak detection tool.
@@ -89,8 +223,12 @@ def detect_peaks_spectrum(data, window=10, threshold=0, mzRange=None): # detectP
     threshold: float
     mzRange: tuple (ms start, ms end)
     """
-#     tstart = ttime()
+    peaks = find_peaks_maximum_filter(data[:, 0], data[:, 1], window, threshold, mzRange)
     
+    return np.column_stack((peaks['mz'], peaks['intensity']))
+
+def _detect_peaks_spectrum_loop(data, window=10, threshold=0, mzRange=None):
+    """ Original (point-by-point) implementation of `detect_peaks_spectrum`, kept for reference """
     peaks = []
     if mzRange!=None:
         mzStart = np.argmin(np.abs(data[:,0] - mzRange[0]))
@@ -109,10 +247,33 @@ def detect_peaks_spectrum(data, window=10, threshold=0, mzRange=None): # detectP
             if data[i, 1] == testmax and data[i, 1] != data[i - 1, 1]:
                 peaks.append([data[i, 0], data[i, 1]])
     
-#     print("It took {:.4f} seconds to search spectrum".format(ttime()-tstart))            
-    
     return np.array(peaks)
 
+def benchmark_peak_detection(sizes=(1e5, 1e6), window=10, threshold=0.01, n_peaks=1000):
+    """
+    Compare time of peak detection between the point-by-point and maximum filter methods
+    """
+    for size in sizes:
+        size = int(size)
+        msX = np.linspace(500., 5000., size)
+        msY = np.zeros(size)
+        centres = np.random.uniform(msX[0], msX[-1], n_peaks)
+        for centre, height in zip(centres, np.random.uniform(1, 100, n_peaks)):
+            msY += height * np.exp(-(msX - centre) ** 2 / 0.5)
+        data = np.transpose([msX, msY])
+
+        tstart = ttime()
+        peaks_loop = _detect_peaks_spectrum_loop(data, window, threshold)
+        tloop = ttime() - tstart
+
+        tstart = ttime()
+        peaks = detect_peaks_spectrum(data, window, threshold)
+        tfilter = ttime() - tstart
+
+        print("{} points: loop {:.4f} seconds, maximum filter {:.4f} seconds ({:.1f}x), same peaks: {}".format(
+            size, tloop, tfilter, tloop / max(tfilter, 1e-9),
+            np.array_equal(np.reshape(peaks_loop, (-1, 2)), peaks)))
+
 def find_peak_maximum(data, fail_value=1): # findPeakMax
     """
     Simple tool to find the intensity (maximum) of a selected peak
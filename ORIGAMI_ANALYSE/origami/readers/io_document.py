@@ -17,8 +17,25 @@
 # -------------------------------------------------------------------------
 # __author__ lukasz.g.migas
 
+import os
+import json
 import time
+import uuid
+import shutil
+import hashlib
+import numpy as np
 import cPickle as pickle
+from cStringIO import StringIO
+from collections import OrderedDict
+
+from document import document as Document, LazyArray, LazyObject, LazyDict
+
+DOCUMENT_EXTENSION = ".origami"
+CONTAINER_VERSION = 1
+# arrays smaller than this (bytes) are kept in the metadata file
+ARRAY_MIN_SIZE = 4096
+# document attributes that are not dictionaries but can be large (e.g. DataFrames)
+LAZY_OBJECT_ATTRIBUTES = ['massSpectraSave', 'calibrationParameters']
 
 def save_py_object(filename=None, saveFile=None):
     """ 
@@ -61,4 +78,274 @@ def cleanup_document(document):
     except: 
         pass
     
-    return document
\ No newline at end of file
+    return document
+
+
+def load_pickle(filename):
+    with open(filename, 'rb') as f:
+        return pickle.load(f)
+
+
+def get_data_dir(filename):
+    """ Get directory with the datasets of the document container """
+    return os.path.splitext(filename)[0] + DOCUMENT_EXTENSION + "_data"
+
+
+def is_document_container(filename):
+    return os.path.splitext(filename)[1] == DOCUMENT_EXTENSION
+
+
+def write_synced(filename, content=None, array=None):
+    """ Write file and make sure it is flushed to the disk """
+    with open(filename, 'wb') as f_ptr:
+        if array is not None:
+            np.save(f_ptr, array)
+        else:
+            f_ptr.write(content)
+        f_ptr.flush()
+        os.fsync(f_ptr.fileno())
+
+
+def write_atomic(filename, content):
+    """
+    Replace file so that either the old or the new version exists at any point. If the
+    process is interrupted, the previous version is kept as `.bak` and is used on load
+    """
+    temp_filename = filename + ".tmp"
+    backup_filename = filename + ".bak"
+    if not isinstance(content, bytes):
+        content = content.encode("utf-8")
+    write_synced(temp_filename, content)
+    if os.path.exists(filename):
+        if os.path.exists(backup_filename):
+            os.remove(backup_filename)
+        os.rename(filename, backup_filename)
+    os.rename(temp_filename, filename)
+    if os.path.exists(backup_filename):
+        os.remove(backup_filename)
+
+
+def read_manifest(filename):
+    """ Read manifest of the document container (falls back to the backup of interrupted save) """
+    for path in [filename, filename + ".bak"]:
+        if os.path.isfile(path):
+            with open(path, 'r') as f_ptr:
+                return json.load(f_ptr)
+    raise IOError("Could not find document file {}".format(filename))
+
+
+class DocumentContainerWriter(object):
+    """
+    Write document into container: JSON manifest with directory of .npy arrays and
+    pickled metadata (document without the arrays)
+
+    Datasets are named after the hash of their content, so only datasets that changed
+    (including in-place edits) are written. Datasets that were not loaded are reused
+    without reading them and the manifest is replaced last, so an interrupted save leaves
+    the previous version intact
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.data_dir = get_data_dir(filename)
+        self.files = set()
+        self.n_written = 0
+
+    def _new_name(self, prefix, extension):
+        return "{}_{}{}".format(prefix, uuid.uuid4().hex[:16], extension)
+
+    def _content_name(self, prefix, extension, digest):
+        return "{}_{}{}".format(prefix, digest[:16], extension)
+
+    def _write_new(self, name, content=None, array=None):
+        """ Write dataset unless file with the same content already exists """
+        path = os.path.join(self.data_dir, name)
+        if not os.path.exists(path):
+            temp_path = path + ".tmp"
+            write_synced(temp_path, content, array)
+            os.rename(temp_path, path)
+            self.n_written += 1
+        self.files.add(name)
+
+    def _reuse(self, placeholder):
+        """ Reuse file of dataset that did not change since it was loaded/saved """
+        name = os.path.basename(placeholder.path)
+        path = os.path.join(self.data_dir, name)
+        if not os.path.exists(path):
+            shutil.copy2(placeholder.path, path)
+            self.n_written += 1
+        self.files.add(name)
+        return placeholder.__class__(name)
+
+    def write_array(self, prefix, array):
+        data = np.ascontiguousarray(array)
+        digest = hashlib.sha1(str((data.shape, data.dtype.str)))
+        digest.update(data.view(np.uint8).ravel())
+        name = self._content_name(prefix, ".npy", digest.hexdigest())
+        self._write_new(name, array=array)
+        return LazyArray(name)
+
+    def write_object(self, prefix, value):
+        content = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        name = self._content_name(prefix, ".pickle", hashlib.sha1(content).hexdigest())
+        self._write_new(name, content)
+        return LazyObject(name)
+
+    def strip(self, value, prefix):
+        """
+        Replace large arrays in (nested) dictionaries with placeholders
+        :return: value, whether any placeholder was added
+        """
+        if not isinstance(value, dict):
+            return value, False
+
+        out, has_lazy = LazyDict(), False
+        for key in list(value.keys()):
+            item = value.get_raw(key) if isinstance(value, LazyDict) else value[key]
+            if isinstance(item, LazyArray):
+                item, lazy = self._reuse(item), True
+            elif (type(item) is np.ndarray and item.dtype != object
+                  and item.nbytes >= ARRAY_MIN_SIZE):
+                item, lazy = self.write_array(prefix, item), True
+            else:
+                item, lazy = self.strip(item, prefix)
+            out[key] = item
+            has_lazy = has_lazy or lazy
+
+        if not has_lazy:
+            return value, False
+        return out, True
+
+    def get_state(self, document):
+        state = OrderedDict()
+        lazy_attributes = {}
+        for name, value in document.__dict__.get('_lazy_attributes', {}).items():
+            lazy_attributes[name] = self._reuse(value)
+
+        for name, value in document.__dict__.items():
+            if name == '_lazy_attributes':
+                continue
+            elif name in LAZY_OBJECT_ATTRIBUTES and value is not None and len(value) > 0:
+                lazy_attributes[name] = self.write_object(name, value)
+            else:
+                state[name], __ = self.strip(value, name)
+        state['_lazy_attributes'] = lazy_attributes
+        return state
+
+    def persistent_id(self, obj):
+        # lazy dictionaries are stored with their placeholders (pickling them normally would
+        # load all values)
+        if isinstance(obj, LazyDict):
+            return ("dict", [(key, obj.get_raw(key)) for key in obj])
+        elif isinstance(obj, LazyObject):
+            return "object:" + obj.path
+        elif isinstance(obj, LazyArray):
+            return "array:" + obj.path
+        return None
+
+    def write(self, document):
+        """
+        Write document. Returns False if nothing changed since the last save
+        """
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+
+        document.document_filename = self.filename
+        state = self.get_state(document)
+        f_ptr = StringIO()
+        pickler = pickle.Pickler(f_ptr, pickle.HIGHEST_PROTOCOL)
+        pickler.persistent_id = self.persistent_id
+        pickler.dump(state)
+        metadata = f_ptr.getvalue()
+        metadata_hash = hashlib.sha1(metadata).hexdigest()
+
+        # nothing to do if none of the datasets and metadata changed
+        previous = None
+        if os.path.exists(self.filename):
+            try:
+                previous = read_manifest(self.filename)
+            except (IOError, ValueError):
+                pass
+        if (previous is not None and self.n_written == 0 and
+            previous.get("metadata_hash") == metadata_hash and
+            set(previous.get("files", [])) == self.files | set([previous.get("metadata")])):
+            return False
+
+        name = self._new_name("metadata", ".pickle")
+        write_synced(os.path.join(self.data_dir, name), metadata)
+        self.files.add(name)
+
+        manifest = OrderedDict([("format", "ORIGAMI document"),
+                                ("version", CONTAINER_VERSION),
+                                ("title", document.title),
+                                ("docVersion", document.docVersion),
+                                ("saved", time.strftime("%Y-%m-%d %H:%M:%S")),
+                                ("metadata", name),
+                                ("metadata_hash", metadata_hash),
+                                ("files", sorted(self.files))])
+        write_atomic(self.filename, json.dumps(manifest, indent=2))
+        self.remove_unused_files()
+        return True
+
+    def remove_unused_files(self):
+        """ Remove datasets that are no longer referenced by the manifest """
+        for name in os.listdir(self.data_dir):
+            if name not in self.files and os.path.splitext(name)[1] in [".npy", ".pickle", ".tmp"]:
+                try:
+                    os.remove(os.path.join(self.data_dir, name))
+                except OSError as err:
+                    print("Could not remove {}: {}".format(name, err))
+
+
+def save_document(filename=None, document=None):
+    """
+    Save document in the container format
+    """
+    tstart = time.clock()
+    document = cleanup_document(document)
+    writer = DocumentContainerWriter(filename)
+    if not writer.write(document):
+        print("Document {} did not change since it was last saved".format(filename))
+        return False
+    tend = time.clock()
+    print("Saved document in: {} ({} files written). It took {:.4f} seconds.".format(
+        filename, writer.n_written, (tend-tstart)))
+    return True
+
+
+def open_document(filename=None):
+    """
+    Open document saved in the container format. Only the metadata is loaded, datasets are
+    loaded when they are first accessed
+    """
+    tstart = time.clock()
+    manifest = read_manifest(filename)
+    if manifest.get("version", 0) > CONTAINER_VERSION:
+        raise ValueError("Document was saved with newer version of ORIGAMI")
+    data_dir = get_data_dir(filename)
+
+    def persistent_load(pid):
+        if isinstance(pid, tuple):
+            value = LazyDict()
+            for key, item in pid[1]:
+                OrderedDict.__setitem__(value, key, item)
+            return value
+        kind, name = pid.split(":", 1)
+        path = os.path.join(data_dir, name)
+        if kind == "object":
+            return LazyObject(path)
+        return LazyArray(path)
+
+    with open(os.path.join(data_dir, manifest["metadata"]), 'rb') as f_ptr:
+        unpickler = pickle.Unpickler(f_ptr)
+        unpickler.persistent_load = persistent_load
+        state = unpickler.load()
+
+    document = Document()
+    document.__dict__.update(state)
+    # remove defaults of attributes that are loaded on first access
+    for name in document._lazy_attributes:
+        document.__dict__.pop(name, None)
+    tend = time.clock()
+    print("Opened document: {}. It took {:.4f} seconds.".format(filename, (tend-tstart)))
+    return document
@@ -0,0 +1,433 @@
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------------
+#    Copyright (C) 2017-2018 Lukasz G. Migas
+#    <lukasz.migas@manchester.ac.uk> OR <lukas.migas@yahoo.com>
+#
+# 	 GitHub : https://github.com/lukasz-migas/ORIGAMI
+# 	 University of Manchester IP : https://www.click2go.umip.com/i/s_w/ORIGAMI.html
+# 	 Cite : 10.1016/j.ijms.2017.08.014
+#
+#    This program is free software. Feel free to redistribute it and/or
+#    modify it under the condition you cite and credit the authors whenever
+#    appropriate.
+#    The program is distributed in the hope that it will be useful but is
+#    provided WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE
+# -------------------------------------------------------------------------
+# __author__ lukasz.g.migas
+
+"""
+Single extraction API for IM-MS datasets.
+
+All extraction requests (MS, RT, DT, RT x DT and m/z x DT) go through the
+`ExtractionEngine` which delegates the work to one of the backends:
+
+    DriftScope : existing imextract.exe workflow (Windows only)
+    Cube : in-memory NumPy implementation operating on a scan cube with
+           shape (n_scans, n_drift_bins, n_mz_bins), either a dense array or
+           the memory-mapped sidecar from `readers.io_scan_cube`
+
+The cube backend has no process startup or temporary files and can be used
+on any platform (e.g. with the synthetic cube generated by `make_synthetic_cube`)
+"""
+
+import time
+import numpy as np
+
+
+def _normalize(yvals):
+    max_val = np.max(yvals)
+    if max_val == 0:
+        return yvals.astype(np.float64)
+    return np.divide(yvals, max_val, dtype=np.float64)
+
+
+class DriftScopeBackend(object):
+    """
+    Backend that wraps the DriftScope (imextract.exe) extraction functions
+    """
+    name = "DriftScope"
+
+    def __init__(self, path, driftscope_path='C:\DriftScope\lib', **kwargs):
+        # imported here as the module loads MassLynxRaw.dll and Windows-only subprocess flags
+        import readers.io_waters_raw as io_waters
+
+        self.io_waters = io_waters
+        self.path = path
+        self.driftscope_path = driftscope_path
+        self.extract_kwargs = kwargs
+
+    def _kwargs(self, **kwargs):
+        extract_kwargs = dict(self.extract_kwargs)
+        extract_kwargs.update(kwargs)
+        extract_kwargs.update(return_data=True, driftscope_path=self.driftscope_path)
+        return extract_kwargs
+
+    def extract_ms(self, mz_start=0, mz_end=50000, rt_start=0, rt_end=99999.0,
+                   dt_start=1, dt_end=200, bin_size=10000, **kwargs):
+        return self.io_waters.rawMassLynx_MS_extract(
+            path=self.path, bin_size=bin_size, rt_start=rt_start, rt_end=rt_end,
+            dt_start=dt_start, dt_end=dt_end, mz_start=mz_start, mz_end=mz_end,
+            **self._kwargs(**kwargs))
+
+    def extract_rt(self, mz_start=0, mz_end=50000, dt_start=1, dt_end=200, **kwargs):
+        return self.io_waters.rawMassLynx_RT_extract(
+            path=self.path, dt_start=dt_start, dt_end=dt_end,
+            mz_start=mz_start, mz_end=mz_end, **self._kwargs(**kwargs))
+
+    def extract_dt(self, mz_start=0, mz_end=50000, rt_start=0, rt_end=99999.0, **kwargs):
+        return self.io_waters.rawMassLynx_DT_extract(
+            path=self.path, rt_start=rt_start, rt_end=rt_end,
+            mz_start=mz_start, mz_end=mz_end, **self._kwargs(**kwargs))
+
+    def extract_rtdt(self, mz_start=0, mz_end=50000, rt_start=0, rt_end=99999.0, **kwargs):
+        return self.io_waters.rawMassLynx_2DT_extract(
+            path=self.path, rt_start=rt_start, rt_end=rt_end,
+            mz_start=mz_start, mz_end=mz_end, **self._kwargs(**kwargs))
+
+    def extract_ions(self, mz_windows, **kwargs):
+        """
+        DriftScope can only extract one m/z range at a time so all ions are extracted
+        in a single pass over the raw file using the MassLynx SDK instead. Raises IOError
+        if the SDK is not available or cannot open the file
+        """
+        # imported here as the SDK requires MassLynxRaw.dll (Windows only)
+        from readers.io_scan_cube import WatersDriftScanReader
+        try:
+            from readers.waters.MassLynxRawReader import MassLynxException
+        except (ImportError, AttributeError, OSError) as err:
+            # ctypes has no WinDLL outside of Windows
+            raise IOError("MassLynx SDK is not available ({})".format(err))
+
+        try:
+            reader = WatersDriftScanReader(self.path, **kwargs)
+        except MassLynxException as err:
+            raise IOError("MassLynx SDK could not open {} ({})".format(self.path, err))
+        return split_ion_maps(extract_ions_from_reader(reader, mz_windows))
+
+    def extract_mzdt(self, mz_start=0, mz_end=50000, mz_nPoints=5000, dt_start=1, dt_end=200,
+                     **kwargs):
+        return self.io_waters.rawMassLynx_MZDT_extract(
+            path=self.path, mz_start=mz_start, mz_end=mz_end, mz_nPoints=mz_nPoints,
+            dt_start=dt_start, dt_end=dt_end, **self._kwargs(**kwargs))
+
+
+class DenseScanCube(object):
+    """
+    In-memory (or memory-mapped) dense scan cube with shape (n_scans, n_drift_bins, n_mz_bins)
+    """
+
+    def __init__(self, cube):
+        self.cube = cube
+        self.shape = cube.shape
+
+    def drift_scan_map(self, mz_idx):
+        """ Sum m/z bins in the slice, returns array (n_scans, n_drift) """
+        return self.cube[:, :, mz_idx].sum(axis=2, dtype=np.float64)
+
+    def drift_scan_maps(self, mz_slices):
+        """ Sum m/z bins in each slice, returns array (n_ions, n_scans, n_drift) """
+        zvals = np.zeros((len(mz_slices), self.shape[0], self.shape[1]), dtype=np.float64)
+        for ion_idx, mz_idx in enumerate(mz_slices):
+            zvals[ion_idx] = self.drift_scan_map(mz_idx)
+        return zvals
+
+    def mz_drift_map(self, rt_idx, mz_idx=None):
+        """ Sum scans in the slice, returns array (n_drift, n_mz) """
+        zvals = self.cube[rt_idx].sum(axis=0, dtype=np.float64)
+        if mz_idx is not None:
+            zvals[:, :mz_idx.start] = 0
+            zvals[:, mz_idx.stop:] = 0
+        return zvals
+
+
+class CubeBackend(object):
+    """
+    Backend that extracts data directly from a scan cube
+
+    Parameters
+    ----------
+    cube : array (n_scans, n_drift_bins, n_mz_bins) or ScanCube
+        intensity cube, can be a numpy.memmap or the sparse cube from `readers.io_scan_cube`
+    mz_axis : array (n_mz_bins,)
+        centres of the m/z bins
+    rt_axis : array (n_scans,), optional
+        retention time (minutes) of each scan, scan index is used if not provided
+    """
+    name = "Cube"
+
+    def __init__(self, cube, mz_axis=None, rt_axis=None, **kwargs):
+        if isinstance(cube, np.ndarray):
+            cube = DenseScanCube(cube)
+        if mz_axis is None:
+            mz_axis = cube.mz_axis
+        if rt_axis is None:
+            rt_axis = getattr(cube, "rt_axis", None)
+
+        self.cube = cube
+        self.mz_axis = np.asarray(mz_axis)
+        self.n_scans, self.n_drift, self.n_mz = cube.shape
+        if rt_axis is None:
+            rt_axis = np.arange(self.n_scans, dtype=np.float64)
+        self.rt_axis = np.asarray(rt_axis)
+
+        if len(self.mz_axis) != self.n_mz:
+            raise ValueError("m/z axis has {} points but the cube has {} m/z bins".format(
+                len(self.mz_axis), self.n_mz))
+
+    def _mz_slice(self, mz_start, mz_end):
+        idx_start = np.searchsorted(self.mz_axis, mz_start, side='left')
+        idx_end = np.searchsorted(self.mz_axis, mz_end, side='right')
+        return slice(idx_start, idx_end)
+
+    def _rt_slice(self, rt_start, rt_end):
+        idx_start = np.searchsorted(self.rt_axis, rt_start, side='left')
+        idx_end = np.searchsorted(self.rt_axis, rt_end, side='right')
+        return slice(idx_start, idx_end)
+
+    def _dt_slice(self, dt_start, dt_end):
+        # drift bins are 1-indexed and inclusive (same as DriftScope)
+        idx_start = max(int(dt_start) - 1, 0)
+        idx_end = min(int(dt_end), self.n_drift)
+        return slice(idx_start, idx_end)
+
+    def extract_ms(self, mz_start=0, mz_end=50000, rt_start=0, rt_end=99999.0,
+                   dt_start=1, dt_end=200, **kwargs):
+        mz_idx = self._mz_slice(mz_start, mz_end)
+        zvals = self.cube.mz_drift_map(self._rt_slice(rt_start, rt_end), mz_idx)
+        yvals = zvals[self._dt_slice(dt_start, dt_end), mz_idx].sum(axis=0)
+        xvals = self.mz_axis[mz_idx]
+        if kwargs.get("normalize", True):
+            yvals = _normalize(yvals)
+        return xvals, yvals
+
+    def extract_rt(self, mz_start=0, mz_end=50000, dt_start=1, dt_end=200, **kwargs):
+        zvals = self.cube.drift_scan_map(self._mz_slice(mz_start, mz_end))
+        yvals = zvals[:, self._dt_slice(dt_start, dt_end)].sum(axis=1)
+        xvals = np.arange(1, self.n_scans + 1)
+        if kwargs.get("normalize", False):
+            return xvals, yvals, _normalize(yvals)
+        return xvals, yvals
+
+    def extract_dt(self, mz_start=0, mz_end=50000, rt_start=0, rt_end=99999.0, **kwargs):
+        zvals = self.cube.drift_scan_map(self._mz_slice(mz_start, mz_end))
+        yvals = zvals[self._rt_slice(rt_start, rt_end)].sum(axis=0)
+        xvals = np.arange(1, self.n_drift + 1)
+        if kwargs.get("normalize", False):
+            return xvals, yvals, _normalize(yvals)
+        return xvals, yvals
+
+    def extract_rtdt(self, mz_start=0, mz_end=50000, rt_start=0, rt_end=99999.0, **kwargs):
+        rt_idx = self._rt_slice(rt_start, rt_end)
+        scan_map = self.cube.drift_scan_map(self._mz_slice(mz_start, mz_end))
+        # output is in the same orientation as DriftScope (drift bins x scans)
+        zvals = np.zeros((self.n_drift, self.n_scans), dtype=np.float64)
+        zvals[:, rt_idx] = scan_map[rt_idx].T
+        return zvals
+
+    def extract_ions(self, mz_windows, **kwargs):
+        mz_slices = [self._mz_slice(mz_start, mz_end) for mz_start, mz_end in mz_windows]
+        return split_ion_maps(self.cube.drift_scan_maps(mz_slices))
+
+    def extract_mzdt(self, mz_start=0, mz_end=50000, mz_nPoints=5000, dt_start=1, dt_end=200,
+                     **kwargs):
+        mz_idx = self._mz_slice(mz_start, mz_end)
+        dt_idx = self._dt_slice(dt_start, dt_end)
+        summed = self.cube.mz_drift_map(slice(0, self.n_scans), mz_idx)[dt_idx, mz_idx]
+
+        # rebin m/z axis onto requested number of points
+        mz_bins = np.linspace(mz_start, mz_end, int(mz_nPoints) + 1)
+        bin_idx = np.searchsorted(mz_bins, self.mz_axis[mz_idx], side='right') - 1
+        bin_idx = np.clip(bin_idx, 0, int(mz_nPoints) - 1)
+
+        zvals = np.zeros((self.n_drift, int(mz_nPoints)), dtype=np.float64)
+        np.add.at(zvals[dt_idx], (slice(None), bin_idx), summed)
+        return zvals
+
+
+def extract_ions_from_reader(reader, mz_windows):
+    """
+    Extract drift time/scan maps for many m/z windows in a single pass over the file.
+
+    Each drift scan is read once; the intensities are converted to a cumulative sum
+    and the sum within every window is obtained from the window bounds found with
+    `searchsorted`, so the cost grows with the size of the data and not with the
+    number of ions.
+
+    Parameters
+    ----------
+    reader : object
+        object with `n_scans`, `n_drift` attributes and `read_drift_scan(scan, drift)` method
+    mz_windows : list of (mz_start, mz_end)
+
+    Returns
+    -------
+    zvals : array (n_ions, n_scans, n_drift)
+    """
+    tstart = time.time()
+    mz_windows = np.asarray(mz_windows, dtype=np.float64).reshape(-1, 2)
+    mz_starts, mz_ends = mz_windows[:, 0], mz_windows[:, 1]
+
+    zvals = np.zeros((len(mz_windows), reader.n_scans, reader.n_drift), dtype=np.float64)
+    cumsum = np.zeros(1, dtype=np.float64)
+    for scan in range(reader.n_scans):
+        for drift in range(reader.n_drift):
+            masses, intensities = reader.read_drift_scan(scan, drift)
+            n_points = len(masses)
+            if n_points == 0:
+                continue
+            if np.any(masses[1:] < masses[:-1]):
+                order = np.argsort(masses, kind="mergesort")
+                masses, intensities = masses[order], intensities[order]
+            if len(cumsum) < n_points + 1:
+                cumsum = np.zeros(n_points + 1, dtype=np.float64)
+            np.cumsum(intensities, out=cumsum[1:n_points + 1])
+            idx_start = np.searchsorted(masses, mz_starts, side="left")
+            idx_end = np.searchsorted(masses, mz_ends, side="right")
+            zvals[:, scan, drift] = cumsum[idx_end] - cumsum[idx_start]
+
+    print("Extracted {} ions in a single pass in {:.4f} seconds".format(len(mz_windows), time.time() - tstart))
+    return zvals
+
+
+def split_ion_maps(zvals):
+    """
+    Convert (n_ions, n_scans, n_drift) array to list of (mobiligram, chromatogram, heatmap)
+    tuples, with heatmap in the same orientation as DriftScope (drift bins x scans)
+    """
+    return [(ion_map.sum(axis=0), ion_map.sum(axis=1), ion_map.T.copy()) for ion_map in zvals]
+
+
+EXTRACTION_BACKENDS = {DriftScopeBackend.name: DriftScopeBackend,
+                       CubeBackend.name: CubeBackend}
+
+
+class ExtractionEngine(object):
+    """
+    Single entry point for all extraction requests of a raw file
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    @property
+    def backend_name(self):
+        return self.backend.name
+
+    def _run(self, fcn, label, **kwargs):
+        tstart = time.time()
+        out = fcn(**kwargs)
+        print("Extracted {} ({}) in {:.4f} seconds".format(label, self.backend.name, time.time() - tstart))
+        return out
+
+    def extract_ms(self, **kwargs):
+        """ Returns m/z and intensity arrays """
+        return self._run(self.backend.extract_ms, "mass spectrum", **kwargs)
+
+    def extract_rt(self, **kwargs):
+        """ Returns scan and intensity arrays (and normalized intensity if `normalize=True`) """
+        return self._run(self.backend.extract_rt, "chromatogram", **kwargs)
+
+    def extract_dt(self, **kwargs):
+        """ Returns drift bin and intensity arrays (and normalized intensity if `normalize=True`) """
+        return self._run(self.backend.extract_dt, "mobiligram", **kwargs)
+
+    def extract_rtdt(self, **kwargs):
+        """ Returns heatmap with shape (n_drift_bins, n_scans) """
+        return self._run(self.backend.extract_rtdt, "heatmap", **kwargs)
+
+    def extract_mzdt(self, **kwargs):
+        """ Returns heatmap with shape (n_drift_bins, mz_nPoints) """
+        return self._run(self.backend.extract_mzdt, "m/z vs DT heatmap", **kwargs)
+
+    def extract_ions(self, mz_windows, **kwargs):
+        """
+        Extract mobiligram, chromatogram and heatmap for each m/z window. Backends that
+        support it extract all windows at once, otherwise (or if the backend raises IOError,
+        e.g. when the MassLynx SDK is not available) each ion is extracted separately
+
+        Returns
+        -------
+        ion_data : list of (mobiligram, chromatogram, heatmap) in the order of `mz_windows`
+        """
+        if hasattr(self.backend, "extract_ions"):
+            try:
+                return self._run(self.backend.extract_ions, "{} ions".format(len(mz_windows)),
+                                 mz_windows=mz_windows, **kwargs)
+            except (IOError, OSError) as err:
+                print("Batch extraction is not available ({}) - extracting ions one at a time".format(err))
+
+        ion_data = []
+        for mz_start, mz_end in mz_windows:
+            __, yvals1D = self.extract_dt(mz_start=mz_start, mz_end=mz_end)
+            __, yvalsRT = self.extract_rt(mz_start=mz_start, mz_end=mz_end)
+            zvals = self.extract_rtdt(mz_start=mz_start, mz_end=mz_end)
+            ion_data.append((yvals1D, yvalsRT, zvals))
+        return ion_data
+
+
+def get_extraction_engine(path=None, backend="DriftScope", **kwargs):
+    """
+    Instantiate extraction engine for specified file
+
+    Parameters
+    ----------
+    path : str
+        path to the raw file
+    backend : str
+        name of the backend, one of `EXTRACTION_BACKENDS`
+    kwargs :
+        backend specific parameters, e.g. `driftscope_path` for DriftScope or
+        `cube`, `mz_axis`, `rt_axis` for the Cube backend. The sparse cube built
+        by `readers.io_scan_cube` carries its own axes
+    """
+    if backend not in EXTRACTION_BACKENDS:
+        raise ValueError("Unknown extraction backend '{}'. Available: {}".format(
+            backend, ", ".join(sorted(EXTRACTION_BACKENDS.keys()))))
+
+    if backend == CubeBackend.name:
+        backend = CubeBackend(**kwargs)
+    else:
+        backend = EXTRACTION_BACKENDS[backend](path, **kwargs)
+
+    return ExtractionEngine(backend)
+
+
+def make_synthetic_cube(n_scans=200, n_drift=200, mz_start=500., mz_end=2500., n_mz=2000,
+                        n_ions=10, scan_time=1.0, noise=0.0, seed=None):
+    """
+    Generate synthetic scan cube with a number of Gaussian ions. Each ion has a
+    random m/z, drift time and an intensity profile across the scans.
+
+    Returns
+    -------
+    cube : array (n_scans, n_drift, n_mz), float32
+    mz_axis : array (n_mz,)
+    rt_axis : array (n_scans,) in minutes
+    """
+    random_state = np.random.RandomState(seed)
+    mz_axis = np.linspace(mz_start, mz_end, n_mz)
+    dt_axis = np.arange(n_drift, dtype=np.float64)
+    scan_axis = np.arange(n_scans, dtype=np.float64)
+    rt_axis = scan_axis * scan_time / 60.
+
+    cube = np.zeros((n_scans, n_drift, n_mz), dtype=np.float32)
+    for __ in range(n_ions):
+        mz_centre = random_state.uniform(mz_start, mz_end)
+        mz_width = random_state.uniform(0.5, 5.0)
+        dt_centre = random_state.uniform(0.1, 0.9) * n_drift
+        dt_width = random_state.uniform(1.0, 8.0)
+        scan_centre = random_state.uniform(0, n_scans)
+        scan_width = random_state.uniform(0.05, 0.5) * n_scans
+        amplitude = random_state.uniform(100., 1000.)
+
+        mz_profile = np.exp(-(mz_axis - mz_centre) ** 2 / (2 * mz_width ** 2))
+        dt_profile = np.exp(-(dt_axis - dt_centre) ** 2 / (2 * dt_width ** 2))
+        scan_profile = amplitude * np.exp(-(scan_axis - scan_centre) ** 2 / (2 * scan_width ** 2))
+        cube += np.einsum('i,j,k->ijk', scan_profile, dt_profile, mz_profile).astype(np.float32)
+
+    if noise > 0:
+        cube += random_state.uniform(0, noise, cube.shape).astype(np.float32)
+
+    return cube, mz_axis, rt_axis
@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------------
+#    Copyright (C) 2017-2018 Lukasz G. Migas
+#    <lukasz.migas@manchester.ac.uk> OR <lukas.migas@yahoo.com>
+#
+# 	 GitHub : https://github.com/lukasz-migas/ORIGAMI
+# 	 University of Manchester IP : https://www.click2go.umip.com/i/s_w/ORIGAMI.html
+# 	 Cite : 10.1016/j.ijms.2017.08.014
+#
+#    This program is free software. Feel free to redistribute it and/or
+#    modify it under the condition you cite and credit the authors whenever
+#    appropriate.
+#    The program is distributed in the hope that it will be useful but is
+#    provided WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE
+# -------------------------------------------------------------------------
+# __author__ lukasz.g.migas
+
+"""
+Persistent scan cube (scan x drift bin x m/z bin) stored next to the raw file.
+
+The cube is built once by reading every drift scan of the raw file and binning it
+onto a fixed m/z axis. Only non-zero cells are stored, sorted by the m/z bin, so
+that every m/z window is a contiguous slice of the (memory-mapped) arrays:
+
+    col_ptr   : int64 (n_mz + 1) - start of each m/z bin in the arrays below
+    row_idx   : int32 (nnz) - flattened (scan * n_drift + drift) index
+    intensity : float32 (nnz)
+
+The sidecar directory also contains the m/z and retention time axes and a
+metadata file with the modification time and size of the raw file. The cube
+is ignored (and should be rebuilt) when the raw file changes.
+"""
+
+import os
+import json
+import time
+import shutil
+import numpy as np
+from numpy.lib.format import open_memmap
+
+CUBE_VERSION = 1
+CUBE_EXTENSION = ".cube"
+
+
+def get_cube_path(path):
+    """ Get path of the sidecar directory for the raw file """
+    return path.rstrip("/\\") + CUBE_EXTENSION
+
+
+def get_raw_signature(path):
+    """
+    Get modification time and size of the raw file. Waters files are directories
+    so the signature is computed from all files within it
+    """
+    if os.path.isdir(path):
+        size, mtime = 0, 0
+        for root, __, filenames in os.walk(path):
+            for filename in filenames:
+                stats = os.stat(os.path.join(root, filename))
+                size += stats.st_size
+                mtime = max(mtime, stats.st_mtime)
+    else:
+        stats = os.stat(path)
+        size, mtime = stats.st_size, stats.st_mtime
+
+    return {"size": int(size), "mtime": float(mtime)}
+
+
+class WatersDriftScanReader(object):
+    """
+    Read individual drift scans from Waters (.raw) file using the MassLynx SDK
+    """
+
+    def __init__(self, path, function=0, n_drift=200):
+        # imported here as the SDK requires MassLynxRaw.dll (Windows only)
+        from readers.waters.MassLynxRawReader import MassLynxRawReader
+        from readers.waters.MassLynxRawInfoReader import MassLynxRawInfoReader
+        from readers.waters.MassLynxRawScanReader import MassLynxRawScanReader
+
+        self.function = function
+        self.n_drift = n_drift
+        self.reader = MassLynxRawReader(path, 1)
+        self.info_reader = MassLynxRawInfoReader(self.reader)
+        self.scan_reader = MassLynxRawScanReader(self.reader)
+
+        self.n_scans = self.info_reader.GetScansInFunction(function)
+        self.mz_range = self.info_reader.GetAcquisitionMassRange(function)
+        self.rt_axis = np.array([self.info_reader.GetRetentionTime(function, scan)
+                                 for scan in range(self.n_scans)])
+
+    def read_drift_scan(self, scan, drift):
+        masses, intensities = self.scan_reader.ReadDriftScan(self.function, scan, drift)
+        return np.asarray(masses, dtype=np.float32), np.asarray(intensities, dtype=np.float32)
+
+
+class ScanCube(object):
+    """
+    Memory-mapped sparse scan cube
+    """
+
+    def __init__(self, cube_path):
+        self.cube_path = cube_path
+        with open(os.path.join(cube_path, "metadata.json"), "r") as f_ptr:
+            self.metadata = json.load(f_ptr)
+
+        self.n_scans = self.metadata["n_scans"]
+        self.n_drift = self.metadata["n_drift"]
+        self.n_mz = self.metadata["n_mz"]
+        self.shape = (self.n_scans, self.n_drift, self.n_mz)
+
+        self.mz_axis = np.load(os.path.join(cube_path, "mz_axis.npy"))
+        self.rt_axis = np.load(os.path.join(cube_path, "rt_axis.npy"))
+        self.col_ptr = np.load(os.path.join(cube_path, "col_ptr.npy"))
+        self.row_idx = np.load(os.path.join(cube_path, "row_idx.npy"), mmap_mode="r")
+        self.intensity = np.load(os.path.join(cube_path, "intensity.npy"), mmap_mode="r")
+
+    @property
+    def nbytes(self):
+        return self.row_idx.nbytes + self.intensity.nbytes + self.col_ptr.nbytes
+
+    def is_valid(self, path):
+        """ Check the cube still matches the raw file """
+        return self.metadata.get("version") == CUBE_VERSION and \
+            self.metadata.get("raw_signature") == get_raw_signature(path)
+
+    def drift_scan_map(self, mz_idx):
+        """
+        Sum all m/z bins in the slice
+
+        Returns
+        -------
+        zvals : array (n_scans, n_drift)
+        """
+        start, end = self.col_ptr[mz_idx.start], self.col_ptr[mz_idx.stop]
+        zvals = np.bincount(self.row_idx[start:end], weights=self.intensity[start:end],
+                            minlength=self.n_scans * self.n_drift)
+        return zvals.reshape((self.n_scans, self.n_drift))
+
+    def drift_scan_maps(self, mz_slices):
+        """
+        Sum m/z bins in each slice using a single bincount over all slices
+
+        Returns
+        -------
+        zvals : array (n_ions, n_scans, n_drift)
+        """
+        n_rows = self.n_scans * self.n_drift
+        bounds = [(self.col_ptr[mz_idx.start], self.col_ptr[mz_idx.stop]) for mz_idx in mz_slices]
+        lengths = [end - start for start, end in bounds]
+        if sum(lengths) == 0:
+            return np.zeros((len(mz_slices), self.n_scans, self.n_drift), dtype=np.float64)
+
+        labels = np.repeat(np.arange(len(mz_slices), dtype=np.int64) * n_rows, lengths)
+        row_idx = np.concatenate([self.row_idx[start:end] for start, end in bounds])
+        intensity = np.concatenate([self.intensity[start:end] for start, end in bounds])
+        zvals = np.bincount(labels + row_idx, weights=intensity, minlength=len(mz_slices) * n_rows)
+        return zvals.reshape((len(mz_slices), self.n_scans, self.n_drift))
+
+    def mz_drift_map(self, rt_idx, mz_idx=None):
+        """
+        Sum all scans in the slice
+
+        Returns
+        -------
+        zvals : array (n_drift, n_mz)
+        """
+        if mz_idx is None:
+            mz_idx = slice(0, self.n_mz)
+        start, end = self.col_ptr[mz_idx.start], self.col_ptr[mz_idx.stop]
+        row_idx = self.row_idx[start:end]
+        intensity = self.intensity[start:end]
+        cols = np.repeat(np.arange(mz_idx.start, mz_idx.stop, dtype=np.int64),
+                         np.diff(self.col_ptr[mz_idx.start:mz_idx.stop + 1]))
+
+        scans = row_idx // self.n_drift
+        rt_start, rt_stop, __ = rt_idx.indices(self.n_scans)
+        if rt_start > 0 or rt_stop < self.n_scans:
+            mask = (scans >= rt_start) & (scans < rt_stop)
+            row_idx, intensity, cols = row_idx[mask], intensity[mask], cols[mask]
+
+        drift = row_idx % self.n_drift
+        zvals = np.bincount(drift * self.n_mz + cols, weights=intensity,
+                            minlength=self.n_drift * self.n_mz)
+        return zvals.reshape((self.n_drift, self.n_mz))
+
+
+def build_scan_cube(path, reader=None, mz_start=None, mz_end=None, mz_bin=1.0,
+                    function=0, n_drift=200, cube_path=None, chunk_size=10000000):
+    """
+    Bin all drift scans of the raw file into a sparse scan cube and save it
+    next to the raw file
+
+    Parameters
+    ----------
+    path : str
+        path to the raw file
+    reader : object
+        object with `n_scans`, `n_drift`, `rt_axis` attributes and `read_drift_scan(scan, drift)`
+        method. The MassLynx SDK reader is used if not provided
+    mz_start, mz_end : float
+        m/z range of the cube, acquisition range is used if not provided
+    mz_bin : float
+        size of the m/z bins
+    chunk_size : int
+        number of elements sorted in one go when the cube is written to disk
+    """
+    tstart = time.time()
+    if reader is None:
+        reader = WatersDriftScanReader(path, function=function, n_drift=n_drift)
+    if mz_start is None or mz_end is None:
+        mz_start, mz_end = reader.mz_range
+    if cube_path is None:
+        cube_path = get_cube_path(path)
+
+    n_scans, n_drift = reader.n_scans, reader.n_drift
+    mz_bins = np.arange(mz_start, mz_end + mz_bin, mz_bin)
+    n_mz = len(mz_bins) - 1
+    mz_axis = mz_bins[:-1] + mz_bin / 2.
+
+    # cube is written to temporary directory and moved when it is finished
+    temp_path = cube_path + ".tmp"
+    if os.path.exists(temp_path):
+        shutil.rmtree(temp_path)
+    os.makedirs(temp_path)
+
+    # first pass: bin each scan and write (row, col, intensity) triplets in scan order
+    counts = np.zeros(n_mz, dtype=np.int64)
+    scan_files = [os.path.join(temp_path, name) for name in ["_row.bin", "_col.bin", "_int.bin"]]
+    row_file, col_file, int_file = [open(filename, "wb") for filename in scan_files]
+    for scan in range(n_scans):
+        # collect (drift, m/z) cells of all drift scans and only sum the occupied cells
+        scan_cells, scan_intensities = [], []
+        for drift in range(n_drift):
+            masses, intensities = reader.read_drift_scan(scan, drift)
+            if len(masses) == 0:
+                continue
+            cols = np.searchsorted(mz_bins, masses, side="right") - 1
+            mask = (cols >= 0) & (cols < n_mz)
+            scan_cells.append(drift * n_mz + cols[mask].astype(np.int64))
+            scan_intensities.append(np.asarray(intensities, dtype=np.float64)[mask])
+        if not scan_cells:
+            continue
+        cells, inverse = np.unique(np.concatenate(scan_cells), return_inverse=True)
+        sums = np.bincount(inverse, weights=np.concatenate(scan_intensities), minlength=len(cells))
+        nonzero = sums != 0
+        cells, sums = cells[nonzero], sums[nonzero]
+        cols = (cells % n_mz).astype(np.int32)
+        rows = (scan * n_drift + cells // n_mz).astype(np.int32)
+        rows.tofile(row_file)
+        cols.tofile(col_file)
+        sums.astype(np.float32).tofile(int_file)
+        counts += np.bincount(cols, minlength=n_mz)
+    for f_ptr in [row_file, col_file, int_file]:
+        f_ptr.close()
+
+    # second pass: counting sort of the triplets by m/z bin
+    nnz = int(counts.sum())
+    col_ptr = np.zeros(n_mz + 1, dtype=np.int64)
+    np.cumsum(counts, out=col_ptr[1:])
+    cursor = col_ptr[:-1].copy()
+
+    row_idx = open_memmap(os.path.join(temp_path, "row_idx.npy"), mode="w+", dtype=np.int32, shape=(nnz,))
+    intensity = open_memmap(os.path.join(temp_path, "intensity.npy"), mode="w+", dtype=np.float32, shape=(nnz,))
+    if nnz > 0:
+        scan_rows = np.memmap(scan_files[0], dtype=np.int32, mode="r")
+        scan_cols = np.memmap(scan_files[1], dtype=np.int32, mode="r")
+        scan_ints = np.memmap(scan_files[2], dtype=np.float32, mode="r")
+        for start in range(0, nnz, chunk_size):
+            end = min(start + chunk_size, nnz)
+            cols = np.asarray(scan_cols[start:end])
+            order = np.argsort(cols, kind="mergesort")
+            cols = cols[order]
+            # position of each element within its own m/z bin in this chunk
+            first = np.searchsorted(cols, cols, side="left")
+            positions = cursor[cols] + (np.arange(len(cols)) - first)
+            row_idx[positions] = scan_rows[start:end][order]
+            intensity[positions] = scan_ints[start:end][order]
+            cursor += np.bincount(cols, minlength=n_mz)
+        del scan_rows, scan_cols, scan_ints
+    row_idx.flush()
+    intensity.flush()
+    del row_idx, intensity
+    for filename in scan_files:
+        os.remove(filename)
+
+    np.save(os.path.join(temp_path, "col_ptr.npy"), col_ptr)
+    np.save(os.path.join(temp_path, "mz_axis.npy"), mz_axis)
+    np.save(os.path.join(temp_path, "rt_axis.npy"), np.asarray(reader.rt_axis, dtype=np.float64))
+    metadata = {"version": CUBE_VERSION,
+                "raw_signature": get_raw_signature(path),
+                "n_scans": int(n_scans), "n_drift": int(n_drift), "n_mz": int(n_mz),
+                "mz_start": float(mz_start), "mz_end": float(mz_end), "mz_bin": float(mz_bin),
+                "nnz": nnz}
+    with open(os.path.join(temp_path, "metadata.json"), "w") as f_ptr:
+        json.dump(metadata, f_ptr, indent=2)
+
+    if os.path.exists(cube_path):
+        shutil.rmtree(cube_path)
+    os.rename(temp_path, cube_path)
+    print("Built scan cube ({} scans, {} drift bins, {} m/z bins, {} non-zero) in {:.4f} seconds".format(
+        n_scans, n_drift, n_mz, nnz, time.time() - tstart))
+
+    return ScanCube(cube_path)
+
+
+def load_scan_cube(path, cube_path=None):
+    """
+    Load scan cube for the raw file. Returns None if the cube does not exist or is
+    out of date
+    """
+    if cube_path is None:
+        cube_path = get_cube_path(path)
+    if not os.path.isfile(os.path.join(cube_path, "metadata.json")):
+        return None
+
+    try:
+        cube = ScanCube(cube_path)
+    except (IOError, OSError, ValueError, KeyError) as err:
+        print("Failed to load scan cube: {}".format(err))
+        return None
+
+    if not cube.is_valid(path):
+        print("Scan cube {} is out of date - the raw file has changed".format(cube_path))
+        return None
+
+    return cube
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------------
+#    Copyright (C) 2017-2018 Lukasz G. Migas
+#    <lukasz.migas@manchester.ac.uk> OR <lukas.migas@yahoo.com>
+#
+# 	 GitHub : https://github.com/lukasz-migas/ORIGAMI
+# 	 University of Manchester IP : https://www.click2go.umip.com/i/s_w/ORIGAMI.html
+# 	 Cite : 10.1016/j.ijms.2017.08.014
+#
+#    This program is free software. Feel free to redistribute it and/or
+#    modify it under the condition you cite and credit the authors whenever
+#    appropriate.
+#    The program is distributed in the hope that it will be useful but is
+#    provided WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE
+# -------------------------------------------------------------------------
+# __author__ lukasz.g.migas
+
+"""
+Cumulative (prefix-sum) index of mass spectra over scans.
+
+Every scan is linearised onto a fixed m/z axis and accumulated, so that row `i`
+of the index contains the sum of scans [0, i). The summed spectrum of any scan
+range [start, end) is then `index[end] - index[start]`. The index is stored next
+to the raw file and memory-mapped when loaded.
+"""
+
+import os
+import json
+import time
+import shutil
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from processing.spectra import get_linearization_range, get_resampling_operator
+from readers.io_scan_cube import get_raw_signature
+
+INDEX_VERSION = 1
+INDEX_EXTENSION = ".msindex"
+
+
+def get_index_path(path):
+    """ Get path of the sidecar directory for the raw file """
+    return path.rstrip("/\\") + INDEX_EXTENSION
+
+
+def get_index_parameters(mz_start, mz_end, binsize, linearization_mode):
+    return {"mz_start": float(mz_start), "mz_end": float(mz_end),
+            "binsize": float(binsize), "linearization_mode": linearization_mode}
+
+
+def get_index_axis(mz_start, mz_end, binsize, linearization_mode):
+    """
+    Get the m/z axis (and bin edges for `Binning` mode) in the same way as `rawMassLynx_MS_bin`
+    """
+    if linearization_mode == "Binning":
+        ms_edges = np.arange(mz_start, mz_end + binsize, binsize)
+        return ms_edges[:-1] + (binsize / 2.), ms_edges
+
+    return get_linearization_range(mz_start, mz_end, binsize, linearization_mode), None
+
+
+def estimate_index_size(n_scans, mz_start, mz_end, binsize, linearization_mode):
+    """ Estimate size (bytes) of the index """
+    mz_axis, __ = get_index_axis(mz_start, mz_end, binsize, linearization_mode)
+    return (n_scans + 1) * len(mz_axis) * np.dtype(np.float64).itemsize
+
+
+class ScanSpectrumIndex(object):
+    """
+    Memory-mapped cumulative spectrum index
+    """
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        with open(os.path.join(index_path, "metadata.json"), "r") as f_ptr:
+            self.metadata = json.load(f_ptr)
+
+        self.mz_axis = np.load(os.path.join(index_path, "mz_axis.npy"))
+        self.cumsum = np.load(os.path.join(index_path, "cumsum.npy"), mmap_mode="r")
+        self.n_scans = self.cumsum.shape[0] - 1
+
+    def is_valid(self, path, **parameters):
+        """ Check the index matches the raw file and the linearisation parameters """
+        return self.metadata.get("version") == INDEX_VERSION and \
+            self.metadata.get("raw_signature") == get_raw_signature(path) and \
+            self.metadata.get("parameters") == parameters
+
+    def get_spectrum(self, start_scan=0, end_scan=-1):
+        """
+        Get summed spectrum for scans [start_scan, end_scan), uses the same scan
+        numbering as `rawMassLynx_MS_bin`
+        """
+        if end_scan == -1 or end_scan > self.n_scans:
+            end_scan = self.n_scans
+        start_scan = min(max(int(start_scan), 0), end_scan)
+        yvals = np.subtract(self.cumsum[int(end_scan)], self.cumsum[start_scan])
+        return self.mz_axis, yvals
+
+
+def build_scan_index(path, scans, n_scans, mz_start, mz_end, binsize, linearization_mode,
+                     index_path=None):
+    """
+    Build cumulative spectrum index
+
+    Parameters
+    ----------
+    path : str
+        path to the raw file
+    scans : iterable
+        yields (scan, msX, msY) for each scan, in order (e.g. `rawMassLynx_MS_scans`)
+    n_scans : int
+        number of scans in the file
+    """
+    tstart = time.time()
+    if index_path is None:
+        index_path = get_index_path(path)
+    mz_axis, ms_edges = get_index_axis(mz_start, mz_end, binsize, linearization_mode)
+
+    temp_path = index_path + ".tmp"
+    if os.path.exists(temp_path):
+        shutil.rmtree(temp_path)
+    os.makedirs(temp_path)
+
+    cumsum = open_memmap(os.path.join(temp_path, "cumsum.npy"), mode="w+", dtype=np.float64,
+                         shape=(n_scans + 1, len(mz_axis)))
+    running = np.zeros(len(mz_axis), dtype=np.float64)
+    cumsum[0] = running
+    operator, last_msX = None, None
+    for idx, (__, msX, msY) in enumerate(scans):
+        if idx >= n_scans:
+            break
+        if last_msX is None or len(msX) != len(last_msX) or not np.array_equal(msX, last_msX):
+            operator = get_resampling_operator(msX, mz_axis, linearization_mode, ms_edges)
+            last_msX = msX.copy()
+        running += operator.dot(msY)
+        cumsum[idx + 1] = running
+    cumsum.flush()
+    del cumsum
+
+    np.save(os.path.join(temp_path, "mz_axis.npy"), mz_axis)
+    metadata = {"version": INDEX_VERSION,
+                "raw_signature": get_raw_signature(path),
+                "parameters": get_index_parameters(mz_start, mz_end, binsize, linearization_mode),
+                "n_scans": int(n_scans)}
+    with open(os.path.join(temp_path, "metadata.json"), "w") as f_ptr:
+        json.dump(metadata, f_ptr, indent=2)
+
+    if os.path.exists(index_path):
+        shutil.rmtree(index_path)
+    os.rename(temp_path, index_path)
+    print("Built spectrum index ({} scans, {} m/z points) in {:.4f} seconds".format(
+        n_scans, len(mz_axis), time.time() - tstart))
+
+    return ScanSpectrumIndex(index_path)
+
+
+def load_scan_index(path, mz_start, mz_end, binsize, linearization_mode, index_path=None):
+    """
+    Load spectrum index for the raw file. Returns None if the index does not exist,
+    is out of date or was built with different parameters
+    """
+    if index_path is None:
+        index_path = get_index_path(path)
+    if not os.path.isfile(os.path.join(index_path, "metadata.json")):
+        return None
+
+    try:
+        index = ScanSpectrumIndex(index_path)
+    except (IOError, OSError, ValueError, KeyError) as err:
+        print("Failed to load spectrum index: {}".format(err))
+        return None
+
+    parameters = get_index_parameters(mz_start, mz_end, binsize, linearization_mode)
+    if not index.is_valid(path, **parameters):
+        return None
+
+    return index
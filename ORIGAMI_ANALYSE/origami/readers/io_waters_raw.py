@@ -24,7 +24,7 @@ import numpy as np
 from ctypes import cdll, c_float, byref
 
 from toolbox import strictly_increasing
-from processing.spectra import get_linearization_range, bin_1D, linearize
+from processing.spectra import get_linearization_range, get_resampling_operator
 from gui_elements.misc_dialogs import dlgBox
 from io_utils import clean_up
 
@@ -374,13 +374,40 @@ def rawMassLynx_MZDT_load(path=None, inputFile='output.2dDTMZ', normalize=False,
 # ##
 
 
-def rawMassLynx_MS_bin(filename=None, startScan=0, endScan=-1, function=1,
-                       mzStart=None, mzEnd=None, binsize=None, binData=False,
-                       **kwargs):
+def _read_scans(filePointer, dataPointer, function, msRange):
     """
-    Extract MS data, bin it
+    Read scans using a single buffer that is only reallocated when a larger scan is found
+    ---
+    yields scan number, msX, msY (the arrays are overwritten by the next scan)
+    """
+    xpoint = c_float()
+    ypoint = c_float()
+    buffer_size = 0
+    for scan in msRange:
+        nPoints = mlLib.getScanSize(dataPointer, function, scan)
+        # Read XY coordinates
+        mlLib.getXYCoordinates(filePointer, function, scan, byref(xpoint), byref(ypoint))
+        if nPoints > buffer_size:
+            buffer_size = nPoints
+            mzP = (c_float * buffer_size)()
+            mzI = (c_float * buffer_size)()
+            msX_buffer = np.ndarray((buffer_size,), 'f', mzP, order='C')
+            msY_buffer = np.ndarray((buffer_size,), 'f', mzI, order='C')
+        # Read spectrum
+        mlLib.readSpectrum(dataPointer, function, scan, byref(mzP), byref(mzI))
+        yield scan, msX_buffer[:nPoints], msY_buffer[:nPoints]
+
+
+def rawMassLynx_MS_bin_array(filename=None, startScan=0, endScan=-1, function=1,
+                             mzStart=None, mzEnd=None, binsize=None, binData=True,
+                             sum_only=True, **kwargs):
+    """
+    Extract MS data and bin each scan straight into a preallocated array
     ---
     @param binData: boolean, determines if data should be binned or not
+    @param sum_only: boolean, if True only the summed spectrum is kept, otherwise each
+        scan is written into (n_scans x n_bins) float32 array
+    @return msCentre, msY, rtY (summed intensity of each scan)
     """
     tstart = time.clock()
     # Create pointer to the file
@@ -394,21 +421,13 @@ def rawMassLynx_MS_bin(filename=None, startScan=0, endScan=-1, function=1,
     dataPointer = mlLib.newCMassLynxRawScanReader(filePointer)
     # Extract number of scans available from the file
     nScans = mlLib.getScansInFunction(dataPointer, function)
-    # Initilise pointers to data
-    xpoint = c_float()
-    ypoint = c_float()
-    # Initilise empty lists
-    msX = []
-    msY = []
-    msDict = {}
     if endScan == -1 or endScan > nScans:
         endScan = nScans
-    if 'linearization_mode' in kwargs:
-        if kwargs['linearization_mode'] == 'Raw':
-            binData = False
-
+    if kwargs.get('linearization_mode', None) == 'Raw':
+        binData = False
     if binsize == 0.: binData = False
 
+    msList = None
     if binData:
         if 'auto_range' in kwargs and kwargs['auto_range'] :
             mzStart = kwargs['mz_min']
@@ -422,33 +441,129 @@ def rawMassLynx_MS_bin(filename=None, startScan=0, endScan=-1, function=1,
             msCentre = msList[:-1] + (binsize / 2)
         else:
             msCentre = get_linearization_range(mzStart, mzEnd, binsize, kwargs['linearization_mode'])
+        mode = kwargs['linearization_mode']
+    else:
+        # without binning, scans are assumed to share the m/z axis of the first scan and
+        # are only interpolated onto it if they don't
+        msCentre = None
+        mode = "Linear interpolation"
 
     msRange = np.arange(startScan, endScan) + 1
-    # First extract data
-    for scan in msRange:
-        nPoints = mlLib.getScanSize(dataPointer, function, scan)
-        # Read XY coordinates
-        mlLib.getXYCoordinates(filePointer, function, scan, byref(xpoint), byref(ypoint))
-        # Prepare pointers
-        mzP = (c_float * nPoints)()
-        mzI = (c_float * nPoints)()
-        # Read spectrum
-        mlLib.readSpectrum(dataPointer, function, scan, byref(mzP), byref(mzI))
-        # Extract data from pointer and assign it to list
-        msX = np.ndarray((nPoints,), 'f', mzP, order='C')
-        msY = np.ndarray((nPoints,), 'f', mzI, order='C')
-        if binData:
-            if kwargs['linearization_mode'] == "Binning":
-                msYbin = bin_1D(x=msX, y=msY, bins=msList)
-            else:
-                msCentre, msYbin = linearize(data=np.transpose([msX, msY]),
-                                            binsize=binsize, mode=kwargs['linearization_mode'],
-                                            input_list=msCentre)
-            msDict[scan] = [msCentre, msYbin]
+    rtY = np.zeros(len(msRange), dtype=np.float64)
+    msY, msArray, operator, last_msX = None, None, None, None
+    for counter, (scan, msX, msYscan) in enumerate(_read_scans(filePointer, dataPointer,
+                                                                function, msRange)):
+        if msCentre is None:
+            msCentre = msX.astype(np.float64)
+        # allocate output once the size of the m/z axis is known
+        if msY is None:
+            msY = np.zeros(len(msCentre), dtype=np.float64)
+            if not sum_only:
+                msArray = np.zeros((len(msRange), len(msCentre)), dtype=np.float32)
+
+        if not binData and len(msX) == len(msCentre) and np.array_equal(msX, msCentre):
+            yvals = msYscan
         else:
-            msDict[scan] = [msX, msY]
+            # the operator only needs to be looked up when the m/z values change between scans
+            if last_msX is None or len(msX) != len(last_msX) or not np.array_equal(msX, last_msX):
+                operator = get_resampling_operator(msX, msCentre, mode, msList)
+                last_msX = msX.copy()
+            yvals = operator.dot(msYscan)
+
+        msY += yvals
+        rtY[counter] = np.sum(yvals)
+        if msArray is not None:
+            msArray[counter] = yvals
+
+    tend = time.clock()
+    print("It took {:.4f} seconds to process {} scans".format((tend - tstart), len(msRange)))
+
+    if msY is None:
+        return None
+    if not sum_only:
+        msY = msArray
+
+    # Return data
+    return msCentre, msY, rtY
+
+
+def rawMassLynx_MS_bin(filename=None, startScan=0, endScan=-1, function=1,
+                       mzStart=None, mzEnd=None, binsize=None, binData=False,
+                       **kwargs):
+    """
+    Extract MS data, bin it
+    ---
+    @param binData: boolean, determines if data should be binned or not
+    """
+    if 'linearization_mode' in kwargs:
+        if kwargs['linearization_mode'] == 'Raw':
+            binData = False
+
+    if binsize == 0.: binData = False
+
+    msDict = {}
+    msRange = np.arange(startScan, endScan) + 1
+    if binData:
+        # scans are binned into one array, dictionary values are views of its rows
+        data = rawMassLynx_MS_bin_array(filename=filename, startScan=startScan, endScan=endScan,
+                                        function=function, mzStart=mzStart, mzEnd=mzEnd,
+                                        binsize=binsize, binData=True, sum_only=False, **kwargs)
+        if data is None:
+            return
+        msCentre, msArray, __ = data
+        if endScan == -1 or endScan > startScan + len(msArray):
+            msRange = np.arange(startScan, startScan + len(msArray)) + 1
+        for counter, scan in enumerate(msRange):
+            msDict[scan] = [msCentre, msArray[counter]]
+        return msDict
+
+    tstart = time.clock()
+    # Create pointer to the file
+    try:
+        filePointer = mlLib.newCMassLynxRawReader(filename)
+    except WindowsError as err:
+        dlgBox(exceptionTitle="Error", exceptionMsg=str(err), type="Error")
+        return
+
+    # Setup scan reader
+    dataPointer = mlLib.newCMassLynxRawScanReader(filePointer)
+    # Extract number of scans available from the file
+    nScans = mlLib.getScansInFunction(dataPointer, function)
+    if endScan == -1 or endScan > nScans:
+        endScan = nScans
+
+    msRange = np.arange(startScan, endScan) + 1
+    # First extract data
+    for scan, msX, msY in _read_scans(filePointer, dataPointer, function, msRange):
+        msDict[scan] = [msX.copy(), msY.copy()]
     tend = time.clock()
     print("It took {:.4f} seconds to process {} scans".format((tend - tstart), len(msRange)))
 
     # Return data
     return msDict
+
+
+def rawMassLynx_MS_scan_count(filename=None, function=1, **kwargs):
+    """
+    Get number of scans in the function
+    """
+    filePointer = mlLib.newCMassLynxRawReader(filename)
+    dataPointer = mlLib.newCMassLynxRawScanReader(filePointer)
+    return mlLib.getScansInFunction(dataPointer, function)
+
+
+def rawMassLynx_MS_scans(filename=None, startScan=0, endScan=-1, function=1, **kwargs):
+    """
+    Iterate over individual scans without keeping them in memory
+    ---
+    yields scan number, msX, msY (the arrays are overwritten by the next scan)
+    """
+    filePointer = mlLib.newCMassLynxRawReader(filename)
+    dataPointer = mlLib.newCMassLynxRawScanReader(filePointer)
+    nScans = mlLib.getScansInFunction(dataPointer, function)
+    if endScan == -1 or endScan > nScans:
+        endScan = nScans
+
+    msRange = np.arange(startScan, endScan) + 1
+    for scan, msX, msY in _read_scans(filePointer, dataPointer, function, msRange):
+        yield scan, msX, msY
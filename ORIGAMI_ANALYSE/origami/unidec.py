@@ -6,6 +6,8 @@ from scipy import signal
 
 from unidec_modules import unidecstructure, peakstructure, MassFitter
 import unidec_modules.unidectools as ud
+import unidec_modules.unidec_core as ud_core
+import unidec_modules.unidec_cache as ud_cache
 from unidec_modules.unidec_enginebase import UniDecEngine
 
 __author__ = 'Michael.Marty'
@@ -26,6 +28,7 @@ class UniDec(UniDecEngine):
         self.massfit = None
         self.massfitdat = None
         self.errorgrid = None
+        self.cache_hit = False
         pass
     
     def open_file(self, file_name=None, file_directory=None, data_in=None, 
@@ -217,7 +220,9 @@ class UniDec(UniDecEngine):
         :return: None
         """
         tstart = time.clock()
-        self.export_config()
+        # input/config files are only needed by the UniDec binary
+        if not self.use_in_memory_core():
+            self.export_config()
 
         try:
             float(self.config.minmz)
@@ -247,7 +252,8 @@ class UniDec(UniDecEngine):
 
         if self.config.imflag == 0:
             self.data.data2 = ud.dataprep(self.data.rawdata, self.config)
-            ud.dataexport(self.data.data2, self.config.infname)
+            if not self.use_in_memory_core():
+                ud.dataexport(self.data.data2, self.config.infname)
 #         else:
 #             tstart2 = time.clock()
 #             mz, dt, i3 = IM_func.process_data_2d(self.data.rawdata3[:, 0], self.data.rawdata3[:, 1],
@@ -268,14 +274,29 @@ class UniDec(UniDecEngine):
         # self.get_spectrum_peaks()
         pass
 
+    def use_in_memory_core(self):
+        """
+        Checks whether the in-process (NumPy) core should be used. The UniDec binary is used by
+        default, the core is used if self.config.inmemoryflag is set or the binary cannot be found.
+        :return: bool
+        """
+        if getattr(self.config, "inmemoryflag", 0):
+            return True
+        path = getattr(self.config, "UniDecPath", None)
+        return path is None or not os.path.isfile(path)
+
     def run_unidec(self, silent=False, efficiency=False):
         """
         Runs UniDec.
 
-        Checks that everything is set to go and then places external call to:
+        Checks that everything is set to go and then runs the in-process (NumPy) core if
+        self.use_in_memory_core() and the core supports the current settings. Otherwise,
+        places external call to:
             self.config.UniDecPath for MS
             self.config.UniDecIMPath for IM-MS
 
+        If self.config.cacheflag is set, results are loaded from/saved to self.config.cachedir.
+
         If successful, calls self.unidec_imports()
         If not, prints the error code.
         :param silent: If True, it will suppress printing the output from UniDec
@@ -289,6 +310,41 @@ class UniDec(UniDecEngine):
         if self.check_badness() == 1:
             print "Badness found, aborting UniDec run"
             return 1
+        use_core, reason = self.use_in_memory_core(), None
+        if use_core:
+            use_core, reason = ud_core.check_core_support(self.config)
+        # Load results from cache
+        self.cache_hit = False
+        cache, cache_key = None, None
+        if getattr(self.config, "cacheflag", 0) and self.config.imflag == 0 and self.config.cachedir:
+            cache = ud_cache.UniDecCache(self.config.cachedir, self.config.cachesize)
+            cache_key = ud_cache.get_cache_key(self.data.data2, self.config,
+                                               engine="core" if use_core else "binary")
+            results = cache.get(cache_key)
+            if results is not None:
+                self.cache_hit = True
+                self.config.runtime = 0
+                self.unidec_imports_core(results, efficiency)
+                if not silent:
+                    print "Loaded UniDec results from cache. R Squared: ", self.config.error
+                return 0
+        # Run in-process core
+        if use_core:
+            tstart = time.clock()
+            results = ud_core.run_unidec_core(self.data.data2, self.config, silent=silent)
+            self.config.runtime = (time.clock() - tstart)
+            if cache is not None:
+                cache.put(cache_key, results)
+            self.unidec_imports_core(results, efficiency)
+            if not silent:
+                print "File Name: ", self.config.filename, "R Sqaured: ", self.config.error
+            return 0
+        elif reason is not None:
+            print "In-memory UniDec does not support %s. Using UniDec binary instead" % reason
+        if self.use_in_memory_core():
+            # input file is not exported by process_data when the core is used
+            ud.dataexport(self.data.data2, self.config.infname)
+            
         # Export Config and Call
         self.export_config()
         tstart = time.clock()
@@ -302,6 +358,8 @@ class UniDec(UniDecEngine):
         # Import Results if Successful
         if out == 0:
             self.unidec_imports(efficiency)
+            if cache is not None and not efficiency:
+                cache.put(cache_key, self.get_cache_results())
             if not silent:
                 print "File Name: ", self.config.filename, "R Sqaured: ", self.config.error
             return out
@@ -309,6 +367,40 @@ class UniDec(UniDecEngine):
             print "UniDec Run Error:", out
             return out
 
+    def unidec_imports_core(self, results, efficiency=False):
+        """
+        Imports results of the in-process UniDec core into self.data.
+        :param results: Dictionary returned by ud_core.run_unidec_core
+        :param efficiency: If True, it will ignore the larger arrays.
+        :return: None
+        """
+        self.pks = peakstructure.Peaks()
+        self.data.massdat = results['massdat']
+        self.data.ztab = np.arange(self.config.startz, self.config.endz + 1)
+        self.config.massdatnormtop = np.amax(self.data.massdat[:, 1])
+        # Calculate Error
+        mean = np.mean(self.data.data2[:, 1])
+        self.config.error = 1 - results['error'] / np.sum((self.data.data2[:, 1] - mean) ** 2)
+        if not efficiency:
+            self.data.massgrid = results['massgrid']
+            self.data.fitdat = results['fitdat']
+            self.data.baseline = results['baseline']
+            # Import Grid
+            xv, yv = np.meshgrid(self.data.ztab, self.data.data2[:, 0])
+            xv = np.c_[np.ravel(yv), np.ravel(xv)]
+            self.data.mzgrid = np.c_[xv, results['mzgrid']]
+
+    def get_cache_results(self):
+        """
+        Collects results imported from the UniDec binary in the format of ud_core.run_unidec_core
+        :return: Dictionary of results
+        """
+        mean = np.mean(self.data.data2[:, 1])
+        sse = (1 - self.config.error) * np.sum((self.data.data2[:, 1] - mean) ** 2)
+        return {'massdat': self.data.massdat, 'massgrid': self.data.massgrid,
+                'fitdat': self.data.fitdat, 'mzgrid': self.data.mzgrid[:, 2],
+                'baseline': self.data.baseline, 'error': sse}
+
     def unidec_imports(self, efficiency=False):
         """
         Imports files output from the UniDec core executable into self.data.
@@ -815,11 +907,13 @@ class UniDec(UniDecEngine):
                 traindata = ud.dataprep(np.delete(self.data.rawdata, np.s_[i::numcross], 0), self.config)
                 # Select one of k-fold
                 # testdata = ud.dataprep(self.data.rawdata[i::numcross], self.config)
-                ud.dataexport(traindata, self.config.infname)
-
-                ud.unidec_call(self.config, silent=True)
-
-                massdat = np.loadtxt(self.config.outfname + "_mass.txt")
+                if self.use_in_memory_core() and ud_core.check_core_support(self.config)[0]:
+                    massdat = ud_core.run_unidec_core(traindata, self.config, silent=True)['massdat']
+                else:
+                    self.export_config()
+                    ud.dataexport(traindata, self.config.infname)
+                    ud.unidec_call(self.config, silent=True)
+                    massdat = np.loadtxt(self.config.outfname + "_mass.txt")
                 try:
                     peaks = ud.peakdetect(massdat, self.config)
                     peaks = ud.mergepeaks(toppeaks, peaks, self.config.peakwindow)
@@ -836,7 +930,8 @@ class UniDec(UniDecEngine):
             print j, "Total CV Time:", (tend - tstart), "STD:", np.mean(stddev)
 
         self.data.data2 = deepcopy(data2archive)
-        ud.dataexport(self.data.data2, self.config.infname)
+        if not self.use_in_memory_core():
+            ud.dataexport(self.data.data2, self.config.infname)
         try:
             peaksvert = []
             for peak in toppeaks:
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------------
+#    Copyright (C) 2017-2018 Lukasz G. Migas
+#    <lukasz.migas@manchester.ac.uk> OR <lukas.migas@yahoo.com>
+#
+# 	 GitHub : https://github.com/lukasz-migas/ORIGAMI
+# 	 University of Manchester IP : https://www.click2go.umip.com/i/s_w/ORIGAMI.html
+# 	 Cite : 10.1016/j.ijms.2017.08.014
+#
+#    This program is free software. Feel free to redistribute it and/or
+#    modify it under the condition you cite and credit the authors whenever
+#    appropriate.
+#    The program is distributed in the hope that it will be useful but is
+#    provided WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE
+# -------------------------------------------------------------------------
+# __author__ lukasz.g.migas
+
+"""
+On-disk cache of UniDec results.
+
+Results of the deconvolution are stored as compressed .npz files named after the
+hash of the pre-processed spectrum and of the config fields that affect the output,
+so rerunning UniDec on the same spectrum with the same settings (e.g. after reloading
+a document) loads the results instead of deconvolving the data again. The least
+recently used files are removed when the cache exceeds its size limit.
+"""
+
+import os
+import hashlib
+import tempfile
+import numpy as np
+
+CACHE_VERSION = 1
+CACHE_EXTENSION = ".npz"
+
+# config fields that affect the results of the deconvolution
+CACHE_FIELDS = ["imflag", "numit", "startz", "endz", "psfun", "zzsig", "mzsig",
+                "masslb", "massub", "massbins", "msig", "molig", "mtabsig", "mfileflag",
+                "masslist", "manualfileflag", "manuallist", "aggressiveflag", "rawflag",
+                "adductmass", "nativezub", "nativezlb", "poolflag", "inflate", "isotopemode",
+                "orbimode", "baselineflag", "zerolog"]
+
+# arrays stored in the cache (same keys as the output of `unidec_core.run_unidec_core`)
+CACHE_ARRAYS = ["massdat", "massgrid", "fitdat", "mzgrid", "baseline", "error"]
+
+
+def _update_hash(key, value):
+    if isinstance(value, (np.ndarray, list, tuple)):
+        value = np.ascontiguousarray(value)
+        key.update(str((value.shape, value.dtype.str)).encode("utf-8"))
+        if value.dtype.kind == "O":
+            key.update(repr(value.tolist()).encode("utf-8"))
+        elif value.size:
+            key.update(value.view(np.uint8).ravel())
+    else:
+        key.update(repr(value).encode("utf-8"))
+
+
+def get_cache_key(data2, config, engine=None):
+    """
+    Hash pre-processed spectrum and config fields that affect the deconvolution
+    :param data2: pre-processed spectrum (m/z, intensity)
+    :param config: UniDecConfig object
+    :param engine: name of the engine that computes the results (e.g. 'core' or 'binary')
+    :return: key (str)
+    """
+    key = hashlib.sha1()
+    _update_hash(key, CACHE_VERSION)
+    _update_hash(key, engine)
+    _update_hash(key, data2)
+    for field in CACHE_FIELDS:
+        key.update(field.encode("utf-8"))
+        _update_hash(key, getattr(config, field, None))
+    return key.hexdigest()
+
+
+class UniDecCache(object):
+    """
+    Size-bounded directory of UniDec results
+    """
+
+    def __init__(self, cache_dir, max_size=512):
+        """
+        :param cache_dir: directory where results are stored
+        :param max_size: maximum size of all cached results (MB)
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def get_path(self, key):
+        return os.path.join(self.cache_dir, key + CACHE_EXTENSION)
+
+    def get(self, key):
+        """ Load cached results, returns None if the key is not in the cache """
+        path = self.get_path(key)
+        if not os.path.isfile(path):
+            return None
+        try:
+            with np.load(path) as data:
+                results = dict([(name, data[name]) for name in CACHE_ARRAYS])
+        except (IOError, OSError, ValueError, KeyError) as err:
+            print("Failed to load cached UniDec results: {}".format(err))
+            self._remove(path)
+            return None
+        results['error'] = float(results['error'])
+
+        # mark as recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return results
+
+    def put(self, key, results):
+        """ Store results (dictionary with `CACHE_ARRAYS` keys) """
+        if self.max_size <= 0:
+            return
+        path = self.get_path(key)
+        if os.path.isfile(path):
+            return
+
+        # write to temporary file first so incomplete files are never loaded
+        temp_path = None
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            f_handle, temp_path = tempfile.mkstemp(suffix=".tmp", dir=self.cache_dir)
+            with os.fdopen(f_handle, "wb") as f_ptr:
+                np.savez_compressed(f_ptr, **dict([(name, np.asarray(results[name]))
+                                                   for name in CACHE_ARRAYS]))
+            os.rename(temp_path, path)
+        except (IOError, OSError) as err:
+            print("Failed to cache UniDec results: {}".format(err))
+            if temp_path is not None:
+                self._remove(temp_path)
+            return
+        self.evict()
+
+    def evict(self):
+        """ Remove least recently used results until the cache is within its size limit """
+        files = []
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return
+        for name in names:
+            if not name.endswith(CACHE_EXTENSION):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+        total_size = sum([size for __, size, __ in files])
+        for __, size, path in sorted(files):
+            if total_size <= self.max_size * 1024 ** 2:
+                break
+            self._remove(path)
+            total_size -= size
+
+    def clear(self):
+        if not os.path.isdir(self.cache_dir):
+            return
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(CACHE_EXTENSION):
+                self._remove(os.path.join(self.cache_dir, name))
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------------
+#    Copyright (C) 2017-2018 Lukasz G. Migas
+#    <lukasz.migas@manchester.ac.uk> OR <lukas.migas@yahoo.com>
+#
+# 	 GitHub : https://github.com/lukasz-migas/ORIGAMI
+# 	 University of Manchester IP : https://www.click2go.umip.com/i/s_w/ORIGAMI.html
+# 	 Cite : 10.1016/j.ijms.2017.08.014
+#
+#    This program is free software. Feel free to redistribute it and/or
+#    modify it under the condition you cite and credit the authors whenever
+#    appropriate.
+#    The program is distributed in the hope that it will be useful but is
+#    provided WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE
+# -------------------------------------------------------------------------
+# __author__ lukasz.g.migas
+
+"""
+In-process (NumPy) implementation of the UniDec core deconvolution (MS data only).
+
+The m/z vs charge grid is iterated in memory in the same way as the UniDec binary:
+each iteration smooths the grid along the charge (and optionally oligomer mass)
+dimension, convolves the summed grid with the peak shape and multiplies it by the
+(correlated) ratio of the data to the fit. Results are returned as arrays with the
+same layout as the files written by the binary (`_mass.txt`, `_massgrid.bin`,
+`_fitdat.bin`, `_grid.bin` and `_error.txt`).
+"""
+
+import time
+import numpy as np
+from scipy import sparse
+
+from fitting import ndis, ldis, ndis_std
+from unidectools import predict_charge, isempty
+
+# width of the peak shape (in multiples of the FWHM) used by the convolution
+PEAK_SHAPE_THRESHOLD = 6
+# convergence criterion of the iterations
+CONVERGENCE_THRESHOLD = 1e-6
+
+
+def check_core_support(config, **kwargs):
+    """
+    Check whether the in-process core supports the current configuration
+    :return: True/False, reason why the binary has to be used instead
+    """
+    if config.imflag != 0:
+        return False, "IM-MS deconvolution"
+    if "kill" in kwargs:
+        return False, "peak removal"
+    if config.psfun not in [0, 1, 2]:
+        return False, "peak shape function %s" % config.psfun
+    if config.aggressiveflag != 0:
+        return False, "baseline fitting"
+    if config.isotopemode != 0:
+        return False, "isotope mode"
+    if config.orbimode != 0:
+        return False, "Orbitrap mode"
+    if config.mfileflag and not isempty(config.masslist):
+        return False, "mass list"
+    if config.manualfileflag and not isempty(config.manuallist):
+        return False, "manual assignments"
+    return True, ""
+
+
+def get_peak_shape(xvals, mid, fwhm, psfun):
+    """
+    Peak shape centred at `mid` (both arguments can be arrays of the same shape)
+    """
+    if psfun == 1:
+        return ldis(xvals, mid, fwhm)
+    elif psfun == 2:
+        return np.where(xvals > mid, ldis(xvals, mid, fwhm),
+                        ndis_std(xvals, mid, fwhm / (2 * np.sqrt(2 * np.log(2)))))
+    return ndis(xvals, mid, fwhm)
+
+
+def get_peak_shape_operator(mzaxis, fwhm, psfun, inflate=1):
+    """
+    Sparse convolution operator of the peak shape on (not necessarily linear) m/z axis.
+    Element [i, k] is the intensity at mzaxis[i] of (unit area) peak centred at mzaxis[k]
+    """
+    n_points = len(mzaxis)
+    fwhm = abs(fwhm)
+    if fwhm == 0:
+        return sparse.identity(n_points, format="csr")
+
+    width = PEAK_SHAPE_THRESHOLD * fwhm * max(inflate, 1)
+    starts = np.searchsorted(mzaxis, mzaxis - width, side="left")
+    ends = np.searchsorted(mzaxis, mzaxis + width, side="right")
+    counts = ends - starts
+    rows = np.repeat(np.arange(n_points), counts)
+    cols = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts - starts, counts)
+    values = get_peak_shape(mzaxis[rows], mzaxis[cols], fwhm, psfun)
+    # each peak is normalized to unit area so that the multiplicative update preserves intensity
+    values /= np.bincount(cols, weights=values, minlength=n_points)[cols]
+    return sparse.csr_matrix((values, (rows, cols)), shape=(n_points, n_points))
+
+
+def get_nearest_index(mzaxis, mzvals):
+    """
+    Index of the nearest point of the m/z axis or -1 if the value is outside of the m/z range
+    """
+    idx = np.clip(np.searchsorted(mzaxis, mzvals), 1, len(mzaxis) - 1)
+    idx -= (mzvals - mzaxis[idx - 1]) < (mzaxis[idx] - mzvals)
+    idx[(mzvals < mzaxis[0]) | (mzvals > mzaxis[-1])] = -1
+    return idx
+
+
+def get_mass_table(mzaxis, ztab, config):
+    """
+    Mass of each point of the m/z vs charge grid and mask of the allowed points
+    """
+    mtab = (mzaxis[:, np.newaxis] - config.adductmass) * ztab[np.newaxis, :]
+    barr = (mtab >= config.masslb) & (mtab <= config.massub)
+    zoffset = ztab[np.newaxis, :] - predict_charge(np.abs(mtab))
+    barr &= (zoffset >= config.nativezlb) & (zoffset <= config.nativezub)
+    return mtab, barr
+
+
+def get_neighbour_indices(mzaxis, mtab, ztab, adductmass, zoffset, mass_shift=0.):
+    """
+    Flat index of the grid point that has the same mass (+ mass_shift) at charge + zoffset.
+    Points without neighbour point at the padding element (index n_mz * n_z)
+    """
+    n_points, n_charges = mtab.shape
+    zidx = np.arange(n_charges) + zoffset
+    valid_z = (zidx >= 0) & (zidx < n_charges)
+    zidx = np.clip(zidx, 0, n_charges - 1)
+    charges = ztab[zidx].astype(np.float64)
+    valid_z &= charges != 0
+    charges[charges == 0] = 1
+
+    mzvals = (mtab + mass_shift) / charges[np.newaxis, :] + adductmass
+    idx = get_nearest_index(mzaxis, mzvals)
+    indices = idx * n_charges + zidx[np.newaxis, :]
+    indices[(idx < 0) | ~valid_z[np.newaxis, :]] = n_points * n_charges
+    return indices
+
+
+def get_smoothing_neighbours(mzaxis, mtab, ztab, config):
+    """
+    Indices of the charge (and oligomer mass) neighbours used to smooth the grid
+    :return: list of [mass weight, list of charge neighbour indices]
+    """
+    zlength = 1 + 2 * int(abs(config.zzsig))
+    zoffsets = np.arange(zlength) - (zlength - 1) // 2
+
+    moffsets, mweights = np.array([0]), np.array([1.])
+    if config.msig > 0 and config.molig != 0:
+        mlength = 1 + 2 * int(config.msig)
+        moffsets = np.arange(mlength) - (mlength - 1) // 2
+        mweights = ndis(moffsets, 0, config.msig)
+        mweights = mweights / np.sum(mweights)
+
+    neighbours = []
+    for moffset, mweight in zip(moffsets, mweights):
+        indices = [get_neighbour_indices(mzaxis, mtab, ztab, config.adductmass, zoffset,
+                                         moffset * config.molig) for zoffset in zoffsets]
+        neighbours.append([mweight, indices])
+    return neighbours
+
+
+def smooth_grid(blur, barr, neighbours, zzsig, zerolog):
+    """
+    Smooth the grid along charge dimension (geometric mean for zzsig > 0, arithmetic
+    mean for zzsig < 0) and take weighted average over oligomer mass neighbours
+    """
+    flat = np.append(blur.ravel(), 0.)
+    if zzsig > 0:
+        # zero (or missing) neighbours contribute with `zerolog`
+        zeros = flat <= 0
+        flat = np.log(np.maximum(flat, 1e-300))
+        flat[zeros] = zerolog
+
+    newblur = np.zeros_like(blur)
+    for mweight, indices in neighbours:
+        values = np.zeros_like(blur)
+        for idx in indices:
+            values += flat[idx]
+        values /= len(indices)
+        if zzsig > 0:
+            np.exp(values, out=values)
+        newblur += mweight * values
+    newblur[~barr] = 0
+    return newblur
+
+
+def get_mass_axis(mtab, barr, massbins, masslb, massub):
+    """
+    Mass axis covering all allowed points of the grid
+    """
+    if np.any(barr):
+        massmin = max(np.floor(np.min(mtab[barr])), masslb)
+        massmax = min(np.ceil(np.max(mtab[barr])), massub)
+    else:
+        massmin, massmax = masslb, massub
+    n_bins = 1 + int((massmax - massmin) / massbins)
+    return massmin + np.arange(n_bins) * massbins
+
+
+def transform_to_mass(mzaxis, grid, mtab, ztab, massaxis, adductmass, poolflag=1):
+    """
+    Transform m/z vs charge grid into mass vs charge grid by interpolation (poolflag=1)
+    or integration (poolflag=0)
+    """
+    n_points, n_charges = grid.shape
+    n_bins = len(massaxis)
+    if poolflag == 0:
+        massbins = massaxis[1] - massaxis[0] if n_bins > 1 else 1.
+        bins = np.round((mtab - massaxis[0]) / massbins).astype(np.int64)
+        valid = (bins >= 0) & (bins < n_bins)
+        flat_bins = bins * n_charges + np.arange(n_charges)[np.newaxis, :]
+        massgrid = np.bincount(flat_bins[valid], weights=grid[valid], minlength=n_bins * n_charges)
+        return massgrid.reshape((n_bins, n_charges))
+
+    mzvals = massaxis[:, np.newaxis] / ztab[np.newaxis, :] + adductmass
+    idx = np.clip(np.searchsorted(mzaxis, mzvals), 1, n_points - 1)
+    fraction = (mzvals - mzaxis[idx - 1]) / (mzaxis[idx] - mzaxis[idx - 1])
+    zidx = np.arange(n_charges)[np.newaxis, :]
+    massgrid = grid[idx - 1, zidx] * (1 - fraction) + grid[idx, zidx] * fraction
+    massgrid[(mzvals < mzaxis[0]) | (mzvals > mzaxis[-1])] = 0
+    return massgrid
+
+
+def run_unidec_core(data2, config, silent=False):
+    """
+    Deconvolve pre-processed mass spectrum
+
+    Parameters
+    ----------
+    data2 : array (n_points x 2)
+        pre-processed mass spectrum (`UniDec.data.data2`)
+    config : UniDecConfig
+        UniDec parameters
+
+    Returns
+    -------
+    results : dict
+        massdat (n_masses x 2), massgrid (flat n_masses * n_charges), fitdat (n_points),
+        mzgrid (flat n_points * n_charges), baseline, error (sum of squared errors)
+    """
+    tstart = time.time()
+    mzaxis = np.asarray(data2[:, 0], dtype=np.float64)
+    intensity = np.clip(np.asarray(data2[:, 1], dtype=np.float64), 0, None)
+    if len(mzaxis) < 2:
+        raise ValueError("Not enough data points to perform deconvolution")
+
+    ztab = np.arange(int(config.startz), int(config.endz) + 1)
+    mtab, barr = get_mass_table(mzaxis, ztab, config)
+    operator = get_peak_shape_operator(mzaxis, config.mzsig, config.psfun, config.inflate)
+    operator_t = operator.T.tocsr()
+    neighbours = None
+    if config.zzsig != 0 or (config.msig > 0 and config.molig != 0):
+        neighbours = get_smoothing_neighbours(mzaxis, mtab, ztab, config)
+
+    blur = np.where(barr, intensity[:, np.newaxis], 0.)
+    n_iterations = abs(int(config.numit))
+    for iteration in range(n_iterations):
+        oldblur = blur
+        if neighbours is not None:
+            blur = smooth_grid(blur, barr, neighbours, config.zzsig, config.zerolog)
+        # ratio of the data to the current fit, correlated with the peak shape
+        fit = operator.dot(blur.sum(axis=1))
+        ratio = np.divide(intensity, fit, out=np.zeros_like(intensity), where=fit != 0)
+        blur = blur * operator_t.dot(ratio)[:, np.newaxis]
+
+        total = np.sum(blur)
+        if total != 0 and np.sum((blur - oldblur) ** 2) / total < CONVERGENCE_THRESHOLD:
+            break
+
+    fitdat = operator.dot(blur.sum(axis=1))
+    error = np.sum((fitdat - intensity) ** 2)
+
+    # re-apply peak shape to the grid
+    if config.rawflag == 0:
+        mzgrid = operator.dot(blur)
+    else:
+        mzgrid = blur
+    mzgrid = np.clip(mzgrid, 0, None)
+
+    massaxis = get_mass_axis(mtab, barr, config.massbins, config.masslb, config.massub)
+    massgrid = transform_to_mass(mzaxis, mzgrid, mtab, ztab, massaxis, config.adductmass,
+                                 config.poolflag)
+    massdat = np.transpose([massaxis, np.sum(massgrid, axis=1)])
+
+    if not silent:
+        print("UniDec (in-memory) finished after {} iterations in {:.4f} seconds".format(
+            iteration + 1 if n_iterations else 0, time.time() - tstart))
+
+    return {"massdat": massdat, "massgrid": np.ravel(massgrid), "fitdat": fitdat,
+            "mzgrid": np.ravel(mzgrid), "baseline": np.array([]), "error": error}
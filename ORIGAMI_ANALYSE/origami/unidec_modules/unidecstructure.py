@@ -134,6 +134,10 @@ class UniDecConfig(object):
         self.orbimode = 0
 
         # Other
+        self.inmemoryflag = 0
+        self.cacheflag = 0
+        self.cachedir = ""
+        self.cachesize = 512
         self.mtabsig = 0
         self.poolflag = 1
         self.nativezub = 100
@@ -14,11 +14,13 @@ from scipy.interpolate import interp1d
 from scipy.interpolate import griddata
 from scipy import signal
 from scipy import fftpack
+from scipy import sparse
 import matplotlib.cm as cm
 # import mzMLimporter
 from fitting import *
 import unidecstructure
 import tempfile
+from processing.utils import find_peaks_maximum_filter
 
 try:
     import data_reader
@@ -224,6 +226,23 @@ def nearest(array, target):
     return i
 
 
+def nearest_vector(array, targets):
+    """
+    Vectorised equivalent of nearest for many targets.
+    :param array: Sorted array
+    :param targets: Array of values
+    :return: Array of positions of the elements closest to each target
+    """
+    array = np.asarray(array)
+    targets = np.asarray(targets)
+    i = np.searchsorted(array, targets, side="left")
+    inner = np.logical_and(i > 0, i < len(array) - 1)
+    i = np.clip(i, 0, len(array) - 1)
+    lower = np.abs(array[i] - targets) > np.abs(array[np.maximum(i - 1, 0)] - targets)
+    i[np.logical_and(inner, lower)] -= 1
+    return i
+
+
 def get_z_offset(mass, charge):
     """
     For a given mass and charge combination, calculate the charge offset parameter.
@@ -446,7 +465,52 @@ def data_extract(data, x, extract_method, window=None, **kwargs):
     return val
 
 
+def data_extract_vector(data, xvals, extract_method, window=None, zero_edge=True):
+    """
+    Vectorised equivalent of data_extract for many values. Assumes a sorted array in data[:,0]
+    :param data:
+    :param xvals: Array of values
+    :param extract_method:
+    :param window:
+    :return: Array of extracted values or None if the extraction method is not supported
+    """
+    xvals = np.asarray(xvals, dtype=np.float64)
+    if extract_method == 0 or (extract_method == 1 and window == 0):
+        index = nearest_vector(data[:, 0], xvals)
+        vals = data[index, 1].astype(np.float64)
+        if zero_edge:
+            vals[np.logical_or(index == 0, index == len(data) - 1)] = 0
+        return vals
+
+    elif extract_method == 1 and window is not None:
+        # local maximum between nearest points to x - window and x + window
+        start = nearest_vector(data[:, 0], xvals - window)
+        end = nearest_vector(data[:, 0], xvals + window)
+        vals = np.maximum.reduceat(data[:, 1], np.ravel(np.column_stack([start, end])))[::2]
+        vals = vals.astype(np.float64)
+        vals[start >= end] = 0
+        return vals
+
+    elif extract_method == 2 and window is not None:
+        # trapezoid integral of points within (x - window, x + window)
+        cumint = np.zeros(len(data))
+        cumint[1:] = np.cumsum(np.diff(data[:, 0]) * (data[1:, 1] + data[:-1, 1]) / 2.)
+        start = np.searchsorted(data[:, 0], xvals - window, side="right")
+        end = np.searchsorted(data[:, 0], xvals + window, side="left") - 1
+        vals = np.zeros(len(xvals))
+        valid = end > start
+        vals[valid] = cumint[end[valid]] - cumint[start[valid]]
+        return vals
+
+    return None
+
+
 def data_extract_grid(data, xarray, extract_method=1, window=0):
+    xarray = np.asarray(xarray)
+    igrid = data_extract_vector(data, np.ravel(xarray), extract_method, window=window)
+    if igrid is not None:
+        return igrid.reshape(xarray.shape)
+
     igrid = np.zeros_like(xarray)
     dims = igrid.shape
     for j in xrange(0, dims[0]):
@@ -478,25 +542,12 @@ def kendrick_analysis(massdat, kendrickmass, centermode=1, nbins=50, transformmo
     if transformmode == 1:
         # Interpolation
         f = interp1d(massdat[:, 0], massdat[:, 1], bounds_error=False, fill_value=0)
-        for j in xrange(0, len(nominal)):
-            for k in xrange(0, len(defects)):
-                nommass = nominal[j]
-                defect = defects[k]
-                mass = (nommass + defect) * kendrickmass
-                intensity = f(mass)
-                igrid[j, k] = intensity
+        igrid = f((m1grid + m2grid) * kendrickmass)
     else:
         # Integration
-        for j in xrange(0, len(kmass)):
-            nommass = nominalkmass[j]
-            defect = kmdefectexact[j]
-            pos = nearest(defects, defect)
-            pos2 = nearest(nominal, nommass)
-            try:
-                intensity = massdat[j, 1]
-            except IndexError:
-                intensity = 0
-            igrid[pos2, pos] += intensity
+        pos = nearest_vector(defects, kmdefectexact)
+        pos2 = nearest_vector(nominal, nominalkmass)
+        np.add.at(igrid, (pos2, pos), massdat[:, 1])
     igrid /= np.amax(igrid)
 
     # Write Outputs
@@ -786,17 +837,77 @@ def datacompsub(datatop, buff):
     :param buff: Width parameter
     :return: Subtracted data
     """
-    length = len(datatop)
-    mins = range(0, length)
-    indexes = range(0, length)
-    for i in indexes:
-        mins[i] = np.amin(datatop[int(max([0, i - abs(buff)])):int(min([i + abs(buff), length])), 1])
-    background = filt.gaussian_filter(mins, abs(buff) * 2)
-    datatop[:, 1] = datatop[:, 1] - background
+    datatop[:, 1] = datatop[:, 1] - compsub_background(datatop[:, 1], buff)
     return datatop
 
 
+def compsub_background(yvals, buff):
+    """
+    Background used by datacompsub. Minimum within a window of +/- buff smoothed with a Gaussian filter.
+    :param yvals: Intensities (N) or stack of intensities sharing the same x-axis (M x N)
+    :param buff: Width parameter
+    :return: Background array with the same shape as yvals
+    """
+    yvals = np.asarray(yvals, dtype=np.float64)
+    buff = abs(buff)
+    length = yvals.shape[-1]
+    if buff < 1:
+        # window [i - buff, i + buff) has at most one point
+        mins = np.zeros_like(yvals)
+        for i in xrange(0, length):
+            mins[..., i] = np.amin(yvals[..., int(max([0, i - buff])):int(min([i + buff, length]))], axis=-1)
+    else:
+        # window [i - ceil(buff), i + floor(buff) - 1]; edges are padded with the edge values
+        # which does not change the minimum
+        left = int(np.ceil(buff))
+        size = left + int(np.floor(buff))
+        mins = filt.minimum_filter1d(yvals, size, axis=-1, mode="nearest", origin=left - size // 2)
+    return filt.gaussian_filter1d(mins, buff * 2, axis=-1)
+
+
+def _compsub_background_loop(yvals, buff):
+    """ Original (point-by-point) implementation of compsub_background, used by the benchmark """
+    length = len(yvals)
+    mins = range(0, length)
+    for i in xrange(0, length):
+        mins[i] = np.amin(yvals[int(max([0, i - abs(buff)])):int(min([i + abs(buff), length]))])
+    return filt.gaussian_filter(mins, abs(buff) * 2)
+
+
 def calc_local_mins(data, w):
+    """
+    Local minimum (position, intensity) of data within windows of width w.
+    Assumes data is sorted by data[:,0].
+    :param data: Data array (N x 2)
+    :param w: Width of the windows
+    :return: Array of local minimums (W x 2)
+    """
+    start = np.amin(data[:, 0])
+    stop = np.amax(data[:, 0])
+    windows = np.arange(start, stop, step=w)
+    if len(windows) == 0:
+        return np.array([])
+
+    # points within each window (excluding the window edges)
+    starts = np.searchsorted(data[:, 0], windows, side="right")
+    ends = np.searchsorted(data[:, 0], windows + w, side="left")
+    if np.any(ends <= starts):
+        raise ValueError("zero-size array to reduction operation minimum which has no identity")
+    bounds = np.ravel(np.column_stack([starts, ends]))
+    length = len(data)
+
+    localmin = np.minimum.reduceat(np.append(data[:, 1], np.inf), bounds)[::2]
+    # first position of the minimum in each window
+    indexes = np.arange(0, length)
+    label = np.searchsorted(starts, indexes, side="right") - 1
+    inside = np.logical_and(label >= 0, indexes < ends[label])
+    ismin = np.logical_and(inside, data[:, 1] == localmin[label])
+    positions = np.minimum.reduceat(np.append(np.where(ismin, indexes, length), length), bounds)[::2]
+    return np.column_stack([data[positions, 0], localmin])
+
+
+def _calc_local_mins_loop(data, w):
+    """ Original (window-by-window) implementation of calc_local_mins, used by the benchmark """
     start = np.amin(data[:, 0])
     stop = np.amax(data[:, 0])
     windows = np.arange(start, stop, step=w)
@@ -906,6 +1017,44 @@ def savgol_background_subtract(datatop, width, cutoff_percent=0.25):
     return datatop
 
 
+def background_subtract_batch(xvals, ystack, subtype, buff):
+    """
+    Baseline subtraction of a stack of spectra that share the same x-axis (same as the baseline
+    subtraction step of dataprep). Simple, complex and minimum subtraction are applied to the
+    whole stack at once, other modes process one spectrum at a time.
+    :param xvals: x-axis (N)
+    :param ystack: Intensities (M x N)
+    :param subtype: Background subtraction code (config.subtype)
+    :param buff: Width parameter (config.subbuff)
+    :return: Subtracted intensities (M x N)
+    """
+    ystack = np.array(ystack, dtype=np.float64, ndmin=2)
+    buff = abs(buff)
+    if buff == 0:
+        return ystack
+    if subtype == 0:
+        ystack -= np.amin(ystack, axis=1)[:, np.newaxis]
+    elif subtype == 1:
+        length = ystack.shape[1]
+        buff = int(buff)
+        frontpart = np.mean(ystack[:, :buff], axis=1)[:, np.newaxis]
+        backpart = np.mean(ystack[:, length - buff - 1:length - 1], axis=1)[:, np.newaxis]
+        ystack -= frontpart + (backpart - frontpart) / length * np.arange(length)
+    elif subtype == 2:
+        ystack -= compsub_background(ystack, buff)
+    elif subtype in [4, 5]:
+        for i in xrange(0, len(ystack)):
+            datatop = np.column_stack((xvals, ystack[i]))
+            if subtype == 4:
+                datatop = polynomial_background_subtract(datatop, buff)
+            else:
+                datatop = savgol_background_subtract(datatop, buff)
+            ystack[i] = datatop[:, 1]
+    else:
+        print "Background subtraction code unsupported", subtype, buff
+    return ystack
+
+
 def gaussian_backgroud_subtract(datatop, sig):
     background = deepcopy(datatop)
     # background[:,1]=np.log(background[:,1])
@@ -1072,9 +1221,22 @@ def removeduplicates(datatop):
     :param datatop: Data array (N x 2)
     :return: Data with unique x values
     """
-    testunique = np.unique(datatop[:, 0])
+    testunique, inverse = np.unique(datatop[:, 0], return_inverse=True)
     if len(testunique) != len(datatop):
         print "Removing Duplicates"
+        # the last two unique values share one bin (as the last bin of np.histogram includes its right edge)
+        inverse = np.minimum(inverse, max(len(testunique) - 2, 0))
+        num = np.bincount(inverse)
+        xvals = np.bincount(inverse, weights=datatop[:, 0]) / num
+        means = np.bincount(inverse, weights=datatop[:, 1])
+        datatop = np.column_stack((xvals, means))
+    return datatop
+
+
+def _removeduplicates_loop(datatop):
+    """ Original (value-by-value) implementation of removeduplicates, used by the benchmark """
+    testunique = np.unique(datatop[:, 0])
+    if len(testunique) != len(datatop):
         num, start = np.histogram(datatop[:, 0], bins=testunique)
         means = []
         xvals = []
@@ -1087,6 +1249,54 @@ def removeduplicates(datatop):
     return datatop
 
 
+def benchmark_background_subtraction(sizes=(1e4, 1e5), buff=40, width=20, n_spectra=20, seed=0):
+    """
+    Compare vectorised background subtraction functions against the original Python loops
+    on synthetic spectra of increasing size
+    :return: list of (function, n_points, reference time, vectorised time, maximum difference)
+    """
+    rng = np.random.RandomState(seed)
+    results = []
+
+    def _compare(name, n_points, reference_func, func):
+        tstart = time.time()
+        reference = reference_func()
+        t_reference = time.time() - tstart
+        tstart = time.time()
+        result = func()
+        t_vectorised = time.time() - tstart
+        difference = np.max(np.abs(np.asarray(reference) - np.asarray(result)))
+        print "{}: {} points | loop {:.4f} s | vectorised {:.4f} s | speed-up {:.1f}x | max difference {}".format(
+            name, n_points, t_reference, t_vectorised, t_reference / max(t_vectorised, 1e-9), difference)
+        results.append((name, n_points, t_reference, t_vectorised, difference))
+
+    for n_points in sizes:
+        n_points = int(n_points)
+        xvals = np.linspace(500., 5000., n_points)
+        background = 1e-4 * (xvals - xvals[0])
+        ystack = rng.uniform(0, 0.1, (n_spectra, n_points)) + background
+        for centre in rng.uniform(xvals[0], xvals[-1], 50):
+            ystack += rng.uniform(0, 1, (n_spectra, 1)) * np.exp(-(xvals - centre) ** 2 / 2.)
+        data = np.column_stack((xvals, ystack[0]))
+        duplicates = np.column_stack((np.round(xvals), ystack[0]))
+
+        _compare("datacompsub", n_points, lambda: _compsub_background_loop(data[:, 1], buff),
+                 lambda: compsub_background(data[:, 1], buff))
+        _compare("calc_local_mins", n_points, lambda: _calc_local_mins_loop(data, width),
+                 lambda: calc_local_mins(data, width))
+        _compare("removeduplicates", n_points, lambda: _removeduplicates_loop(duplicates),
+                 lambda: removeduplicates(duplicates))
+        for subtype, name in [(0, "minimum"), (1, "datasimpsub"), (2, "datacompsub")]:
+            reference_funcs = {0: lambda y: y - np.amin(y),
+                               1: lambda y: datasimpsub(np.column_stack((xvals, y)), buff)[:, 1],
+                               2: lambda y: y - _compsub_background_loop(y, buff)}
+            _compare("background_subtract_batch ({}, {} spectra)".format(name, n_spectra), n_points,
+                     lambda: [reference_funcs[subtype](np.array(y)) for y in ystack],
+                     lambda: background_subtract_batch(xvals, ystack, subtype, buff))
+
+    return results
+
+
 def normalize(datatop):
     """
     Normalize the data so that the maximum intensity is 1.
@@ -1276,21 +1486,8 @@ def peakdetect(data, config=None, window=10, threshold=0):
     if config is not None:
         window = config.peakwindow / config.massbins
         threshold = config.peakthresh
-    peaks = []
-    length = len(data)
-    maxval = np.amax(data[:, 1])
-    for i in range(1, length):
-        if data[i, 1] > maxval * threshold:
-            start = i - window
-            end = i + window
-            if start < 0:
-                start = 0
-            if end > length:
-                end = length
-            testmax = np.amax(data[int(start):int(end) + 1, 1])
-            if data[i, 1] == testmax and data[i, 1] != data[i - 1, 1]:
-                peaks.append([data[i, 0], data[i, 1]])
-    return np.array(peaks)
+    peaks = find_peaks_maximum_filter(data[:, 0], data[:, 1], window, threshold)
+    return np.column_stack((peaks['mz'], peaks['intensity']))
 
 
 def mergepeaks(peaks1, peaks2, window):
@@ -1337,9 +1534,14 @@ def make_peaks_mztab(mzgrid, pks, adductmass, index=None):
     ylen = len(yvals)
     newgrid = np.reshape(mzgrid[:, 2], (xlen, ylen))
     plen = pks.plen
-    ftab = [interp1d(xvals, newgrid[:, k]) for k in xrange(0, ylen)]
-    mztab = [[makespecfun(i, k, pks.masses, adductmass, yvals, xvals, ftab, xmax, xmin) for k in xrange(0, ylen)] for i
-             in xrange(0, plen)]
+    # m/z of each peak (P) at each charge state (Z)
+    intx = np.true_divide(np.reshape(pks.masses, (-1, 1)) + adductmass * yvals, yvals)
+    inty = np.zeros_like(intx)
+    for k in xrange(0, ylen):
+        inside = np.logical_and(xmin < intx[:, k], intx[:, k] < xmax)
+        inty[inside, k] = np.interp(intx[inside, k], xvals, newgrid[:, k])
+    pos = nearest_vector(xvals, intx)
+    mztab = np.dstack([intx, inty, pos])
     if index is None:
         for i in xrange(0, plen):
             pks.peaks[i].mztab = np.array(mztab[i])
@@ -1391,12 +1593,13 @@ def make_peaks_mztab_spectrum(mzgrid, pks, data2, mztab, index=None):
     mztab2 = deepcopy(mztab)
 
     if index is None:
-        mztab2[:, :, 1] = [[data2[int(pks.peaks[i].mztab[k, 2]), 1] for k in range(0, zlen)] for i in range(0, plen)]
+        pos = np.array([pks.peaks[i].mztab[:zlen, 2] for i in xrange(0, plen)]).astype(np.int)
+        mztab2[:, :, 1] = data2[pos, 1]
         for i in xrange(0, plen):
             pks.peaks[i].mztab2 = np.array(mztab2[i])
     else:
-        mztab2[:, :, 1] = [[data2[int(pks.peaks[i].mztab[index][k, 2]), 1] for k in range(0, zlen)] for i in
-                           range(0, plen)]
+        pos = np.array([pks.peaks[i].mztab[index][:zlen, 2] for i in xrange(0, plen)]).astype(np.int)
+        mztab2[:, :, 1] = data2[pos, 1]
         for i in xrange(0, plen):
             pks.peaks[i].mztab2.append(np.array(mztab2[i]))
 
@@ -1421,10 +1624,15 @@ def makeconvspecies(processed_data, pks, config):
         kernel = conv_peak_shape_kernel(xvals, config.psfun, peakwidth)
         stickdat = [stickconv(p.mztab, kernel) for p in pks.peaks]
     else:
-        try:
-            stickdat = [cconvolve(xvals, p.mztab, config.mzsig, config.psfun) for p in pks.peaks]
-        except (OSError, TypeError, NameError, AttributeError):
-            stickdat = [nonlinstickconv(xvals, p.mztab, config.mzsig, config.psfun) for p in pks.peaks]
+        # convolve stick spectra of all peaks with the same banded kernel matrix (only columns
+        # of the non-zero sticks are needed)
+        positions = [np.array(p.mztab[:, 2]).astype(np.int) for p in pks.peaks]
+        columns = np.unique(np.concatenate(positions)) if pks.plen > 0 else np.array([], dtype=np.int)
+        operator = nonlinconv_operator(xvals, config.mzsig, config.psfun, columns=columns)
+        sticks = np.zeros((len(columns), pks.plen))
+        for i in xrange(0, pks.plen):
+            sticks[np.searchsorted(columns, positions[i]), i] = pks.peaks[i].mztab[:, 1]
+        stickdat = np.transpose(operator.dot(sticks))
 
     pks.composite = np.zeros(xlen)
     for i in xrange(0, pks.plen):
@@ -1434,26 +1642,56 @@ def makeconvspecies(processed_data, pks, config):
     return np.array(stickdat)
 
 
-def nonlinstickconv(xvals, mztab, fwhm, psfun):
+def nonlinconv_operator(xvals, fwhm, psfun, columns=None):
     """
-    Python-based Nonlinear convolution. First makes a stick spectrum. Then, convolved with peak shape kernel.
-    :param xvals: x-axis
-    :param mztab: mztab from make_peaks_mztab
+    Sparse band matrix of peak shape kernels for nonlinear convolution.
+    Element [i, k] is the weight of point xvals[columns[k]] in the convolved value at xvals[i]
+    (non-zero only within the peak shape window).
+    :param xvals: x-axis (sorted)
     :param fwhm: Full width half max
     :param psfun: Peak shape function integer
-    :return: Convolved output
+    :param columns: Indices of x-axis points to include as columns (default is all)
+    :return: Sparse (CSC) N x len(columns) matrix
     """
     if psfun == 0:
         window = 5 * fwhm
     else:
         window = 15 * fwhm
+    xvals = np.asarray(xvals, dtype=np.float64)
+    xlen = len(xvals)
+    if columns is None:
+        columns = np.arange(xlen)
+    columns = np.asarray(columns, dtype=np.int)
+    starts = np.searchsorted(xvals, xvals[columns] - window, side="right")
+    ends = np.searchsorted(xvals, xvals[columns] + window, side="left")
+    counts = np.maximum(ends - starts, 0)
+    cols = np.repeat(np.arange(len(columns)), counts)
+    rows = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts - starts, counts)
+    x, mid = -xvals[columns[cols]], -xvals[rows]
+    if psfun == 2:
+        values = np.where(x > mid, ldis(x, mid, fwhm), ndis_std(x, mid, fwhm / (2 * np.sqrt(2 * np.log(2)))))
+    else:
+        values = make_peak_shape(x, psfun, fwhm, mid)
+    return sparse.csc_matrix((values, (rows, cols)), shape=(xlen, len(columns)))
+
+
+def nonlinstickconv(xvals, mztab, fwhm, psfun, operator=None):
+    """
+    Python-based Nonlinear convolution. First makes a stick spectrum. Then, convolved with peak shape kernel.
+    :param xvals: x-axis
+    :param mztab: mztab from make_peaks_mztab
+    :param fwhm: Full width half max
+    :param psfun: Peak shape function integer
+    :param operator: Kernel matrix from nonlinconv_operator (optional)
+    :return: Convolved output
+    """
     xlen = len(xvals)
     stick = np.zeros(xlen)
     stick[np.array(mztab[:, 2]).astype(np.int)] = mztab[:, 1]
-    bool1 = [np.abs(xvals - xvals[i]) < window for i in xrange(0, xlen)]
-    kernels = np.array([make_peak_shape(-xvals[bool1[i]], psfun, fwhm, -xvals[i]) for i in xrange(0, xlen)])
-    output = np.array([np.sum(kernels[i] * stick[bool1[i]]) for i in xrange(0, xlen)])
-    return output
+    if operator is None:
+        columns = np.flatnonzero(stick)
+        return nonlinconv_operator(xvals, fwhm, psfun, columns=columns).dot(stick[columns])
+    return operator.dot(stick)
 
 
 def stickconv(mztab, kernel):
@@ -2093,30 +2331,37 @@ def peaks_error_FWHM(pks, data):
     :param data: self.data.massdat
     :return:
     """
-    pmax = np.amax([p.height for p in pks.peaks])
-    datamax = np.amax(np.asarray(data)[:, 1])
-    div = datamax / pmax
-    for pk in pks.peaks:
-        int = pk.height
-        index = nearest(data[:, 0], pk.mass)
-        leftwidth = 0
-        rightwidth = 0
-        counter = 1
-        leftfound = False
-        rightfound = False
-        while rightfound is False and leftfound is False:
-            if leftfound is False:
-                if data[index - counter, 1] <= (int * div) / 2:
-                    leftfound = True
-                else:
-                    leftwidth += 1
-            if rightfound is False:
-                if data[index + counter, 1] <= (int * div) / 2:
-                    rightfound = True
-                else:
-                    rightwidth += 1
-            counter += 1
-        pk.errorFWHM = data[index + rightwidth, 0] - data[index - leftwidth, 0]
+    data = np.asarray(data)
+    heights = np.array([p.height for p in pks.peaks])
+    div = np.amax(data[:, 1]) / np.amax(heights)
+    halfmax = np.reshape(heights * div / 2, (-1, 1))
+    index = np.reshape(nearest_vector(data[:, 0], [p.mass for p in pks.peaks]), (-1, 1))
+    npoints = len(data)
+
+    # Search until the half max is crossed on either side of the peak (the edge of the data
+    # counts as crossing), doubling the search window for peaks that have not crossed yet
+    window = 16
+    while True:
+        offsets = np.arange(1, window + 1)
+        left = index - offsets
+        right = index + offsets
+        leftmask = np.logical_or(left < 0, data[np.clip(left, 0, npoints - 1), 1] <= halfmax)
+        rightmask = np.logical_or(right >= npoints, data[np.clip(right, 0, npoints - 1), 1] <= halfmax)
+        if np.all(np.any(np.logical_or(leftmask, rightmask), axis=1)) or window >= npoints:
+            break
+        window *= 2
+
+    # number of steps to the first crossing on each side and on either side
+    leftcross = np.where(np.any(leftmask, axis=1), np.argmax(leftmask, axis=1) + 1, window + 1)
+    rightcross = np.where(np.any(rightmask, axis=1), np.argmax(rightmask, axis=1) + 1, window + 1)
+    crossing = np.minimum(leftcross, rightcross)
+    leftwidth = np.minimum(leftcross - 1, crossing)
+    rightwidth = np.minimum(rightcross - 1, crossing)
+
+    index = np.ravel(index)
+    errors = data[np.minimum(index + rightwidth, npoints - 1), 0] - data[np.maximum(index - leftwidth, 0), 0]
+    for i, pk in enumerate(pks.peaks):
+        pk.errorFWHM = errors[i]
 
 
 def peaks_error_mean(pks, data, ztab, massdat, config):
@@ -2130,45 +2375,35 @@ def peaks_error_mean(pks, data, ztab, massdat, config):
     :param config: self.config
     :return:
     """
-    length = len(data) / len(ztab)
-    for pk in pks.peaks:
-        index = nearest(massdat[:, 0], pk.mass)
-        masses = []
-        ints = []
-        zgrid = []
-        startindmass = nearest(massdat[:, 0], massdat[index, 0] - config.peakwindow)
-        endindmass = nearest(massdat[:, 0], massdat[index, 0] + config.peakwindow)
-        # plotmasses = massdat[startindmass:endindmass, 0]
-        for z in range(0, len(ztab)):
-            startind = startindmass + (z * length)
-            endind = endindmass + (z * length)
-            tmparr = data[startind:endind]
-            ind = np.argmax(tmparr)
-            ints.append(tmparr[ind])
-            # print massdat[startindmass + ind, 0]
-            masses.append(massdat[startindmass + ind, 0])
-            # zgrid.extend(tmparr)
-        mean = np.average(masses, weights=ints)
-        # Calculate weighted standard deviation
-        sum = 0
-        denom = 0
-        for w, m in enumerate(masses):
-            sum += ints[w] * pow(m - mean, 2)
-            denom += ints[w]
-        denom *= (len(ztab) - 1)
-        std = sum / denom
-        std = std / len(ztab)
-        std = std ** 0.5
-        # print mean
-        # print std
-        # tab = wx.Frame(None, title="Test", size=(500, 500))
-        # plot = plot2d.Plot2d(tab, figsize=(500, 500))
-        # plot.contourplot(xvals=np.asarray(plotmasses), yvals=ztab, zgrid=np.asarray(zgrid),
-        #                 config=config, title="Mass vs. Charge", xlab="Mass (Da)",
-        #                 normflag=1, test_kda=False, repaint=False)
-        # tab.Show()
-        pk.errormean = std
-        # pks.peaks[count].errormean = abs(sums[count] - pks.peaks[count].mass)
+    zlen = len(ztab)
+    length = len(data) // zlen
+    grid = np.reshape(np.asarray(data)[:zlen * length], (zlen, length))
+    index = nearest_vector(massdat[:, 0], [pk.mass for pk in pks.peaks])
+    startindmass = nearest_vector(massdat[:, 0], massdat[index, 0] - config.peakwindow)
+    endindmass = nearest_vector(massdat[:, 0], massdat[index, 0] + config.peakwindow)
+    if np.any(endindmass <= startindmass):
+        raise ValueError("attempt to get argmax of an empty sequence")
+
+    # local max of each peak (P) at each charge state (Z) within the peak window (W)
+    offsets = np.arange(0, np.amax(endindmass - startindmass))
+    window = np.reshape(startindmass, (-1, 1)) + offsets
+    inside = window < np.reshape(endindmass, (-1, 1))
+    tmparr = np.where(inside, grid[:, np.minimum(window, length - 1)], -np.inf)
+    ind = np.argmax(tmparr, axis=2)
+    zind, pind = np.indices(ind.shape)
+    ints = tmparr[zind, pind, ind]
+    masses = massdat[startindmass + ind, 0]
+
+    # Calculate weighted mean and weighted standard deviation
+    denom = np.sum(ints, axis=0)
+    if np.any(denom == 0):
+        raise ZeroDivisionError("Weights sum to zero, can't be normalized")
+    mean = np.sum(ints * masses, axis=0) / denom
+    std = np.sum(ints * (masses - mean) ** 2, axis=0) / (denom * (zlen - 1))
+    std = std / zlen
+    std = std ** 0.5
+    for i, pk in enumerate(pks.peaks):
+        pk.errormean = std[i]
 
 
 if __name__ == "__main__":